@@ -1,6 +1,5 @@
 import streamlit as st
 from auth import login_teacher, register_teacher
-import database as db
 
 
 
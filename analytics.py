@@ -0,0 +1,149 @@
+import argparse
+import sqlite3
+from typing import Dict, Any, Optional
+import database as db
+from utils import load_questions
+
+# Per-exam score summaries, kept up to date as submissions are graded:
+# - exam_analytics: number of graded submissions and the sums of their total and maximum scores,
+# - exam_question_scores: how many answers to each question got each score (0-10).
+# Page views read these small tables instead of every submission. NumPy and pandas are only
+# loaded to compute statistics, not when submissions record their grades.
+SCORES = range(11)
+# Score from which an answer counts as correct, like `correct` in the evaluations
+CORRECT_SCORE = 8
+
+def _bucket(score: Any) -> int:
+    """Clamp a score to the 0-10 histogram buckets."""
+    return int(min(10, max(0, round(float(score)))))
+
+def record_submission(cursor: sqlite3.Cursor, teacher_id: str, exam_id: int, evaluations: Dict[str, Dict[str, Any]],
+                      total_score: int, max_score: int, sign: int = 1):
+    """
+    Add a graded submission to its exam's summary, inside the caller's transaction.
+
+    Pass sign=-1 to take out a submission's previous grades before it is graded again.
+    """
+    cursor.execute('''
+    INSERT INTO exam_analytics (teacher_id, exam_id, submissions, score_sum, max_score_sum) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (teacher_id, exam_id) DO UPDATE SET
+        submissions = submissions + excluded.submissions,
+        score_sum = score_sum + excluded.score_sum,
+        max_score_sum = max_score_sum + excluded.max_score_sum
+    ''', (teacher_id, exam_id, sign, sign * total_score, sign * max_score))
+    cursor.executemany('''
+    INSERT INTO exam_question_scores (teacher_id, exam_id, question_text, score, answers) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (teacher_id, exam_id, question_text, score) DO UPDATE SET answers = answers + excluded.answers
+    ''', [(teacher_id, exam_id, q_text, _bucket(evaluation['score']), sign)
+          for q_text, evaluation in evaluations.items() if evaluation and evaluation.get('score') is not None])
+
+def recompute(teacher_id: str, exam_id: int) -> bool:
+    """
+    Rebuild an exam's summary from its stored grades, e.g. after importing or repairing data.
+
+    All graded answers are counted per question and score in one vectorized pass.
+    """
+    import pandas as pd
+    try:
+        with db.db_connection() as conn:
+            totals = pd.read_sql_query('''
+            SELECT total_score, max_score FROM submissions WHERE teacher_id = ? AND exam_id = ? AND status = 'graded'
+            ''', conn, params=(teacher_id, exam_id))
+            scores = pd.read_sql_query('''
+            SELECT a.question_text, a.score FROM submission_answers a JOIN submissions s ON s.id = a.submission_id
+            WHERE s.teacher_id = ? AND s.exam_id = ? AND s.status = 'graded' AND a.score IS NOT NULL
+            ''', conn, params=(teacher_id, exam_id))
+            scores['score'] = scores['score'].astype('float64').round().clip(0, 10).astype('int64')
+            counts = scores.groupby(['question_text', 'score']).size()
+
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM exam_analytics WHERE teacher_id = ? AND exam_id = ?', (teacher_id, exam_id))
+            cursor.execute('DELETE FROM exam_question_scores WHERE teacher_id = ? AND exam_id = ?', (teacher_id, exam_id))
+            cursor.execute('''
+            INSERT INTO exam_analytics (teacher_id, exam_id, submissions, score_sum, max_score_sum) VALUES (?, ?, ?, ?, ?)
+            ''', (teacher_id, exam_id, len(totals), int(totals['total_score'].sum()), int(totals['max_score'].sum())))
+            cursor.executemany('''
+            INSERT INTO exam_question_scores (teacher_id, exam_id, question_text, score, answers) VALUES (?, ?, ?, ?, ?)
+            ''', [(teacher_id, exam_id, q_text, int(score), int(count)) for (q_text, score), count in counts.items()])
+            conn.commit()
+            return True
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return False
+
+def exam_summary(teacher_id: str, exam_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Compute an exam's statistics from its summary tables.
+
+    Returns:
+        Optional[Dict[str, Any]]: None if the summary can't be read, else a dict with
+        - `submissions` and `average_score` (mean total score) and `max_score`,
+        - `questions`: per question its topic, answers, mean, standard deviation, median and
+          share of correct answers, hardest (lowest mean) first,
+        - `distribution`: answers per question (rows) and score 0-10 (columns),
+        - `topics`: answers and mean score per topic ("Question Number").
+    """
+    import numpy as np
+    import pandas as pd
+    try:
+        with db.db_connection() as conn:
+            header = conn.execute('''
+            SELECT submissions, score_sum, max_score_sum FROM exam_analytics WHERE teacher_id = ? AND exam_id = ?
+            ''', (teacher_id, exam_id)).fetchone()
+            counts = pd.read_sql_query('''
+            SELECT question_text, score, answers FROM exam_question_scores
+            WHERE teacher_id = ? AND exam_id = ? AND answers > 0
+            ''', conn, params=(teacher_id, exam_id))
+    except sqlite3.Error:
+        return None
+
+    submissions = header['submissions'] if header else 0
+    scores = np.array(SCORES)
+    # Questions (rows) x scores 0-10 (columns) matrix of answer counts
+    distribution = (counts.pivot_table(index='question_text', columns='score', values='answers', aggfunc='sum')
+                    .reindex(columns=scores, fill_value=0).fillna(0).astype('int64'))
+    matrix = distribution.to_numpy()
+    answers = matrix.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = matrix @ scores / answers
+        std = np.sqrt(np.maximum(matrix @ scores ** 2 / answers - mean ** 2, 0))
+        correct = matrix[:, scores >= CORRECT_SCORE].sum(axis=1) / answers
+    # Median: first score where the cumulative count reaches half of the answers
+    median = (np.cumsum(matrix, axis=1) >= (answers[:, None] + 1) / 2).argmax(axis=1) if len(matrix) else np.array([])
+
+    questions_data = load_questions(teacher_id, exam_id)
+    topics = [questions_data.get(q_text, {}).get("Question Number", "General") for q_text in distribution.index]
+    questions = pd.DataFrame({
+        "question": distribution.index,
+        "topic": topics,
+        "answers": answers,
+        "mean": mean,
+        "std": std,
+        "median": median,
+        "correct_rate": correct
+    }).sort_values("mean", kind="stable").reset_index(drop=True)
+
+    # Topic means weighted by each question's number of answers
+    weighted = questions.assign(score_sum=questions["mean"] * questions["answers"])
+    topic_stats = weighted.groupby("topic", sort=False)[["answers", "score_sum"]].sum()
+    topic_stats["mean"] = topic_stats["score_sum"] / topic_stats["answers"]
+
+    return {
+        "submissions": submissions,
+        "average_score": header['score_sum'] / submissions if submissions else 0.0,
+        "max_score": header['max_score_sum'] / submissions if submissions else 0.0,
+        "questions": questions,
+        "distribution": distribution.rename_axis(index="question", columns="score"),
+        "topics": topic_stats[["answers", "mean"]].reset_index()
+    }
+
+# Usage: python analytics.py TEACHER_ID EXAM_ID - rebuilds the exam's summary from its stored grades
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute an exam's analytics from its stored grades.")
+    parser.add_argument("teacher", help="Teacher ID")
+    parser.add_argument("exam", type=int, help="Exam ID")
+    args = parser.parse_args()
+
+    if recompute(args.teacher, args.exam):
+        summary = exam_summary(args.teacher, args.exam)
+        print(f"Recomputed analytics of {summary['submissions']} submission(s).")
@@ -0,0 +1,49 @@
+import streamlit as st
+import analytics
+
+def display_analytics(teacher_id: str, selected_exam_id: int, exams: dict):
+    # Display the exam title as a subheader
+    st.subheader(f"Analytics for {exams[selected_exam_id]}")
+
+    # Read the exam's precomputed summary instead of every submission
+    summary = analytics.exam_summary(teacher_id, selected_exam_id)
+    if summary is None:
+        st.error("Failed to load analytics! ⚠️")
+        return
+    if summary["submissions"] == 0:
+        st.write("No graded submissions yet.")
+        return
+
+    # Headline numbers
+    col1, col2 = st.columns(2)
+    col1.metric("Graded submissions", summary["submissions"])
+    col2.metric("Average score", f"{summary['average_score']:.1f} / {summary['max_score']:.0f}")
+
+    # Per-question statistics, hardest question first
+    st.write("### Questions (hardest first)")
+    st.dataframe(
+        summary["questions"],
+        column_config={
+            "mean": st.column_config.NumberColumn("Mean", format="%.1f"),
+            "std": st.column_config.NumberColumn("Std. dev.", format="%.1f"),
+            "median": st.column_config.NumberColumn("Median"),
+            "correct_rate": st.column_config.NumberColumn("Correct", format="percent")
+        },
+        hide_index=True
+    )
+
+    # Score distribution of one question at a time
+    st.write("### Score distribution")
+    question = st.selectbox("Question:", list(summary["distribution"].index), key=f"analytics_question_{selected_exam_id}")
+    st.bar_chart(summary["distribution"].loc[question].rename("answers"), x_label="Score", y_label="Answers")
+
+    # Average score per topic, like the student page's topic breakdown
+    st.write("### Topics")
+    st.bar_chart(summary["topics"].set_index("topic")["mean"], x_label="Topic", y_label="Mean score")
+
+    # Rebuild the summary from the stored grades, e.g. after data was changed by hand
+    if st.button("Recompute analytics 🔄", key=f"analytics_recompute_{selected_exam_id}"):
+        if analytics.recompute(teacher_id, selected_exam_id):
+            st.rerun()
+        else:
+            st.error("Failed to recompute analytics! ⚠️")
@@ -0,0 +1,14 @@
+import argparse
+from utils import backfill_subjects
+
+# Command line job that classifies the subject of questions created before
+# subjects were stored with each question.
+# Usage: python backfill_subjects.py [--teacher TEACHER_ID] [--exam EXAM_ID]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect and store subjects for existing short answer questions.")
+    parser.add_argument("--teacher", help="Only backfill questions of this teacher")
+    parser.add_argument("--exam", type=int, help="Only backfill questions of this exam")
+    args = parser.parse_args()
+
+    count = backfill_subjects(args.teacher, args.exam)
+    print(f"Classified {count} question(s).")
@@ -0,0 +1,91 @@
+import argparse
+import json
+import time
+from typing import Callable, Dict, Any
+import bench_utils
+
+# Benchmark of the SQLite layer: lookup time of an exam's submissions and questions
+# against table size, with and without the exam index, and the cost of opening a
+# connection per call versus reusing the thread's connection.
+# Usage: python benchmarks/bench_db.py [--sizes 1000 10000 100000]
+
+bench_utils.use_temp_workdir()
+
+import database as db
+import utils
+import submission_manager
+
+EXAMS = 100
+
+def fill(total_submissions: int):
+    """Grow the tables to `total_submissions` submissions of 10 answers spread over EXAMS exams."""
+    with db.db_connection() as conn:
+        current = conn.execute('SELECT COUNT(*) FROM submissions').fetchone()[0]
+        if current == 0:
+            conn.executemany('''
+            INSERT INTO questions (teacher_id, exam_id, question_text, question_type, question_number, reference, subject)
+            VALUES (?, ?, ?, 'Short Answer', '1', 'Reference', 'Science')
+            ''', [("teacher", exam, f"Q{i}") for exam in range(EXAMS) for i in range(10)])
+        for index in range(current, total_submissions):
+            cursor = conn.execute('''
+            INSERT INTO submissions (teacher_id, exam_id, student_name, submission_data, total_score, max_score)
+            VALUES (?, ?, ?, '{}', 50, 100)
+            ''', ("teacher", index % EXAMS, f"Student {index}"))
+            conn.executemany('''
+            INSERT INTO submission_answers (submission_id, question_text, position, answer, score, correct, feedback)
+            VALUES (?, ?, ?, ?, 5, 0, 'Feedback')
+            ''', [(cursor.lastrowid, f"Q{i}", i, json.dumps("An answer")) for i in range(10)])
+        conn.commit()
+
+def time_call(func: Callable[[], Any], iterations: int) -> float:
+    """Average milliseconds per call."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1000
+
+def measure(size: int, iterations: int) -> Dict[str, Any]:
+    """Time the lookups at the current table size, with and without the submissions index."""
+    indexed = time_call(lambda: submission_manager.load_submissions("teacher", 7), iterations)
+    with db.db_connection() as conn:
+        conn.execute('DROP INDEX idx_submissions_exam')
+        conn.commit()
+    scanned = time_call(lambda: submission_manager.load_submissions("teacher", 7), iterations)
+    with db.db_connection() as conn:
+        conn.execute('CREATE INDEX idx_submissions_exam ON submissions (teacher_id, exam_id)')
+        conn.commit()
+    return {
+        "submissions": size,
+        "load_subs_indexed_ms": indexed,
+        "load_subs_scan_ms": scanned,
+        "load_questions_ms": time_call(lambda: utils.load_questions("teacher", 7), iterations),
+        "score_list_ms": time_call(lambda: submission_manager.load_score_list("teacher", 7), iterations),
+    }
+
+def connection_overhead(iterations: int) -> Dict[str, float]:
+    """Compare opening a tuned connection per call with reusing the thread's connection."""
+    def per_call():
+        conn = db._connect()
+        conn.execute('SELECT 1').fetchone()
+        conn.close()
+
+    def reused():
+        with db.db_connection() as conn:
+            conn.execute('SELECT 1').fetchone()
+
+    return {"connect_per_call_ms": time_call(per_call, iterations), "reused_connection_ms": time_call(reused, iterations)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark SQLite lookups against table size.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Total submissions")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    db.init_db()
+    rows = []
+    for size in sorted(args.sizes):
+        fill(size)
+        rows.append(measure(size, args.iterations))
+    bench_utils.print_table(rows)
+    print()
+    bench_utils.print_table([connection_overhead(args.iterations * 10)])
@@ -0,0 +1,92 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any
+import bench_utils
+
+# End-to-end benchmark of the submit flow of pages/Student.py (grade every answer,
+# then save the submission) against the local fake LLM endpoint. Runs fully offline.
+# Usage: python benchmarks/bench_grading.py [--concurrency 1 10 100] [--exam-sizes 5 20]
+
+bench_utils.use_temp_workdir()
+# Every answer must reach the endpoint, otherwise the cache hides the grading cost
+os.environ.setdefault("GRADING_CACHE_MAX_ENTRIES", "0")
+# Measure the grading path itself, not the shared rate limit
+os.environ.setdefault("LLM_RPM_LIMIT", "0")
+os.environ.setdefault("LLM_TPM_LIMIT", "0")
+
+import llm_client
+import grading
+import pre_grader
+import submission_writer
+from fake_llm import FakeLLMServer
+
+def make_exam(size: int) -> Dict[str, Dict[str, Any]]:
+    """Build an exam where every fourth question is multiple choice."""
+    questions = {}
+    for index in range(size):
+        if index % 4 == 3:
+            questions[f"Question {index}: pick the gases"] = {
+                "type": "Multiple Choice", "Question Number": str(index),
+                "options": ["Oxygen", "Iron", "Helium"], "correct": ["Oxygen", "Helium"]
+            }
+        else:
+            questions[f"Question {index}: explain photosynthesis"] = {
+                "type": "Short Answer", "Question Number": str(index), "subject": "Science",
+                "reference": "Plants turn light, water and carbon dioxide into glucose and oxygen."
+            }
+    return questions
+
+def submit(questions: Dict[str, Dict[str, Any]], student: int) -> float:
+    """Grade and save one submission like the student page does; returns its latency in seconds."""
+    answers = {
+        q_text: ["Oxygen"] if q_data["type"] == "Multiple Choice" else f"Student {student} says plants make food from light."
+        for q_text, q_data in questions.items()
+    }
+    start = time.perf_counter()
+    result = grading.grade_submission(questions, answers)
+    submission_writer.submit("bench_teacher", 1, {
+        "student_name": f"Student {student}",
+        "answers": answers,
+        "evaluations": result["evaluations"],
+        "total_score": result["total_score"],
+        "max_score": result["max_score"]
+    })
+    return time.perf_counter() - start
+
+def run_scenario(concurrency: int, exam_size: int, submissions: int) -> Dict[str, Any]:
+    """Submit `submissions` exams with `concurrency` students submitting at once."""
+    questions = make_exam(exam_size)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(lambda student: submit(questions, student), range(submissions)))
+    elapsed = time.perf_counter() - start
+    stats = bench_utils.summarize(latencies, elapsed)
+    return {"concurrency": concurrency, "questions": exam_size, "submissions": stats["count"],
+            "subs_per_s": stats["throughput"], "p50_ms": stats["p50_ms"], "p95_ms": stats["p95_ms"], "p99_ms": stats["p99_ms"]}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the grading path against a fake LLM endpoint.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100], help="Concurrent submissions")
+    parser.add_argument("--exam-sizes", type=int, nargs="+", default=[5, 20], help="Questions per exam")
+    parser.add_argument("--rounds", type=int, default=2, help="Submissions per concurrent student")
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=0.2, help="Mean LLM response time in seconds")
+    parser.add_argument("--latency-spread", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with FakeLLMServer(args.latency, args.latency_mean, args.latency_spread, args.error_rate,
+                       args.rate_limit_rate, seed=args.seed) as server:
+        llm_client.configure(endpoint=server.url, api_key="fake")
+        rows = [
+            run_scenario(concurrency, exam_size, concurrency * args.rounds)
+            for exam_size in args.exam_sizes
+            for concurrency in args.concurrency
+        ]
+        bench_utils.print_table(rows)
+        print(f"\nFake endpoint: {server.stats}")
+        print(f"Pre-grader: {pre_grader.pre_grade_stats()}")
@@ -0,0 +1,80 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import bench_utils
+
+# Startup benchmark of the Streamlit pages: time to import streamlit, then to import and run
+# each page script once (its module imports plus the first render), in a fresh interpreter
+# per run so nothing is cached in sys.modules. Also lists the heavy libraries each page loaded.
+# Usage: python benchmarks/bench_startup.py [--runs 5]
+
+bench_utils.use_temp_workdir()
+
+import database as db
+import exam_manager
+import utils
+
+HEAVY_MODULES = ("openai", "pandas", "numpy", "pyarrow")
+
+# Page, session state and query parameters of each scenario
+SCENARIOS = [
+    ("Home.py", {}, {}),
+    ("pages/Teacher.py", {}, {}),
+    ("pages/Teacher.py", {"logged_in": True, "teacher_id": "teacher"}, {}),
+    ("pages/Student.py", {}, {"teacher_id": "teacher", "exam_id": "1"}),
+]
+
+# Runs in the child interpreter: prints the import and first run times as JSON
+CHILD = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+app = AppTest.from_file({page!r}, default_timeout=60)
+for key, value in {state!r}.items():
+    app.session_state[key] = value
+for key, value in {params!r}.items():
+    app.query_params[key] = value
+app.run()
+done = time.perf_counter()
+print(json.dumps({{"streamlit_ms": (imported - start) * 1000, "page_ms": (done - imported) * 1000,
+                   "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+def seed():
+    """Create the schema and one exam, so the pages render with data."""
+    db.init_db()
+    exam_id = exam_manager.save_exam("teacher", "Startup")
+    utils.upsert_questions("teacher", exam_id, {
+        "Explain photosynthesis.": {"type": "Short Answer", "Question Number": "1", "subject": "Science",
+                                    "reference": "Plants turn light, water and carbon dioxide into glucose and oxygen."},
+        "Pick the gases.": {"type": "Multiple Choice", "Question Number": "2",
+                            "options": ["Oxygen", "Iron", "Helium"], "correct": ["Oxygen", "Helium"]}
+    })
+
+def measure(page: str, state: dict, params: dict, runs: int) -> dict:
+    """Median times of `runs` cold starts of one page."""
+    script = CHILD.format(root=bench_utils.ROOT, page=os.path.join(bench_utils.ROOT, page), state=state,
+                          params=params, heavy=HEAVY_MODULES)
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "page": page + (" (logged in)" if state else ""),
+        "streamlit_ms": statistics.median(result["streamlit_ms"] for result in results),
+        "page_ms": statistics.median(result["page_ms"] for result in results),
+        "heavy_imports": ",".join(results[-1]["heavy"]) or "-",
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the cold start of the Streamlit pages.")
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts per page")
+    args = parser.parse_args()
+
+    seed()
+    bench_utils.print_table([measure(page, state, params, args.runs) for page, state, params in SCENARIOS])
@@ -0,0 +1,72 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any
+import bench_utils
+
+# Load test of saving submissions: many students submitting at once, each save either in its
+# own transaction (submission_manager.save_submission) or group-committed by the writer thread
+# (submission_writer.submit). Grading is left out, so this measures the write path alone.
+# Usage: python benchmarks/bench_submit.py [--concurrency 100 300 500] [--db-timeout 2]
+
+bench_utils.use_temp_workdir()
+
+parser = argparse.ArgumentParser(description="Load test concurrent submission saves.")
+parser.add_argument("--concurrency", type=int, nargs="+", default=[100, 300, 500], help="Concurrent submits")
+parser.add_argument("--rounds", type=int, default=2, help="Submissions per concurrent student")
+parser.add_argument("--questions", type=int, default=10, help="Answers per submission")
+parser.add_argument("--db-timeout", type=float, default=None, help="SQLite busy timeout (seconds), DB_TIMEOUT by default")
+args = parser.parse_args()
+if args.db_timeout is not None:
+    os.environ["DB_TIMEOUT"] = str(args.db_timeout)
+
+import database as db
+import exam_manager
+import utils
+import submission_manager
+import submission_writer
+
+def seed(questions: int) -> int:
+    """Create an exam with short answer questions; returns its ID."""
+    db.init_db()
+    exam_id = exam_manager.save_exam("bench_teacher", "Load test")
+    utils.upsert_questions("bench_teacher", exam_id, {
+        f"Question {index}": {"type": "Short Answer", "Question Number": str(index), "subject": "Science",
+                              "reference": "Plants turn light, water and carbon dioxide into glucose and oxygen."}
+        for index in range(questions)
+    })
+    return exam_id
+
+def run(mode: str, save: Callable, exam_id: int, concurrency: int, submissions: int, questions: int) -> Dict[str, Any]:
+    """Save `submissions` graded submissions with `concurrency` students saving at once."""
+    def one(student: int):
+        submission = {
+            "student_name": f"Student {student}",
+            "answers": {f"Question {index}": f"Student {student} says plants make food from light." for index in range(questions)},
+            "evaluations": {f"Question {index}": {"correct": False, "score": 6, "feedback": "Partly right."} for index in range(questions)},
+            "total_score": 6 * questions,
+            "max_score": 10 * questions
+        }
+        start = time.perf_counter()
+        submission_id = save("bench_teacher", exam_id, submission)
+        return time.perf_counter() - start, submission_id is not None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(submissions)))
+    elapsed = time.perf_counter() - start
+    stats = bench_utils.summarize([latency for latency, _ in results], elapsed)
+    return {"mode": mode, "concurrency": concurrency, "submissions": stats["count"],
+            "failed": sum(1 for _, saved in results if not saved), "subs_per_s": stats["throughput"],
+            "p50_ms": stats["p50_ms"], "p95_ms": stats["p95_ms"], "p99_ms": stats["p99_ms"]}
+
+if __name__ == "__main__":
+    exam_id = seed(args.questions)
+    rows = []
+    for concurrency in args.concurrency:
+        for mode, save in (("per-submit", submission_manager.save_submission), ("group", submission_writer.submit)):
+            rows.append(run(mode, save, exam_id, concurrency, concurrency * args.rounds, args.questions))
+    bench_utils.print_table(rows)
+    print(f"\nWriter: {submission_writer.writer_stats()}")
+    print(f"Stored submissions: {len(submission_manager.load_score_list('bench_teacher', exam_id))}")
@@ -0,0 +1,47 @@
+import math
+import os
+import sys
+import tempfile
+from typing import Dict, List
+
+# Shared helpers of the benchmark scripts.
+
+# Make the application modules importable when running `python benchmarks/<script>.py`
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+def use_temp_workdir() -> str:
+    """Run in a throwaway directory so benchmarks never touch the real data/ databases."""
+    workdir = tempfile.mkdtemp(prefix="eshraq_bench_")
+    os.chdir(workdir)
+    return workdir
+
+def percentile(values: List[float], pct: float) -> float:
+    """Return the pct-th percentile (0-100) of values using nearest-rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    """Throughput and latency percentiles (in milliseconds) of a benchmark run."""
+    return {
+        "count": len(latencies),
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+def print_table(rows: List[Dict[str, object]]):
+    """Print rows of equal keys as an aligned text table."""
+    if not rows:
+        return
+    columns = list(rows[0])
+    cells = [[f"{row[col]:.2f}" if isinstance(row[col], float) else str(row[col]) for col in columns] for row in rows]
+    widths = [max(len(col), *(len(cell[i]) for cell in cells)) for i, col in enumerate(columns)]
+    print("  ".join(col.rjust(width) for col, width in zip(columns, widths)))
+    for cell in cells:
+        print("  ".join(value.rjust(width) for value, width in zip(cell, widths)))
@@ -0,0 +1,349 @@
+import argparse
+import contextvars
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Union
+import pandas as pd
+import database as db
+import metrics
+import rate_limiter
+import submission_manager
+from evaluation import evaluate_answer
+from grading import GRADING_MAX_WORKERS, grade_multiple_choice, summarize_grades
+from utils import load_questions
+
+# Offline grading of transcribed answer sheets. A sheet is stored once in bulk_import_answers,
+# then graded concurrently; finished grades are written back every BULK_CHECKPOINT_SIZE answers,
+# so a run that stops halfway resumes with the answers that are not graded yet.
+BULK_CHECKPOINT_SIZE = int(os.getenv("BULK_CHECKPOINT_SIZE", "50"))
+IMPORT_FORMATS = ("csv", "jsonl")
+REQUIRED_COLUMNS = ["student", "question", "answer"]
+
+# Imports being graded on background threads of this process
+_running = set()
+_running_lock = threading.Lock()
+
+def _is_blank(answer: Any) -> bool:
+    """Whether a sheet cell is empty: a missing JSONL value or a NaN that pandas filled in."""
+    # pd.isna only on floats: on a list it returns an array, which has no truth value
+    return answer is None or (isinstance(answer, float) and pd.isna(answer))
+
+def _parse_answer(answer: Any, q_data: Dict[str, Any]) -> Any:
+    """
+    Convert a sheet cell to the answer format of its question's type.
+
+    Raises:
+        ValueError: If a short answer is not text (e.g. a JSON list or object).
+    """
+    if q_data.get("type") == "Multiple Choice":
+        # Selected options as a JSON list, or separated by semicolons
+        if not isinstance(answer, list):
+            answer = [] if _is_blank(answer) else str(answer).split(";")
+        return [str(option).strip() for option in answer if str(option).strip()]
+    if _is_blank(answer):
+        return ""
+    if not isinstance(answer, str):
+        raise ValueError(f"expected a text answer, got {type(answer).__name__}")
+    return answer
+
+def read_answer_sheet(source: Union[str, BinaryIO], fmt: str, questions: Dict[str, Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Read an answer sheet with one (student, question, answer) row per answer.
+
+    Args:
+        source (Union[str, BinaryIO]): A file path or binary file object.
+        fmt (str): "csv" or "jsonl".
+        questions (Dict[str, Dict[str, Any]]): The exam's questions, to check and convert the answers.
+
+    Returns:
+        pd.DataFrame: The `student`, `question` and `answer` columns; a later row for the same
+        student and question replaces an earlier one.
+
+    Raises:
+        ValueError: If the file can't be parsed, a column is missing, a question is not in the exam
+        or an answer doesn't fit its question's type.
+    """
+    if fmt == "csv":
+        sheet = pd.read_csv(source, dtype=str, keep_default_na=False)
+    else:
+        sheet = pd.read_json(source, lines=True, dtype=False)
+    missing = [column for column in REQUIRED_COLUMNS if column not in sheet.columns]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+
+    sheet = sheet[REQUIRED_COLUMNS].copy()
+    sheet["student"] = sheet["student"].astype(str).str.strip()
+    sheet["question"] = sheet["question"].astype(str).str.strip()
+    sheet = sheet[sheet["student"] != ""]
+    unknown = sorted(set(sheet["question"]) - set(questions))
+    if unknown:
+        raise ValueError(f"Question(s) not in this exam: {', '.join(unknown)}")
+    sheet = sheet.drop_duplicates(["student", "question"], keep="last")
+    answers, invalid = [], []
+    for row, q_text, answer in zip(sheet.index, sheet["question"], sheet["answer"]):
+        try:
+            answers.append(_parse_answer(answer, questions[q_text]))
+        except ValueError as e:
+            invalid.append(f"row {row + 1} ({q_text}): {e}")
+    if invalid:
+        raise ValueError(f"Invalid answer(s): {'; '.join(invalid)}")
+    sheet["answer"] = answers
+    return sheet.reset_index(drop=True)
+
+def create_import(teacher_id: str, exam_id: int, sheet: pd.DataFrame, source: Optional[str] = None) -> Optional[int]:
+    """
+    Store an answer sheet for grading and return its import ID, or None on a database error.
+
+    Importing the same sheet for the same exam again returns the existing import, so an
+    interrupted run resumes instead of starting over.
+    """
+    rows = [(student, q_text, json.dumps(answer, ensure_ascii=False)) for student, q_text, answer in sheet.itertuples(index=False)]
+    digest = hashlib.sha256(json.dumps(rows, ensure_ascii=False).encode("utf-8")).hexdigest()
+    positions = {q_text: position for position, q_text in enumerate(load_questions(teacher_id, exam_id))}
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM bulk_imports WHERE teacher_id = ? AND exam_id = ? AND digest = ?', (teacher_id, exam_id, digest))
+            existing = cursor.fetchone()
+            if existing:
+                return existing['id']
+            cursor.execute('''
+            INSERT INTO bulk_imports (teacher_id, exam_id, source, digest, created_at) VALUES (?, ?, ?, ?, ?)
+            ''', (teacher_id, exam_id, source, digest, time.time()))
+            import_id = cursor.lastrowid
+            cursor.executemany('''
+            INSERT INTO bulk_import_answers (import_id, student_name, question_text, position, answer) VALUES (?, ?, ?, ?, ?)
+            ''', [(import_id, student, q_text, positions.get(q_text, len(positions)), answer) for student, q_text, answer in rows])
+            conn.commit()
+            return import_id
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return None
+
+def list_imports(teacher_id: str, exam_id: int) -> List[Dict[str, Any]]:
+    """Return an exam's imports, newest first."""
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT id, source, status, created_at FROM bulk_imports WHERE teacher_id = ? AND exam_id = ? ORDER BY id DESC
+            ''', (teacher_id, exam_id))
+            return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error:
+        return []
+
+def import_progress(import_id: int) -> Dict[str, int]:
+    """Return the number of answers and students of an import, how many answers are graded and how many submissions are saved."""
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT COUNT(*) AS answers, COUNT(result) AS graded, COUNT(DISTINCT student_name) AS students,
+                   COUNT(DISTINCT CASE WHEN submission_id IS NOT NULL THEN student_name END) AS saved
+            FROM bulk_import_answers WHERE import_id = ?
+            ''', (import_id,))
+            return dict(cursor.fetchone())
+    except sqlite3.Error:
+        return {"answers": 0, "graded": 0, "students": 0, "saved": 0}
+
+def _grade(q_text: str, q_data: Optional[Dict[str, Any]], answer: Any) -> Dict[str, Any]:
+    """Grade one imported answer like the student page does."""
+    if q_data is None:
+        return {"correct": False, "score": 0, "feedback": "Question removed from the exam", "error": True}
+    try:
+        if q_data.get("type") == "Multiple Choice":
+            return grade_multiple_choice(answer, q_data["correct"])
+        return evaluate_answer(q_text, answer, q_data["reference"], q_data.get("subject"))
+    except Exception as e:
+        print(f"Evaluation error: {e}")
+        return {"correct": False, "score": 0, "feedback": "Error in evaluation", "error": True}
+
+def _checkpoint(import_id: int, grades: List[tuple]):
+    """Store finished grades, given as (student, question, result) tuples."""
+    if not grades:
+        return
+    try:
+        with db.db_connection() as conn:
+            conn.executemany('''
+            UPDATE bulk_import_answers SET result = ? WHERE import_id = ? AND student_name = ? AND question_text = ?
+            ''', [(json.dumps(result, ensure_ascii=False), import_id, student, q_text) for student, q_text, result in grades])
+            conn.commit()
+    except sqlite3.Error as e:
+        # Grades sent to the model are in the grading cache, so a retry doesn't pay for them again
+        print(f"Checkpoint error: {e}")
+
+def _save_submissions(import_id: int, teacher_id: str, exam_id: int, questions: Dict[str, Dict[str, Any]]) -> int:
+    """Save a submission for every student whose answers are all graded and who doesn't have one yet."""
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT student_name, question_text, answer, result FROM bulk_import_answers
+            WHERE import_id = ? AND submission_id IS NULL AND student_name NOT IN (
+                SELECT student_name FROM bulk_import_answers WHERE import_id = ? AND result IS NULL
+            )
+            ORDER BY student_name, position
+            ''', (import_id, import_id))
+            rows = cursor.fetchall()
+    except sqlite3.Error:
+        return 0
+
+    saved = 0
+    for student, group in itertools.groupby(rows, key=lambda row: row['student_name']):
+        group = list(group)
+        answers = {row['question_text']: json.loads(row['answer']) for row in group}
+        result = summarize_grades(questions, answers, {row['question_text']: json.loads(row['result']) for row in group}, [])
+        submission = {
+            "student_name": student,
+            "answers": answers,
+            "evaluations": result["evaluations"],
+            "total_score": result["total_score"],
+            "max_score": result["max_score"]
+        }
+        try:
+            with db.db_connection() as conn:
+                # Mark the student first: save_submission commits this connection's transaction,
+                # so the mark and the submission are stored together and never saved twice
+                conn.execute('UPDATE bulk_import_answers SET submission_id = 0 WHERE import_id = ? AND student_name = ?', (import_id, student))
+                submission_id = submission_manager.save_submission(teacher_id, exam_id, submission)
+                if submission_id is None:
+                    conn.rollback()
+                    continue
+                conn.execute('UPDATE bulk_import_answers SET submission_id = ? WHERE import_id = ? AND student_name = ?',
+                             (submission_id, import_id, student))
+                conn.commit()
+                saved += 1
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+    return saved
+
+def run_import(import_id: int, max_workers: Optional[int] = None, on_progress: Optional[Callable[[int, int], None]] = None) -> Optional[Dict[str, int]]:
+    """
+    Grade the answers of an import that are not graded yet, then save its submissions.
+
+    Short answers go through `evaluate_answer` on a thread pool at re-grade priority, so students
+    taking an exam are served first; multiple choice answers are graded locally. Answers whose
+    grading fails stay ungraded and are retried by the next run; a student's submission is
+    saved once all of their answers are graded.
+
+    Args:
+        import_id (int): The import to grade.
+        max_workers (Optional[int]): Concurrency cap, defaults to GRADING_MAX_WORKERS.
+        on_progress (Optional[Callable[[int, int], None]]): Called with the graded and total answers after each grade.
+
+    Returns:
+        Optional[Dict[str, int]]: None if the import doesn't exist, else the number of `answers`,
+        `graded` and `failed` answers and the submissions `saved` by this run.
+    """
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT teacher_id, exam_id FROM bulk_imports WHERE id = ?', (import_id,))
+            header = cursor.fetchone()
+            if header is None:
+                return None
+            cursor.execute('SELECT student_name, question_text, answer FROM bulk_import_answers WHERE import_id = ? AND result IS NULL', (import_id,))
+            pending = cursor.fetchall()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return None
+
+    teacher_id, exam_id = header['teacher_id'], header['exam_id']
+    questions = load_questions(teacher_id, exam_id)
+    total = import_progress(import_id)["answers"]
+    graded, failed, grades = total - len(pending), 0, []
+    with rate_limiter.priority(rate_limiter.REGRADE), metrics.exam_context(teacher_id, exam_id):
+        with ThreadPoolExecutor(max_workers=max_workers or GRADING_MAX_WORKERS) as executor:
+            futures = {
+                executor.submit(contextvars.copy_context().run, _grade, row['question_text'], questions.get(row['question_text']),
+                                json.loads(row['answer'])): (row['student_name'], row['question_text'])
+                for row in pending
+            }
+            try:
+                for future in as_completed(futures):
+                    result = future.result()
+                    if result.get("error"):
+                        failed += 1
+                        continue
+                    grades.append((*futures[future], result))
+                    graded += 1
+                    if len(grades) >= BULK_CHECKPOINT_SIZE:
+                        _checkpoint(import_id, grades)
+                        grades = []
+                    if on_progress:
+                        on_progress(graded, total)
+            finally:
+                # When interrupted, keep the finished grades and drop the answers not started yet
+                for future in futures:
+                    future.cancel()
+                _checkpoint(import_id, grades)
+
+    saved = _save_submissions(import_id, teacher_id, exam_id, questions)
+    progress = import_progress(import_id)
+    if progress["graded"] == progress["answers"] and progress["saved"] == progress["students"]:
+        try:
+            with db.db_connection() as conn:
+                conn.execute("UPDATE bulk_imports SET status = 'done' WHERE id = ?", (import_id,))
+                conn.commit()
+        except sqlite3.Error:
+            pass
+    return {"answers": total, "graded": graded, "failed": failed, "saved": saved}
+
+def start_import(import_id: int) -> bool:
+    """Grade an import on a background thread of this process; returns False if it is already being graded here."""
+    with _running_lock:
+        if import_id in _running:
+            return False
+        _running.add(import_id)
+
+    def run():
+        try:
+            run_import(import_id)
+        finally:
+            with _running_lock:
+                _running.discard(import_id)
+
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
+def is_running(import_id: int) -> bool:
+    """Return whether an import is being graded on a background thread of this process."""
+    with _running_lock:
+        return import_id in _running
+
+# Usage: python bulk_import.py TEACHER_ID EXAM_ID SHEET - run it again with the same sheet to resume
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grade a transcribed answer sheet of (student, question, answer) rows.")
+    parser.add_argument("teacher", help="Teacher ID")
+    parser.add_argument("exam", type=int, help="Exam ID")
+    parser.add_argument("sheet", help="CSV or JSONL answer sheet")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="Defaults to the sheet's extension")
+    parser.add_argument("--workers", type=int, default=GRADING_MAX_WORKERS, help="Answers graded in parallel")
+    args = parser.parse_args()
+
+    fmt = args.format or ("jsonl" if args.sheet.endswith(".jsonl") else "csv")
+    try:
+        sheet = read_answer_sheet(args.sheet, fmt, load_questions(args.teacher, args.exam))
+    except ValueError as e:
+        parser.error(str(e))
+    import_id = create_import(args.teacher, args.exam, sheet, os.path.basename(args.sheet))
+    if import_id is None:
+        parser.exit(1, "Failed to store the answer sheet.\n")
+
+    progress = import_progress(import_id)
+    print(f"Import {import_id}: {progress['answers']} answer(s) of {progress['students']} student(s), {progress['graded']} already graded.")
+
+    def report(graded: int, total: int):
+        if graded % BULK_CHECKPOINT_SIZE == 0 or graded == total:
+            print(f"Graded {graded}/{total} answers.")
+
+    result = run_import(import_id, args.workers, report)
+    print(f"Saved {result['saved']} submission(s).")
+    if result["failed"]:
+        print(f"{result['failed']} answer(s) could not be graded; run the same command again to retry them.")
@@ -0,0 +1,39 @@
+import streamlit as st
+import bulk_import
+import utils
+
+def display_bulk_import(teacher_id: str, selected_exam_id: int, exams: dict):
+    # Display the exam title as a subheader
+    st.subheader(f"Import Answer Sheets for {exams[selected_exam_id]}")
+    st.write("Upload transcribed paper exams as a CSV or JSONL file with `student`, `question` and `answer` "
+             "columns, one row per answer. Multiple choice answers list the selected options separated by `;`.")
+
+    uploaded = st.file_uploader("Answer sheet:", type=["csv", "jsonl"], key=f"bulk_import_file_{selected_exam_id}")
+    if uploaded is not None and st.button("Import and grade 📥", key=f"bulk_import_start_{selected_exam_id}"):
+        fmt = "jsonl" if uploaded.name.endswith(".jsonl") else "csv"
+        try:
+            sheet = bulk_import.read_answer_sheet(uploaded, fmt, utils.load_questions(teacher_id, selected_exam_id))
+        except ValueError as e:
+            st.error(f"{e} ⚠️")
+        else:
+            # Uploading the same sheet again resumes its import instead of grading it twice
+            import_id = bulk_import.create_import(teacher_id, selected_exam_id, sheet, uploaded.name)
+            if import_id is None:
+                st.error("Failed to import the answer sheet! ⚠️")
+            else:
+                bulk_import.start_import(import_id)
+                st.success(f"Imported {len(sheet)} answers, grading them in the background. ✅")
+
+    # Progress of this exam's imports, updated with the submissions tab's auto-refresh
+    for item in bulk_import.list_imports(teacher_id, selected_exam_id):
+        progress = bulk_import.import_progress(item['id'])
+        with st.container(border=True):
+            st.write(f"**{item['source'] or 'Import'}** (#{item['id']})")
+            st.progress(progress['graded'] / progress['answers'] if progress['answers'] else 1.0,
+                        text=f"{progress['graded']}/{progress['answers']} answers graded, "
+                             f"{progress['saved']}/{progress['students']} submissions saved")
+            # Imports stopped by a restart or with failed answers can be picked up where they left off
+            if item['status'] != 'done' and not bulk_import.is_running(item['id']):
+                if st.button("Resume grading ▶️", key=f"bulk_import_resume_{item['id']}"):
+                    bulk_import.start_import(item['id'])
+                    st.rerun()
@@ -1,86 +1,336 @@
+import json
 import sqlite3
 import os
+import threading
 from contextlib import contextmanager
 
-# Create a data directory if it doesn't exist
-if not os.path.exists('data'):
-    os.makedirs('data')
-
 DB_PATH = 'data/eshraq.db'
 
-def get_connection():
-    """Create and return a database connection"""
-    conn = sqlite3.connect(DB_PATH, timeout=2.0)
+# Seconds a connection waits for another writer's lock before failing with "database is locked"
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "5.0"))
+
+# Connection tuning applied to every new connection:
+# - WAL lets readers proceed while a submission is being written
+# - synchronous=NORMAL is durable across application crashes in WAL mode and avoids an fsync per commit
+# - a 16 MB page cache and 256 MB memory map keep hot pages out of the read() path
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+)
+
+# One connection per thread, reused across calls instead of reconnecting every time
+_local = threading.local()
+
+# Whether this process has checked the schema version (see ensure_schema)
+_schema_checked = False
+_schema_lock = threading.Lock()
+
+def _connect() -> sqlite3.Connection:
+    """Open and tune a new database connection"""
+    # Create the data directory on first use
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
     conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    if not _schema_checked:
+        ensure_schema(conn)
     return conn
 
+def ensure_schema(conn: sqlite3.Connection):
+    """
+    Bring the schema up to date, once per process.
+
+    Runs on the process's first connection rather than at import time. When the database
+    is already at the latest version this costs a single `PRAGMA user_version` read;
+    `python database.py` applies the migrations ahead of time, e.g. on deploy.
+    """
+    global _schema_checked
+    with _schema_lock:
+        if not _schema_checked:
+            if conn.execute('PRAGMA user_version').fetchone()[0] < len(MIGRATIONS):
+                migrate(conn)
+            _schema_checked = True
+
+def get_connection():
+    """Return this thread's database connection, opening it on first use"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = _connect()
+    return conn
+
+def close_connection():
+    """Close this thread's database connection, if any"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        conn.close()
+
 @contextmanager
 def db_connection():
-    """Context manager for database connections to ensure proper closing"""
-    conn = None
+    """
+    Context manager for the thread's database connection.
+
+    The connection stays open for reuse. Changes must be committed inside the block:
+    when the outermost block exits, anything left uncommitted (after an error or an
+    early return) is rolled back, so the next caller starts from a clean state and
+    no write lock is held between calls.
+    """
+    conn = get_connection()
+    _local.depth = getattr(_local, 'depth', 0) + 1
     try:
-        conn = get_connection()
         yield conn
     finally:
-        if conn:
-            conn.close()
+        _local.depth -= 1
+        if _local.depth == 0 and conn.in_transaction:
+            conn.rollback()
 
 def init_db():
-    """Initialize the database by creating necessary tables if they don't exist"""
+    """Create the database or upgrade its schema to the latest version"""
     with db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('PRAGMA foreign_keys = ON')
-
-        # Teachers table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS teachers (
-            username TEXT PRIMARY KEY,
-            password TEXT NOT NULL
-        )
-        ''')
-
-        # Exams table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS exams (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            teacher_id TEXT NOT NULL,
-            exam_name TEXT NOT NULL,
-            FOREIGN KEY (teacher_id) REFERENCES teachers (username),
-            UNIQUE (teacher_id, exam_name)
-        )
-        ''')
-
-        # Questions table with exam_id
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS questions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            teacher_id TEXT NOT NULL,
-            exam_id INTEGER NOT NULL,
-            question_text TEXT NOT NULL,
-            question_type TEXT NOT NULL,
-            question_number TEXT NOT NULL,
-            reference TEXT,
-            options TEXT,
-            correct_option TEXT,
-            FOREIGN KEY (teacher_id) REFERENCES teachers (username),
-            FOREIGN KEY (exam_id) REFERENCES exams (id),
-            UNIQUE (teacher_id, exam_id, question_text)
-        )
-        ''')
-
-        # Submissions table with exam_id
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS submissions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            teacher_id TEXT NOT NULL,
-            exam_id INTEGER NOT NULL,
-            student_name TEXT NOT NULL,
-            submission_data TEXT NOT NULL,
-            FOREIGN KEY (teacher_id) REFERENCES teachers (username),
-            FOREIGN KEY (exam_id) REFERENCES exams (id)
-        )
-        ''')
+        migrate(conn)
+
+def _create_base_tables(cursor: sqlite3.Cursor):
+    """Create the original tables, which the migrations build on."""
+    # Teachers table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS teachers (
+        username TEXT PRIMARY KEY,
+        password TEXT NOT NULL
+    )
+    ''')
+
+    # Exams table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS exams (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        teacher_id TEXT NOT NULL,
+        exam_name TEXT NOT NULL,
+        FOREIGN KEY (teacher_id) REFERENCES teachers (username),
+        UNIQUE (teacher_id, exam_name)
+    )
+    ''')
 
+    # Questions table with exam_id
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS questions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        teacher_id TEXT NOT NULL,
+        exam_id INTEGER NOT NULL,
+        question_text TEXT NOT NULL,
+        question_type TEXT NOT NULL,
+        question_number TEXT NOT NULL,
+        reference TEXT,
+        options TEXT,
+        correct_option TEXT,
+        FOREIGN KEY (teacher_id) REFERENCES teachers (username),
+        FOREIGN KEY (exam_id) REFERENCES exams (id),
+        UNIQUE (teacher_id, exam_id, question_text)
+    )
+    ''')
+
+    # Submissions table with exam_id
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS submissions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        teacher_id TEXT NOT NULL,
+        exam_id INTEGER NOT NULL,
+        student_name TEXT NOT NULL,
+        submission_data TEXT NOT NULL,
+        FOREIGN KEY (teacher_id) REFERENCES teachers (username),
+        FOREIGN KEY (exam_id) REFERENCES exams (id)
+    )
+    ''')
+
+def _add_question_subject(cursor: sqlite3.Cursor):
+    """Store the detected academic subject of each question."""
+    cursor.execute('ALTER TABLE questions ADD COLUMN subject TEXT')
+
+def _add_grading_jobs(cursor: sqlite3.Cursor):
+    """Track the grading status of submissions and queue them for the background grader."""
+    cursor.execute("ALTER TABLE submissions ADD COLUMN status TEXT NOT NULL DEFAULT 'graded'")
+    cursor.execute('''
+    CREATE TABLE grading_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        submission_id INTEGER NOT NULL UNIQUE,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        available_at REAL NOT NULL,
+        locked_until REAL,
+        FOREIGN KEY (submission_id) REFERENCES submissions (id)
+    )
+    ''')
+    cursor.execute('CREATE INDEX idx_grading_jobs_status ON grading_jobs (status, available_at)')
+
+def _add_lookup_indexes(cursor: sqlite3.Cursor):
+    """Index submissions by exam, so loading an exam's submissions doesn't scan the whole table."""
+    # questions and exams are already covered by the indexes of their UNIQUE constraints
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_submissions_exam ON submissions (teacher_id, exam_id)')
+
+def _normalize_submissions(cursor: sqlite3.Cursor):
+    """
+    Move submissions out of their JSON blobs: scores go to header columns and each
+    answer gets its own row, so scores and per-question data can be queried in SQL.
+    """
+    cursor.execute('ALTER TABLE submissions ADD COLUMN total_score INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('ALTER TABLE submissions ADD COLUMN max_score INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('ALTER TABLE submissions ADD COLUMN created_at REAL')
+    cursor.execute('''
+    CREATE TABLE submission_answers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        submission_id INTEGER NOT NULL,
+        question_id INTEGER,
+        question_text TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        answer TEXT,
+        score INTEGER,
+        correct INTEGER,
+        feedback TEXT,
+        FOREIGN KEY (submission_id) REFERENCES submissions (id),
+        FOREIGN KEY (question_id) REFERENCES questions (id),
+        UNIQUE (submission_id, question_text)
+    )
+    ''')
+    cursor.execute('CREATE INDEX idx_submission_answers_question ON submission_answers (question_id)')
+
+    # Migrate the existing blobs
+    rows = cursor.execute('SELECT id, teacher_id, exam_id, submission_data FROM submissions').fetchall()
+    for submission_id, teacher_id, exam_id, submission_data in rows:
+        submission = json.loads(submission_data)
+        question_ids = dict(cursor.execute(
+            'SELECT question_text, id FROM questions WHERE teacher_id = ? AND exam_id = ?', (teacher_id, exam_id)
+        ).fetchall())
+        evaluations = submission.get('evaluations', {})
+        cursor.executemany('''
+        INSERT INTO submission_answers (submission_id, question_id, question_text, position, answer, score, correct, feedback)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (submission_id, question_ids.get(q_text), q_text, position, json.dumps(answer, ensure_ascii=False),
+             evaluations.get(q_text, {}).get('score'), evaluations.get(q_text, {}).get('correct'),
+             evaluations.get(q_text, {}).get('feedback'))
+            for position, (q_text, answer) in enumerate(submission.get('answers', {}).items())
+        ])
+        cursor.execute('UPDATE submissions SET total_score = ?, max_score = ?, submission_data = ? WHERE id = ?',
+                       (submission.get('total_score', 0), submission.get('max_score', 0), '{}', submission_id))
+
+def _add_exam_versions(cursor: sqlite3.Cursor):
+    """Version each exam's question set, so cached snapshots of it can be invalidated."""
+    cursor.execute('ALTER TABLE exams ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+def _add_exam_analytics(cursor: sqlite3.Cursor):
+    """Keep per-exam score summaries that grow with every graded submission (see analytics.py)."""
+    cursor.execute('''
+    CREATE TABLE exam_analytics (
+        teacher_id TEXT NOT NULL,
+        exam_id INTEGER NOT NULL,
+        submissions INTEGER NOT NULL DEFAULT 0,
+        score_sum INTEGER NOT NULL DEFAULT 0,
+        max_score_sum INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (teacher_id, exam_id)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE exam_question_scores (
+        teacher_id TEXT NOT NULL,
+        exam_id INTEGER NOT NULL,
+        question_text TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        answers INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (teacher_id, exam_id, question_text, score)
+    )
+    ''')
+    # Summarize the submissions graded so far
+    cursor.execute('''
+    INSERT INTO exam_analytics (teacher_id, exam_id, submissions, score_sum, max_score_sum)
+    SELECT teacher_id, exam_id, COUNT(*), SUM(total_score), SUM(max_score) FROM submissions
+    WHERE status = 'graded' GROUP BY teacher_id, exam_id
+    ''')
+    cursor.execute('''
+    INSERT INTO exam_question_scores (teacher_id, exam_id, question_text, score, answers)
+    SELECT s.teacher_id, s.exam_id, a.question_text, MIN(10, MAX(0, CAST(ROUND(a.score) AS INTEGER))) AS bucket, COUNT(*)
+    FROM submission_answers a JOIN submissions s ON s.id = a.submission_id
+    WHERE s.status = 'graded' AND a.score IS NOT NULL
+    GROUP BY s.teacher_id, s.exam_id, a.question_text, bucket
+    ''')
+
+def _add_bulk_imports(cursor: sqlite3.Cursor):
+    """Store imported answer sheets and their grades as they finish, so an import can resume (see bulk_import.py)."""
+    cursor.execute('''
+    CREATE TABLE bulk_imports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        teacher_id TEXT NOT NULL,
+        exam_id INTEGER NOT NULL,
+        source TEXT,
+        digest TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'grading',
+        created_at REAL NOT NULL,
+        UNIQUE (teacher_id, exam_id, digest)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE bulk_import_answers (
+        import_id INTEGER NOT NULL,
+        student_name TEXT NOT NULL,
+        question_text TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        answer TEXT NOT NULL,
+        result TEXT,
+        submission_id INTEGER,
+        FOREIGN KEY (import_id) REFERENCES bulk_imports (id),
+        PRIMARY KEY (import_id, student_name, question_text)
+    )
+    ''')
+
+def _add_submission_keys(cursor: sqlite3.Cursor):
+    """Key each submission by its content, so the same exam attempt is never stored or graded twice."""
+    cursor.execute('ALTER TABLE submissions ADD COLUMN idempotency_key TEXT')
+    # Submissions without a key (older ones, bulk imports) are not constrained: NULLs never conflict
+    cursor.execute('CREATE UNIQUE INDEX idx_submissions_key ON submissions (teacher_id, exam_id, idempotency_key)')
+
+def _add_grading_leases(cursor: sqlite3.Cursor):
+    """Record when a submission's current grading started, so abandoned gradings expire without touching created_at."""
+    cursor.execute('ALTER TABLE submissions ADD COLUMN grading_started_at REAL')
+    # Reservations made before this column existed started grading when they were submitted
+    cursor.execute("UPDATE submissions SET grading_started_at = created_at WHERE status = 'grading'")
+
+# Schema migrations applied in order on top of the base tables.
+# The number of applied migrations is tracked in PRAGMA user_version,
+# so never reorder or remove entries - only append new ones.
+MIGRATIONS = [
+    _add_question_subject,
+    _add_grading_jobs,
+    _add_lookup_indexes,
+    _normalize_submissions,
+    _add_exam_versions,
+    _add_exam_analytics,
+    _add_bulk_imports,
+    _add_submission_keys,
+    _add_grading_leases,
+]
+
+def migrate(conn: sqlite3.Connection):
+    """Create the base tables and apply any schema migrations the database has not seen yet"""
+    cursor = conn.cursor()
+    # Take the write lock first so concurrent processes don't apply a migration twice
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        if version < len(MIGRATIONS):
+            # Databases created before versioning have the base tables at version 0
+            _create_base_tables(cursor)
+        for index, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {index}')
         conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
 
-init_db()
\ No newline at end of file
+# Usage: python database.py - creates the database or applies pending migrations, e.g. on deploy
+if __name__ == "__main__":
+    init_db()
+    with db_connection() as conn:
+        print(f"Database {DB_PATH} is at schema version {conn.execute('PRAGMA user_version').fetchone()[0]}.")
\ No newline at end of file
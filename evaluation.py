@@ -1,16 +1,31 @@
+import json
 import os
-from openai import AzureOpenAI
-from typing import Dict, Any
-
-# Azure OpenAI configuration
-# Retrieve configuration details for Azure OpenAI from environment variables,
-# with default values provided for local testing or fallback.
-ENDPOINT = os.getenv("ENDPOINT_URL", "https://your_account.openai.azure.com/")
-API_KEY = os.getenv("AZURE_OPENAI_API_KEY", "your_azure_openAI_KEY❤️")
-API_VERSION = "2025-01-01-preview"
+import re
+from typing import Callable, Dict, Any, Optional, List, Hashable
+from llm_client import chat_completion, chat_completion_stream
+import grading_cache
+import metrics
+import pre_grader
+
+# Azure OpenAI deployment used for all evaluation calls.
+# The endpoint, key and connection handling live in llm_client.
 DEPLOYMENT_GPT4 = os.getenv("DEPLOYMENT_NAME_GPT4", "gpt-4.1")
+# Structured mode grades with a single JSON-mode request that also returns the subject;
+# set STRUCTURED_GRADING=0 to use the original two-request free text grading.
+STRUCTURED_GRADING = os.getenv("STRUCTURED_GRADING", "1") == "1"
+# Completion budget of a structured grade: a short JSON object with a few sentences of feedback.
+GRADING_MAX_TOKENS = int(os.getenv("GRADING_MAX_TOKENS", "200"))
+# Batch grading: prompt token budget per request, upper bound on answers per request,
+# and completion tokens reserved for each graded answer.
+BATCH_PROMPT_TOKENS = int(os.getenv("BATCH_PROMPT_TOKENS", "6000"))
+BATCH_MAX_ANSWERS = int(os.getenv("BATCH_MAX_ANSWERS", "25"))
+BATCH_TOKENS_PER_ANSWER = int(os.getenv("BATCH_TOKENS_PER_ANSWER", "120"))
+# Version of the grading prompt, part of every grading cache key.
+# Bump it whenever the prompt or scoring scale changes so old grades are not reused.
+PROMPT_VERSION = "2" if STRUCTURED_GRADING else "1"
 
-def detect_subject(question: str) -> str:
+@metrics.timed("call")
+def detect_subject(question: str) -> Optional[str]:
     """
     Detect the academic subject of a question using Azure OpenAI.
 
@@ -21,14 +36,9 @@ def detect_subject(question: str) -> str:
         question (str): The question to evaluate.
 
     Returns:
-        str: The detected academic subject, or "Other" if detection fails.
+        Optional[str]: The detected academic subject ("Other" when the model says so),
+        or None if the request failed, so the question can be classified again later.
     """
-    client = AzureOpenAI(
-        azure_endpoint=ENDPOINT,
-        api_key=API_KEY,
-        api_version=API_VERSION
-    )
-    
     # Prompt instructing the AI to classify the question into a subject category.
     prompt = f"""
     You are an expert in educational content classification. Based on the question provided, identify the academic subject it belongs to. Choose from the following subjects: Mathematics, Science, History, Language, Geography, or Other. Provide only the subject name as the output.
@@ -36,7 +46,7 @@ def detect_subject(question: str) -> str:
     """
     try:
         # Sending the request to Azure OpenAI for subject classification.
-        response = client.chat.completions.create(
+        response = chat_completion(
             model=DEPLOYMENT_GPT4,
             messages=[{"role": "system", "content": prompt}],
             max_tokens=10
@@ -44,110 +54,358 @@ def detect_subject(question: str) -> str:
         # Extracting and returning the subject from the response.
         subject = response.choices[0].message.content.strip()
         return subject
-    except Exception:
-        # Fallback to "Other" in case of an error.
-        return "Other"
+    except Exception as e:
+        # Leave the subject unknown rather than storing a guess: backfill_subjects retries it
+        print(f"Subject detection error: {e}")
+        metrics.record("error", "detect_subject", error=f"{type(e).__name__}: {e}")
+        return None
 
-def evaluate_answer(question: str, student_answer: str, reference: str) -> Dict[str, Any]:
+# Predefined evaluation criteria based on the subject.
+SUBJECT_CRITERIA = {
+    "Mathematics": """
+    - Focus on correctness of calculations and logic.
+    - Minor spelling errors are irrelevant unless they change the meaning.
+    - Award full marks for correct answers even if expressed differently.
+    """,
+    "Science": """
+    - Prioritize scientific accuracy and use of correct terminology.
+    - Minor spelling errors should not heavily penalize if the concept is correct.
+    - Partial credit for incomplete but relevant answers.
+    """,
+    "History": """
+    - Emphasize factual accuracy and relevance to the question.
+    - Allow flexibility in expression as long as key events or concepts are correct.
+    - Minor errors in dates or names should not lead to harsh penalties.
+    """,
+    "Language": """
+    - Focus on grammar, vocabulary, and clarity of expression.
+    - Award marks for coherent ideas even with minor mistakes.
+    """,
+    "Geography": """
+    - Prioritize accuracy of locations, terms, and concepts.
+    - Minor spelling errors in names are acceptable if the context is clear.
+    - Partial credit for partially correct answers.
+    """,
+    "Other": """
+    - Evaluate based on clarity, relevance, and completeness.
+    - Be lenient with minor errors unless they significantly alter the meaning.
     """
-    Evaluate a student's answer to a question using Azure OpenAI with subject-specific criteria.
+}
 
-    This function detects the subject of the question, selects evaluation criteria based on the subject,
-    and generates a score and feedback using Azure OpenAI.
+SUBJECTS = list(SUBJECT_CRITERIA)
+
+# Shared scoring scale and guidelines of the grading prompts.
+SCORING_SCALE = """
+    Your evaluation should be based on the following scale:
+    - 8 to 10 points for answers that are fully accurate, clear, and complete in relation to the reference answer.
+    - 5 to 7 points for answers that are partially correct with minor errors or omissions, but still convey the main idea effectively.
+    - 0 to 4 points for answers that are incorrect, off-topic, or fail to address the question.
+    """
+GUIDELINES = """
+    Guidelines:
+    - If the answer is substantially correct, even with slight differences in wording or phrasing, assess it fairly as correct or partially correct.
+    - Do not penalize for minor differences in expression, as long as the main idea is conveyed clearly and accurately.
+    """
+
+def _criteria_prompt(subject: Optional[str]) -> str:
+    """Describe the grading criteria, or every subject's criteria when the model has to classify the question itself."""
+    if subject:
+        # Select appropriate criteria for the known subject.
+        criteria = SUBJECT_CRITERIA.get(subject, SUBJECT_CRITERIA["Other"])
+        return f"""
+    You are an intelligent teacher specialized in educational assessment for {subject}. Evaluate the student's answer based on the following criteria:
+    {criteria}"""
+    criteria = "".join(f"\n    {name}:{text}" for name, text in SUBJECT_CRITERIA.items())
+    return f"""
+    You are an intelligent teacher specialized in educational assessment. First identify the academic subject of the question, choosing from: {", ".join(SUBJECTS)}.
+    Then evaluate the student's answer based on the criteria of that subject:
+    {criteria}"""
+
+def parse_structured_grade(response_text: str, subject: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Parse a JSON grade returned by the model.
 
     Args:
-        question (str): The question being evaluated.
-        student_answer (str): The student's answer to the question.
-        reference (str): The correct or reference answer for the question.
+        response_text (str): The model output, a JSON object with score, feedback and optionally subject.
+        subject (Optional[str]): The subject to report when the model was not asked to classify.
 
     Returns:
-        Dict[str, Any]: A dictionary containing the evaluation result, score, and feedback.
-    """
-    # Detecting the subject of the question.
-    subject = detect_subject(question)
-    
-    client = AzureOpenAI(
-        azure_endpoint=ENDPOINT,
-        api_key=API_KEY,
-        api_version=API_VERSION
-    )
-    
-    # Predefined evaluation criteria based on the subject.
-    subject_criteria = {
-        "Mathematics": """
-        - Focus on correctness of calculations and logic.
-        - Minor spelling errors are irrelevant unless they change the meaning.
-        - Award full marks for correct answers even if expressed differently.
-        """,
-        "Science": """
-        - Prioritize scientific accuracy and use of correct terminology.
-        - Minor spelling errors should not heavily penalize if the concept is correct.
-        - Partial credit for incomplete but relevant answers.
-        """,
-        "History": """
-        - Emphasize factual accuracy and relevance to the question.
-        - Allow flexibility in expression as long as key events or concepts are correct.
-        - Minor errors in dates or names should not lead to harsh penalties.
-        """,
-        "Language": """
-        - Focus on grammar, vocabulary, and clarity of expression.
-        - Award marks for coherent ideas even with minor mistakes.
-        """,
-        "Geography": """
-        - Prioritize accuracy of locations, terms, and concepts.
-        - Minor spelling errors in names are acceptable if the context is clear.
-        - Partial credit for partially correct answers.
-        """,
-        "Other": """
-        - Evaluate based on clarity, relevance, and completeness.
-        - Be lenient with minor errors unless they significantly alter the meaning.
-        """
+        Dict[str, Any]: The evaluation result, score (clamped to 0-10), feedback and subject.
+
+    Raises:
+        ValueError: If the output is not valid JSON or has no numeric score.
+    """
+    data = json.loads(response_text)
+    score = max(0, min(10, int(round(float(data["score"])))))
+    detected = data.get("subject") if data.get("subject") in SUBJECT_CRITERIA else "Other"
+    return {
+        "correct": score >= 8,
+        "score": score,
+        "feedback": str(data.get("feedback", "")).strip(),
+        "subject": subject or detected
     }
 
-    # Select appropriate criteria for the detected subject.
-    criteria = subject_criteria.get(subject, subject_criteria["Other"])
+def partial_feedback(response_text: str) -> Optional[str]:
+    """Extract the feedback generated so far from an incomplete JSON grade, or None if it hasn't started."""
+    match = re.search(r'"feedback"\s*:\s*"((?:[^"\\]|\\.)*)', response_text)
+    if match is None:
+        return None
+    # Drop an escape sequence cut off at the end of the stream
+    raw = re.sub(r'\\(u[0-9a-fA-F]{0,3})?$', "", match.group(1))
+    try:
+        return json.loads(f'"{raw}"')
+    except ValueError:
+        return raw
+
+def _evaluate_structured(question: str, student_answer: str, reference: str, subject: Optional[str],
+                         on_feedback: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    Grade in a single JSON-mode request that also classifies the subject when it is unknown.
+
+    With `on_feedback` the reply is streamed and the callback receives the feedback text
+    generated so far each time it grows.
+    """
+    keys = '"score"' + ("" if subject else ', "subject"')
+    prompt = f"""{_criteria_prompt(subject)}
+    {SCORING_SCALE}
+    Output Format:
+    Reply with only a JSON object with the keys {keys} and "feedback", for example:
+    {{{"" if subject else '"subject": "Science", '}"score": 7, "feedback": "Detailed feedback"}}
+    {GUIDELINES}
+    Question: {question}
+    Reference Answer: {reference}
+    Student Answer: {student_answer}
+    """
+    messages = [{"role": "system", "content": prompt}]
+    if on_feedback is None:
+        # Sending the evaluation request to Azure OpenAI.
+        response = chat_completion(
+            model=DEPLOYMENT_GPT4,
+            messages=messages,
+            max_tokens=GRADING_MAX_TOKENS,
+            response_format={"type": "json_object"}
+        )
+        return parse_structured_grade(response.choices[0].message.content, subject)
+
+    # Stream the reply and report the feedback as it grows
+    received, shown = [], [""]
+    def on_delta(delta: str):
+        received.append(delta)
+        feedback = partial_feedback("".join(received))
+        if feedback and feedback != shown[0]:
+            shown[0] = feedback
+            on_feedback(feedback)
+    response_text = chat_completion_stream(
+        model=DEPLOYMENT_GPT4,
+        messages=messages,
+        max_tokens=GRADING_MAX_TOKENS,
+        on_delta=on_delta,
+        response_format={"type": "json_object"}
+    )
+    return parse_structured_grade(response_text, subject)
+
+def _evaluate_text(question: str, student_answer: str, reference: str, subject: Optional[str]) -> Dict[str, Any]:
+    """Grade with the original free text prompt, detecting the subject in a separate request first."""
+    # Detecting the subject of the question when it was not precomputed.
+    if not subject:
+        subject = detect_subject(question)
 
     # Constructing the prompt to evaluate the student's answer.
-    prompt = f"""
-    You are an intelligent teacher specialized in educational assessment for {subject}. Evaluate the student's answer based on the following criteria:
-    {criteria}
-    Your evaluation should be based on the following scale:
-    - 8 to 10 points for answers that are fully accurate, clear, and complete in relation to the reference answer.
-    - 5 to 7 points for answers that are partially correct with minor errors or omissions, but still convey the main idea effectively.
-    - 0 to 4 points for answers that are incorrect, off-topic, or fail to address the question.
+    prompt = f"""{_criteria_prompt(subject)}
+    {SCORING_SCALE}
     Output Format:
     Score: [X/10]
     Feedback: [Detailed feedback]
-    Guidelines:
-    - If the answer is substantially correct, even with slight differences in wording or phrasing, assess it fairly as correct or partially correct.
-    - Do not penalize for minor differences in expression, as long as the main idea is conveyed clearly and accurately.
+    {GUIDELINES}
     Question: {question}
     Reference Answer: {reference}
     Student Answer: {student_answer}
     """
+    # Sending the evaluation request to Azure OpenAI.
+    response = chat_completion(
+        model=DEPLOYMENT_GPT4,
+        messages=[{"role": "system", "content": prompt}],
+        max_tokens=150
+    )
+    # Parsing the response to extract score and feedback.
+    response_text = response.choices[0].message.content
+    lines = response_text.split("\n")
+    result = {"correct": False, "score": 0, "feedback": "", "subject": subject}
+    for line in lines:
+        if line.startswith("Score:"):
+            result["score"] = int(line.split(":")[1].strip().split("/")[0])
+            result["correct"] = result["score"] >= 8
+        elif line.startswith("Feedback:"):
+            result["feedback"] = line.split(":")[1].strip()
+    return result
+
+@metrics.timed("call")
+def evaluate_answer(question: str, student_answer: str, reference: str, subject: Optional[str] = None,
+                    on_feedback: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    Evaluate a student's answer to a question using Azure OpenAI with subject-specific criteria.
+
+    In structured mode (the default) the subject, score and feedback come back together from a
+    single JSON-mode request; with a precomputed subject the classification step is skipped.
+    In text mode the subject is detected in a separate request and the free text reply is parsed.
+    Clear-cut answers are graded locally by `pre_grader`, and grades are cached, so an identical
+    (normalized) answer to the same question is returned without a network call.
+
+    Args:
+        question (str): The question being evaluated.
+        student_answer (str): The student's answer to the question.
+        reference (str): The correct or reference answer for the question.
+        subject (Optional[str]): The precomputed subject of the question, detected if omitted.
+        on_feedback (Optional[Callable[[str], None]]): Called with the feedback generated so far while
+            the model streams its reply (structured mode only), to show it before grading finishes.
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the evaluation result, score, feedback and subject.
+    """
+    # Blank, exact and unrelated answers don't need the model.
+    pre_graded = pre_grader.pre_grade(reference, [student_answer], subject)[0]
+    if pre_graded is not None:
+        return pre_graded
+    return _evaluate_with_model(question, student_answer, reference, subject, on_feedback)
+
+def _evaluate_with_model(question: str, student_answer: str, reference: str, subject: Optional[str],
+                         on_feedback: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """Grade one answer with the model, reusing the cached grade of an identical answer."""
+    # Reuse the grade of an identical answer graded before.
+    cached = grading_cache.get(question, reference, student_answer, PROMPT_VERSION)
+    if cached is not None:
+        return cached
+
     try:
-        # Sending the evaluation request to Azure OpenAI.
-        response = client.chat.completions.create(
-            model=DEPLOYMENT_GPT4,
-            messages=[{"role": "system", "content": prompt}],
-            max_tokens=150
-        )
-        # Parsing the response to extract score and feedback.
-        response_text = response.choices[0].message.content
-        lines = response_text.split("\n")
-        result = {"correct": False, "score": 0, "feedback": ""}
-        for line in lines:
-            if line.startswith("Score:"):
-                result["score"] = int(line.split(":")[1].strip().split("/")[0])
-                result["correct"] = result["score"] >= 8
-            elif line.startswith("Feedback:"):
-                result["feedback"] = line.split(":")[1].strip()
+        if STRUCTURED_GRADING:
+            result = _evaluate_structured(question, student_answer, reference, subject, on_feedback)
+        else:
+            result = _evaluate_text(question, student_answer, reference, subject)
+        grading_cache.put(question, reference, student_answer, PROMPT_VERSION, result)
         return result
     except Exception as e:
         # Handle potential errors during evaluation.
         print(f"Evaluation error: {e}")
-        return {"correct": False, "score": 0, "feedback": "Error in evaluation"}
+        metrics.record("error", "evaluate_answer", error=f"{type(e).__name__}: {e}")
+        return {"correct": False, "score": 0, "feedback": "Error in evaluation", "error": True}
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the token count of a text (about four characters per token)."""
+    return len(text) // 4 + 1
+
+def _chunk_answers(answers: List[str], budget: int) -> List[List[int]]:
+    """Split answer indexes into chunks that fit the prompt token budget and BATCH_MAX_ANSWERS."""
+    chunks, current, used = [], [], 0
+    for index, answer in enumerate(answers):
+        cost = estimate_tokens(answer) + 10  # Per-answer JSON overhead
+        if current and (used + cost > budget or len(current) >= BATCH_MAX_ANSWERS):
+            chunks.append(current)
+            current, used = [], 0
+        current.append(index)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _evaluate_chunk(question: str, reference: str, answers: List[str], subject: Optional[str]) -> List[Optional[Dict[str, Any]]]:
+    """Grade a chunk of answers in one JSON-mode request; answers missing from the reply come back as None."""
+    student_answers = json.dumps([{"id": str(index), "answer": answer} for index, answer in enumerate(answers)], ensure_ascii=False)
+    prompt = f"""{_criteria_prompt(subject)}
+    {SCORING_SCALE}
+    Grade each student answer below independently.
+    Output Format:
+    Reply with only a JSON object{"" if subject else ' with the detected "subject" and'} a "results" list holding one entry per student answer, for example:
+    {{{"" if subject else '"subject": "Science", '}"results": [{{"id": "0", "score": 7, "feedback": "Detailed feedback"}}]}}
+    {GUIDELINES}
+    Question: {question}
+    Reference Answer: {reference}
+    Student Answers (JSON list of id and answer): {student_answers}
+    """
+    response = chat_completion(
+        model=DEPLOYMENT_GPT4,
+        messages=[{"role": "system", "content": prompt}],
+        max_tokens=BATCH_TOKENS_PER_ANSWER * len(answers) + 20,
+        response_format={"type": "json_object"}
+    )
+    data = json.loads(response.choices[0].message.content)
+    detected = data.get("subject")
+    results = [None] * len(answers)
+    for item in data.get("results", []):
+        try:
+            index = int(item["id"])
+            if 0 <= index < len(answers):
+                results[index] = parse_structured_grade(json.dumps(dict(item, subject=detected)), subject)
+        except (KeyError, TypeError, ValueError):
+            continue  # Skip malformed entries, they are graded individually
+    return results
+
+@metrics.timed("call")
+def evaluate_answers_batch(question: str, reference: str, answers: Dict[Hashable, str], subject: Optional[str] = None) -> Dict[Hashable, Dict[str, Any]]:
+    """
+    Evaluate many students' answers to the same question with few requests.
+
+    The question, reference answer and criteria are sent once per request together with as
+    many answers as fit the BATCH_PROMPT_TOKENS budget, instead of once per student. Cached
+    and duplicate answers are not sent at all, clear-cut answers are graded locally by
+    `pre_grader` in one vectorized pass, and any answer the model leaves out of its reply is
+    graded on its own. A chunk whose request fails (e.g. rate limited) is returned as errors
+    rather than re-sent answer by answer.
+
+    Args:
+        question (str): The question being evaluated.
+        reference (str): The correct or reference answer for the question.
+        answers (Dict[Hashable, str]): The students' answers keyed by any ID (e.g. submission ID).
+        subject (Optional[str]): The precomputed subject of the question, detected if omitted.
 
+    Returns:
+        Dict[Hashable, Dict[str, Any]]: The evaluation result of each answer, keyed by the same IDs.
+    """
+    results = {}
+    # Grade the clear-cut answers locally, all at once
+    for answer_id, pre_graded in zip(answers, pre_grader.pre_grade(reference, list(answers.values()), subject)):
+        if pre_graded is not None:
+            results[answer_id] = pre_graded
+    # Group the other IDs by normalized answer, so identical answers are graded once
+    pending = {}
+    for answer_id, answer in answers.items():
+        if answer_id in results:
+            continue
+        cached = grading_cache.get(question, reference, answer, PROMPT_VERSION)
+        if cached is not None:
+            results[answer_id] = cached
+        else:
+            pending.setdefault(grading_cache.normalize_answer(answer), []).append(answer_id)
+
+    unique_answers = [answers[ids[0]] for ids in pending.values()]
+    id_groups = list(pending.values())
+    base_tokens = estimate_tokens(question + reference + SCORING_SCALE + GUIDELINES + _criteria_prompt(subject))
+    for chunk in _chunk_answers(unique_answers, max(BATCH_PROMPT_TOKENS - base_tokens, 1)):
+        chunk_answers = [unique_answers[index] for index in chunk]
+        try:
+            chunk_results = _evaluate_chunk(question, reference, chunk_answers, subject)
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            # The reply was not the expected JSON: grade the chunk's answers one by one instead
+            print(f"Batch evaluation error: {e}")
+            metrics.record("error", "evaluate_answers_batch", error=f"{type(e).__name__}: {e}")
+            chunk_results = [None] * len(chunk)
+        except Exception as e:
+            # Rate limited or unreachable: one request per answer would only add to the load.
+            # The answers come back as errors, so the caller retries them later
+            print(f"Batch evaluation error: {e}")
+            metrics.record("error", "evaluate_answers_batch", error=f"{type(e).__name__}: {e}")
+            chunk_results = [{"correct": False, "score": 0, "feedback": "Error in evaluation", "error": True} for _ in chunk]
+        for index, answer, result in zip(chunk, chunk_answers, chunk_results):
+            if result is None:
+                # Fall back to grading this answer on its own
+                result = _evaluate_with_model(question, answer, reference, subject)
+            elif not result.get("error"):
+                grading_cache.put(question, reference, answer, PROMPT_VERSION, result)
+            for answer_id in id_groups[index]:
+                results[answer_id] = result
+    # Keep the caller's order
+    return {answer_id: results[answer_id] for answer_id in answers}
+
+@metrics.timed("call")
 def generate_student_feedback(student_name: str, answers: Dict[str, str], evaluations: Dict[str, Dict[str, Any]], total_score: int, max_score: int) -> str:
     """
     Generate detailed feedback for a student based on their answers and evaluations.
@@ -165,12 +423,6 @@ def generate_student_feedback(student_name: str, answers: Dict[str, str], evalua
     Returns:
         str: A detailed feedback report for the student.
     """
-    client = AzureOpenAI(
-        azure_endpoint=ENDPOINT,
-        api_key=API_KEY,
-        api_version=API_VERSION
-    )
-    
     # Constructing the prompt for generating feedback.
     prompt = f"""
     You are an expert in evaluating student responses. Based on the following data, provide a comprehensive and short report on the student's performance for the teacher. The report should include:
@@ -187,7 +439,7 @@ def generate_student_feedback(student_name: str, answers: Dict[str, str], evalua
 
     try:
         # Sending the feedback generation request to Azure OpenAI.
-        response = client.chat.completions.create(
+        response = chat_completion(
             model=DEPLOYMENT_GPT4,
             messages=[{"role": "system", "content": prompt}],
             max_tokens=100
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+# Process-wide cache of exam question snapshots, shared by every Streamlit session.
+# Snapshots are keyed by (teacher ID, exam ID, version); every write to an exam's
+# questions bumps its version in the database, so a stale snapshot is never served.
+EXAM_CACHE_MAX_ENTRIES = int(os.getenv("EXAM_CACHE_MAX_ENTRIES", "256"))
+# Seconds an exam's version number is trusted before it is read from the database again.
+# Writes made by this process invalidate it immediately; this only bounds how long
+# writes made by another process can go unnoticed.
+EXAM_VERSION_TTL = float(os.getenv("EXAM_VERSION_TTL", "2"))
+
+_snapshots: "OrderedDict[Tuple[str, str, int], Mapping[str, Mapping[str, Any]]]" = OrderedDict()
+_versions: Dict[Tuple[str, str], Tuple[int, float]] = {}  # (teacher ID, exam ID) -> (version, read at)
+_stats = {"hits": 0, "misses": 0}
+_lock = threading.Lock()
+
+def _exam_key(teacher_id: str, exam_id) -> Tuple[str, str]:
+    # Exam IDs arrive as ints from the teacher pages and as strings from query parameters
+    return str(teacher_id), str(exam_id)
+
+def freeze(questions: Dict[str, Dict[str, Any]]) -> Mapping[str, Mapping[str, Any]]:
+    """Wrap loaded questions in read-only mappings, so sessions sharing a snapshot can't modify it."""
+    return MappingProxyType({q_text: MappingProxyType(dict(q_data)) for q_text, q_data in questions.items()})
+
+def get_snapshot(teacher_id: str, exam_id, load_version: Callable[[], int],
+                 load_questions: Callable[[], Dict[str, Dict[str, Any]]]) -> Mapping[str, Mapping[str, Any]]:
+    """
+    Return the cached snapshot of an exam's current version, loading it on a miss.
+
+    Args:
+        teacher_id (str): The teacher who owns the exam.
+        exam_id: The exam's ID.
+        load_version (Callable): Reads the exam's version from the database.
+        load_questions (Callable): Reads the exam's questions from the database.
+
+    Returns:
+        Mapping: Read-only question text -> question data mapping.
+    """
+    exam_key = _exam_key(teacher_id, exam_id)
+    now = time.monotonic()
+    with _lock:
+        cached_version = _versions.get(exam_key)
+    if cached_version is not None and now - cached_version[1] < EXAM_VERSION_TTL:
+        version = cached_version[0]
+    else:
+        version = load_version()
+        with _lock:
+            _versions[exam_key] = (version, now)
+
+    key = exam_key + (version,)
+    with _lock:
+        snapshot = _snapshots.get(key)
+        if snapshot is not None:
+            _snapshots.move_to_end(key)
+            _stats["hits"] += 1
+            return snapshot
+        _stats["misses"] += 1
+
+    # Load outside the lock; two sessions missing together just load the same snapshot twice
+    snapshot = freeze(load_questions())
+    if EXAM_CACHE_MAX_ENTRIES > 0:
+        with _lock:
+            # Older versions of this exam can't be requested any more
+            for stale in [k for k in _snapshots if k[:2] == exam_key and k[2] != version]:
+                del _snapshots[stale]
+            _snapshots[key] = snapshot
+            while len(_snapshots) > EXAM_CACHE_MAX_ENTRIES:
+                _snapshots.popitem(last=False)
+    return snapshot
+
+def invalidate(teacher_id: str, exam_id: Optional[Any] = None):
+    """Drop the cached snapshots and version of one exam, or of all of a teacher's exams."""
+    with _lock:
+        for key in [k for k in _snapshots if k[0] == str(teacher_id) and (exam_id is None or k[1] == str(exam_id))]:
+            del _snapshots[key]
+        for key in [k for k in _versions if k[0] == str(teacher_id) and (exam_id is None or k[1] == str(exam_id))]:
+            del _versions[key]
+
+def clear():
+    """Drop every cached snapshot."""
+    with _lock:
+        _snapshots.clear()
+        _versions.clear()
+
+def cache_stats() -> Dict[str, int]:
+    """Return the number of cached snapshots and this process's hit/miss counts."""
+    with _lock:
+        return {"entries": len(_snapshots), **_stats}
@@ -1,8 +1,10 @@
 import database as db
+import metrics
 from typing import Dict
 import sqlite3
 
 # Function to retrieve all exams associated with a specific teacher
+@metrics.timed("db")
 def load_exams(teacher_id: str) -> Dict[int, str]:
     """Load all exams for a specific teacher."""
     try:
@@ -16,6 +18,7 @@ def load_exams(teacher_id: str) -> Dict[int, str]:
         return {}  # Return empty dictionary if database operation fails
 
 # Function to create a new exam in the database
+@metrics.timed("db")
 def save_exam(teacher_id: str, exam_name: str) -> int:
     """Save a new exam."""
     try:
@@ -0,0 +1,159 @@
+import argparse
+import os
+import sqlite3
+from typing import Iterator, List, Optional, BinaryIO, Union
+import pandas as pd
+import database as db
+from utils import load_questions
+
+# Number of submissions read from SQLite and written per chunk. Memory use of an
+# export depends on this, not on the number of submissions.
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+EXPORT_FORMATS = ("csv", "parquet")
+# Fixed columns of every export, followed by one score column per question
+BASE_COLUMNS = ["submission_id", "student_name", "status", "submitted_at", "total_score", "max_score"]
+
+def export_columns(teacher_id: str, exam_id: int) -> List[str]:
+    """
+    Return the question columns of an exam's export.
+
+    The exam's current questions come first, in their order, followed by questions that
+    were answered in submissions but have since been removed from the exam.
+    """
+    columns = list(load_questions(teacher_id, exam_id))
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT a.question_text FROM submission_answers a JOIN submissions s ON s.id = a.submission_id
+            WHERE s.teacher_id = ? AND s.exam_id = ?
+            GROUP BY a.question_text ORDER BY MIN(a.position)
+            ''', (teacher_id, exam_id))
+            columns += [row['question_text'] for row in cursor.fetchall() if row['question_text'] not in columns]
+    except sqlite3.Error:
+        pass
+    return columns
+
+def empty_results(columns: List[str]) -> pd.DataFrame:
+    """An export without rows, with the same columns and dtypes as the chunks of `iter_result_chunks`."""
+    frame = pd.DataFrame({
+        "submission_id": pd.Series(dtype="int64"),
+        "student_name": pd.Series(dtype="str"),
+        "status": pd.Series(dtype="str"),
+        "submitted_at": pd.Series(dtype="datetime64[ns, UTC]"),
+        "total_score": pd.Series(dtype="int64"),
+        "max_score": pd.Series(dtype="int64")
+    })
+    for column in columns:
+        frame[column] = pd.Series(dtype="float64")
+    return frame
+
+def iter_result_chunks(teacher_id: str, exam_id: int, chunk_size: int = EXPORT_CHUNK_SIZE,
+                       columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Read an exam's results in chunks of `chunk_size` submissions.
+
+    Each chunk is a DataFrame with one row per submission: the BASE_COLUMNS followed by the
+    score of every question (NaN when unanswered or not graded yet). Every chunk has the
+    same columns and dtypes, so chunks can be appended to one CSV or Parquet file.
+
+    Args:
+        teacher_id (str): The teacher who owns the exam.
+        exam_id (int): The exam to export.
+        chunk_size (int): Submissions per chunk.
+        columns (Optional[List[str]]): Question columns, defaults to `export_columns`.
+    """
+    if columns is None:
+        columns = export_columns(teacher_id, exam_id)
+    last_id = 0
+    while True:
+        # Keyset pagination over the submission IDs keeps every chunk an indexed range scan
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None  # Plain tuples are much cheaper than Row objects at this volume
+            cursor.execute('''
+            SELECT id, student_name, status, created_at, total_score, max_score FROM submissions
+            WHERE teacher_id = ? AND exam_id = ? AND id > ? ORDER BY id LIMIT ?
+            ''', (teacher_id, exam_id, last_id, chunk_size))
+            headers = cursor.fetchall()
+            if not headers:
+                return
+            cursor.execute('''
+            SELECT a.submission_id, a.question_text, a.score FROM submission_answers a JOIN submissions s ON s.id = a.submission_id
+            WHERE a.submission_id BETWEEN ? AND ? AND s.teacher_id = ? AND s.exam_id = ? AND a.score IS NOT NULL
+            ''', (headers[0][0], headers[-1][0], teacher_id, exam_id))
+            scores = cursor.fetchall()
+        last_id = headers[-1][0]
+
+        frame = pd.DataFrame(headers, columns=BASE_COLUMNS)
+        frame["submitted_at"] = pd.to_datetime(frame["submitted_at"], unit="s", utc=True)
+        if scores:
+            # One column per question, in the export's column order
+            pivot = (pd.DataFrame(scores, columns=["submission_id", "question_text", "score"])
+                     .pivot(index="submission_id", columns="question_text", values="score"))
+            pivot = pivot.reindex(index=frame["submission_id"], columns=columns)
+        else:
+            pivot = pd.DataFrame(index=frame["submission_id"], columns=columns)
+        pivot = pivot.astype("float64").reset_index(drop=True)
+        yield pd.concat([frame, pivot], axis=1)
+
+def export_results(teacher_id: str, exam_id: int, destination: Union[str, BinaryIO], fmt: str = "csv",
+                   chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+    """
+    Write an exam's results to a CSV or Parquet file, one chunk at a time.
+
+    Args:
+        teacher_id (str): The teacher who owns the exam.
+        exam_id (int): The exam to export.
+        destination (Union[str, BinaryIO]): File path or binary file object to write to.
+        fmt (str): "csv" or "parquet" (needs pyarrow).
+        chunk_size (int): Submissions read and written per chunk.
+
+    Returns:
+        int: The number of exported submissions.
+
+    Raises:
+        ValueError: If the format is not supported.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    columns = export_columns(teacher_id, exam_id)
+    rows = 0
+    if fmt == "csv":
+        handle = open(destination, "wb") if isinstance(destination, str) else destination
+        try:
+            for chunk in iter_result_chunks(teacher_id, exam_id, chunk_size, columns):
+                chunk.to_csv(handle, header=rows == 0, index=False, encoding="utf-8")
+                rows += len(chunk)
+            if rows == 0:
+                # Header only, so an exam without submissions still exports its columns
+                empty_results(columns).to_csv(handle, index=False, encoding="utf-8")
+        finally:
+            if isinstance(destination, str):
+                handle.close()
+        return rows
+
+    # pyarrow is only needed for Parquet exports
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    # Fix the schema up front, so a chunk where a column happens to be all empty still matches
+    schema = pa.Schema.from_pandas(empty_results(columns), preserve_index=False)
+    with pq.ParquetWriter(destination, schema) as writer:
+        for chunk in iter_result_chunks(teacher_id, exam_id, chunk_size, columns):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            rows += len(chunk)
+    return rows
+
+# Usage: python export_results.py TEACHER_ID EXAM_ID results.csv [--format parquet] [--chunk-size N]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export an exam's results with one row per student.")
+    parser.add_argument("teacher", help="Teacher ID")
+    parser.add_argument("exam", type=int, help="Exam ID")
+    parser.add_argument("output", help="Output file")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, help="Defaults to the output file's extension")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE, help="Submissions per chunk")
+    args = parser.parse_args()
+
+    fmt = args.format or ("parquet" if args.output.endswith(".parquet") else "csv")
+    count = export_results(args.teacher, args.exam, args.output, fmt, args.chunk_size)
+    print(f"Exported {count} submission(s) to {args.output}.")
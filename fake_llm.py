@@ -0,0 +1,220 @@
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Dict, Any, Optional
+
+# Local stand-in for the Azure OpenAI chat completions endpoint, used to measure
+# and test the grading path offline. Point the app at it with ENDPOINT_URL or
+# llm_client.configure(endpoint=server.url, api_key="fake").
+
+def default_response(body: Dict[str, Any]) -> str:
+    """Build a plausible reply for the prompts sent by evaluation.py."""
+    prompt = body["messages"][-1]["content"]
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        batch = re.search(r"Student Answers \(JSON list of id and answer\): (\[.*\])", prompt)
+        if batch:
+            # Batch grading: one result per answer ID
+            items = json.loads(batch.group(1))
+            return json.dumps({
+                "subject": "Science",
+                "results": [{"id": item["id"], "score": random.randint(0, 10), "feedback": "Fake feedback."} for item in items]
+            })
+        return json.dumps({"subject": "Science", "score": random.randint(0, 10), "feedback": "Fake feedback."})
+    if "Score: [X/10]" in prompt:
+        return f"Score: {random.randint(0, 10)}/10\nFeedback: Fake feedback."
+    if "identify the academic subject" in prompt:
+        return "Science"
+    return "The student did well overall. Fake report."
+
+class FakeLLMServer:
+    """
+    Threaded HTTP server that answers chat completion requests.
+
+    Args:
+        latency (str): Latency distribution, one of "fixed", "uniform" or "lognormal".
+        latency_mean (float): Mean response time in seconds.
+        latency_spread (float): Half-width of the uniform distribution, or sigma of the lognormal one.
+        error_rate (float): Share of requests answered with a 500 error.
+        rate_limit_rate (float): Share of requests answered with a 429 error.
+        retry_after (float): Retry-After seconds sent with injected 429 errors.
+        responder (Optional[Callable]): Builds the reply content from the request body, defaults to `default_response`.
+        host (str): Interface to bind.
+        port (int): Port to bind, 0 picks a free one.
+        seed (Optional[int]): Seed for reproducible latencies and errors.
+    """
+
+    def __init__(self, latency: str = "fixed", latency_mean: float = 0.0, latency_spread: float = 0.0,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: float = 0.1,
+                 responder: Optional[Callable[[Dict[str, Any]], str]] = None,
+                 host: str = "127.0.0.1", port: int = 0, seed: Optional[int] = None):
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_spread = latency_spread
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.responder = responder or default_response
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0}
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        """Endpoint URL to pass as the Azure endpoint."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def sample_latency(self) -> float:
+        """Draw a response time from the configured distribution."""
+        with self.lock:
+            if self.latency == "uniform":
+                return max(0.0, self.random.uniform(self.latency_mean - self.latency_spread, self.latency_mean + self.latency_spread))
+            if self.latency == "lognormal" and self.latency_mean > 0:
+                # Parametrize so the distribution's mean equals latency_mean
+                sigma = self.latency_spread
+                mu = math.log(self.latency_mean) - sigma ** 2 / 2
+                return self.random.lognormvariate(mu, sigma)
+            return self.latency_mean
+
+    def _outcome(self) -> str:
+        """Decide whether the next request fails, is rate limited or succeeds."""
+        with self.lock:
+            self.stats["requests"] += 1
+            roll = self.random.random()
+            if roll < self.rate_limit_rate:
+                self.stats["rate_limited"] += 1
+                return "rate_limited"
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.stats["errors"] += 1
+                return "error"
+            self.stats["ok"] += 1
+            return "ok"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real endpoint
+
+            def log_message(self, format, *args):
+                pass  # Keep benchmark output clean
+
+            def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, body: Dict[str, Any], content: str):
+                """Send the reply as server-sent events, a few characters per chunk like streamed tokens."""
+                events = []
+                for start in range(0, len(content), 4):
+                    events.append({
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get("model", "fake"),
+                        "choices": [{"index": 0, "finish_reason": None, "delta": {"content": content[start:start + 4]}}]
+                    })
+                events.append({
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get("model", "fake"),
+                    "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}]
+                })
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    prompt_tokens = sum(len(message.get("content", "")) for message in body.get("messages", [])) // 4 + 1
+                    events.append({
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get("model", "fake"),
+                        "choices": [],
+                        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4 + 1,
+                                  "total_tokens": prompt_tokens + len(content) // 4 + 1}
+                    })
+                data = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+                data = data.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                time.sleep(server.sample_latency())
+                outcome = server._outcome()
+                if outcome == "rate_limited":
+                    self._send_json(429, {"error": {"message": "Rate limit exceeded", "code": "429"}},
+                                    {"Retry-After": str(server.retry_after)})
+                    return
+                if outcome == "error":
+                    self._send_json(500, {"error": {"message": "Internal server error", "code": "500"}})
+                    return
+                content = server.responder(body)
+                if body.get("stream"):
+                    self._send_stream(body, content)
+                    return
+                prompt_tokens = sum(len(message.get("content", "")) for message in body.get("messages", [])) // 4 + 1
+                self._send_json(200, {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "fake"),
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4 + 1,
+                              "total_tokens": prompt_tokens + len(content) // 4 + 1}
+                })
+
+        return Handler
+
+    def start(self) -> "FakeLLMServer":
+        """Serve requests on a background thread."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Shut the server down."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "FakeLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+# Usage: python fake_llm.py --port 8000 --latency lognormal --latency-mean 0.8
+# then run the app with ENDPOINT_URL=http://127.0.0.1:8000/ AZURE_OPENAI_API_KEY=fake
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local fake Azure OpenAI endpoint.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="fixed")
+    parser.add_argument("--latency-mean", type=float, default=0.5, help="Mean response time in seconds")
+    parser.add_argument("--latency-spread", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of 500 responses")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of 429 responses")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(args.latency, args.latency_mean, args.latency_spread, args.error_rate,
+                           args.rate_limit_rate, port=args.port)
+    print(f"Fake LLM endpoint listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,165 @@
+import contextvars
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Hashable, Iterator, Tuple
+from evaluation import evaluate_answer, evaluate_answers_batch
+
+# Maximum number of short answers graded in parallel for a single submission.
+# Each worker holds one in-flight Azure OpenAI request, so keep this below the
+# deployment's concurrency limits.
+GRADING_MAX_WORKERS = int(os.getenv("GRADING_MAX_WORKERS", "8"))
+
+def grade_multiple_choice(answer: List[str], correct_options: List[str]) -> Dict[str, Any]:
+    """Grade a multiple choice answer by comparing the selected options to the correct ones."""
+    correct = set(answer) == set(correct_options)  # Check if the answer is correct
+    score = 10 if correct else 0
+    feedback = "Correct! ✅" if correct else "Incorrect. Try reviewing this Question! 📖"
+    return {"correct": correct, "score": score, "feedback": feedback}
+
+def grade_submission_stream(questions: Dict[str, Dict[str, Any]], answers: Dict[str, Any], max_workers: Optional[int] = None,
+                            stream_feedback: bool = True) -> Iterator[Tuple[str, str, Any]]:
+    """
+    Grade every answer of a submission, yielding each grade as soon as it is done.
+
+    Short answers are evaluated on a bounded thread pool and reported in completion order,
+    so a page can show each question's result while the others are still being graded.
+    Events are `(kind, question text, value)` tuples:
+    - `("error", q_text, message)` for a question that can't be graded,
+    - `("feedback", q_text, text)` with the feedback streamed so far (only with `stream_feedback`),
+    - `("result", q_text, evaluation)` once the question is graded.
+    Events are produced on worker threads but always yielded on the caller's thread.
+
+    Args:
+        questions (Dict[str, Dict[str, Any]]): The exam questions keyed by question text.
+        answers (Dict[str, Any]): The student's answers keyed by question text.
+        max_workers (Optional[int]): Concurrency cap, defaults to GRADING_MAX_WORKERS.
+        stream_feedback (bool): Stream short answer feedback from the model while it is generated.
+    """
+    events = queue.Queue()
+    pending = 0
+
+    def evaluate(q_text: str, answer: str, q_data: Dict[str, Any]):
+        on_feedback = (lambda text: events.put(("feedback", q_text, text))) if stream_feedback else None
+        try:
+            evaluation = evaluate_answer(q_text, answer, q_data["reference"], q_data.get("subject"), on_feedback)
+        except Exception as e:
+            evaluation = {"correct": False, "score": 0, "feedback": "Error in evaluation", "error": True}
+            print(f"Evaluation error: {e}")
+        events.put(("result", q_text, evaluation))
+
+    with ThreadPoolExecutor(max_workers=max_workers or GRADING_MAX_WORKERS) as executor:
+        for q_text, answer in answers.items():
+            if answer is None:
+                continue  # Skip unanswered questions
+            q_data = questions[q_text]
+            if q_data.get("type") == "Short Answer":
+                if "reference" not in q_data:
+                    yield "error", q_text, f"Question '{q_text}' is missing 'reference' key."
+                    continue
+                # Run in the caller's context, so the request priority (see rate_limiter) carries over
+                executor.submit(contextvars.copy_context().run, evaluate, q_text, answer, q_data)
+                pending += 1
+            elif q_data.get("type") == "Multiple Choice":
+                if "correct" not in q_data or "options" not in q_data:
+                    yield "error", q_text, f"Question '{q_text}' is missing required keys."
+                    continue
+                yield "result", q_text, grade_multiple_choice(answer, q_data["correct"])
+
+        # Hand over the short answer events as the workers produce them
+        while pending:
+            event = events.get()
+            if event[0] == "result":
+                pending -= 1
+            yield event
+
+def summarize_grades(questions: Dict[str, Dict[str, Any]], answers: Dict[str, Any], evaluations: Dict[str, Dict[str, Any]], errors: List[str]) -> Dict[str, Any]:
+    """Build the result of a graded submission: evaluations in question order plus the totals."""
+    ordered = {q_text: evaluations[q_text] for q_text in answers if q_text in evaluations}
+    return {
+        "evaluations": ordered,
+        "total_score": sum(result["score"] for result in ordered.values()),
+        "max_score": len(questions) * 10,  # Maximum possible score
+        "errors": errors
+    }
+
+def grade_submission(questions: Dict[str, Dict[str, Any]], answers: Dict[str, Any], max_workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Grade every answer of a submission, evaluating short answers concurrently.
+
+    Short answer questions are sent to `evaluate_answer` through a bounded thread pool,
+    so the time to grade a submission tracks the slowest single answer instead of the
+    sum of all of them. Multiple choice questions are graded locally.
+
+    Args:
+        questions (Dict[str, Dict[str, Any]]): The exam questions keyed by question text.
+        answers (Dict[str, Any]): The student's answers keyed by question text.
+        max_workers (Optional[int]): Concurrency cap, defaults to GRADING_MAX_WORKERS.
+
+    Returns:
+        Dict[str, Any]: The `evaluations` (in question order), `total_score`, `max_score`
+        and a list of `errors` for questions that could not be graded.
+    """
+    evaluations = {}
+    errors = []
+    for kind, q_text, value in grade_submission_stream(questions, answers, max_workers, stream_feedback=False):
+        if kind == "result":
+            evaluations[q_text] = value
+        elif kind == "error":
+            errors.append(value)
+    return summarize_grades(questions, answers, evaluations, errors)
+
+def grade_submissions_batch(questions: Dict[str, Dict[str, Any]], submissions: Dict[Hashable, Dict[str, Any]], max_workers: Optional[int] = None) -> Dict[Hashable, Dict[str, Any]]:
+    """
+    Grade many submissions of the same exam, batching each question's answers across students.
+
+    Instead of one request per answer, every short answer question sends all of its answers
+    through `evaluate_answers_batch`; questions are graded concurrently.
+
+    Args:
+        questions (Dict[str, Dict[str, Any]]): The exam questions keyed by question text.
+        submissions (Dict[Hashable, Dict[str, Any]]): Each submission's answers keyed by question text,
+            keyed by any submission ID.
+        max_workers (Optional[int]): Concurrency cap, defaults to GRADING_MAX_WORKERS.
+
+    Returns:
+        Dict[Hashable, Dict[str, Any]]: For each submission ID, the same structure as `grade_submission`.
+    """
+    results = {}
+    short_answers = {}  # Question text -> {submission ID: answer}
+    for submission_id, answers in submissions.items():
+        evaluations = {}
+        errors = []
+        for q_text, answer in answers.items():
+            if answer is None:
+                continue  # Skip unanswered questions
+            q_data = questions.get(q_text)
+            if q_data is None:
+                errors.append(f"Question '{q_text}' no longer exists.")
+            elif q_data.get("type") == "Short Answer":
+                if "reference" not in q_data:
+                    errors.append(f"Question '{q_text}' is missing 'reference' key.")
+                    continue
+                evaluations[q_text] = None  # Filled in once the batch is graded
+                short_answers.setdefault(q_text, {})[submission_id] = answer
+            elif q_data.get("type") == "Multiple Choice":
+                if "correct" not in q_data or "options" not in q_data:
+                    errors.append(f"Question '{q_text}' is missing required keys.")
+                    continue
+                evaluations[q_text] = grade_multiple_choice(answer, q_data["correct"])
+        results[submission_id] = {"evaluations": evaluations, "errors": errors}
+
+    with ThreadPoolExecutor(max_workers=max_workers or GRADING_MAX_WORKERS) as executor:
+        pending = {
+            q_text: executor.submit(contextvars.copy_context().run, evaluate_answers_batch, q_text, questions[q_text]["reference"], answers, questions[q_text].get("subject"))
+            for q_text, answers in short_answers.items()
+        }
+        for q_text, future in pending.items():
+            for submission_id, evaluation in future.result().items():
+                results[submission_id]["evaluations"][q_text] = evaluation
+
+    max_score = len(questions) * 10  # Maximum possible score
+    for result in results.values():
+        result["total_score"] = sum(evaluation["score"] for evaluation in result["evaluations"].values())
+        result["max_score"] = max_score
+    return results
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+import database as db
+import metrics
+
+# Persistent cache of short answer grades, stored next to the main database.
+# Identical (normalized) answers to the same question are graded only once.
+CACHE_PATH = os.getenv("GRADING_CACHE_PATH", os.path.join(os.path.dirname(db.DB_PATH), "grading_cache.db"))
+# Maximum number of cached grades; least recently used entries are evicted first. 0 disables the cache.
+CACHE_MAX_ENTRIES = int(os.getenv("GRADING_CACHE_MAX_ENTRIES", "50000"))
+# The size is checked every CACHE_EVICT_INTERVAL puts, so the cache can briefly exceed the cap by that much
+CACHE_EVICT_INTERVAL = int(os.getenv("GRADING_CACHE_EVICT_INTERVAL", "100"))
+# Hits refresh last_used in batches: after this many hits or this many seconds, whichever comes first
+CACHE_TOUCH_BATCH = int(os.getenv("GRADING_CACHE_TOUCH_BATCH", "100"))
+CACHE_TOUCH_INTERVAL = float(os.getenv("GRADING_CACHE_TOUCH_INTERVAL", "30"))
+
+# Hit/miss counters for this process
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+_table_ready = False
+# One connection per thread, like database.db_connection
+_local = threading.local()
+# Cache keys hit since the last flush, with the time of their last hit
+_touched: Dict[str, float] = {}
+_touched_since = time.monotonic()
+_puts_since_check = 0
+_pending_lock = threading.Lock()
+
+def _connect() -> sqlite3.Connection:
+    """Open and tune a cache connection, creating the table on first use"""
+    global _table_ready
+    if not _table_ready:
+        os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(CACHE_PATH, timeout=db.DB_TIMEOUT)
+    # WAL lets graders read while another one writes; losing the last grades on a power cut only costs a re-grade
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    if not _table_ready:
+        _create_table(conn)
+        _table_ready = True
+    return conn
+
+@contextmanager
+def _cache_connection():
+    """Yield this thread's cache connection; anything left uncommitted is rolled back"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = _connect()
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+
+def _create_table(conn: sqlite3.Connection):
+    """Create the cache table and its indexes if they don't exist"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS grading_cache (
+        cache_key TEXT PRIMARY KEY,
+        question_hash TEXT NOT NULL,
+        result TEXT NOT NULL,
+        last_used REAL NOT NULL
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_grading_cache_last_used ON grading_cache (last_used)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_grading_cache_question ON grading_cache (question_hash)')
+    conn.commit()
+
+def normalize_answer(answer: str) -> str:
+    """Normalize an answer so trivially different copies (case, spacing, trailing punctuation) share a cache entry."""
+    text = unicodedata.normalize("NFKC", answer).casefold()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.strip(" .,;:!?")
+
+def _hash(*parts: str) -> str:
+    """Hash the given strings into a stable hex digest."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")  # Separator so ("ab", "c") and ("a", "bc") differ
+    return digest.hexdigest()
+
+def make_key(question: str, reference: str, student_answer: str, prompt_version: str) -> str:
+    """Build the content address of a grade."""
+    return _hash(question, reference or "", normalize_answer(student_answer), prompt_version)
+
+def get(question: str, reference: str, student_answer: str, prompt_version: str) -> Optional[Dict[str, Any]]:
+    """Return the cached grade for this answer, or None on a miss."""
+    if CACHE_MAX_ENTRIES <= 0:
+        return None
+    key = make_key(question, reference, student_answer, prompt_version)
+    start = time.perf_counter()
+    try:
+        with _cache_connection() as conn:
+            row = conn.execute('SELECT result FROM grading_cache WHERE cache_key = ?', (key,)).fetchone()
+            if row:
+                # Refresh the entry so it is evicted last, in a later batched write
+                _touch(conn, key)
+    except sqlite3.Error:
+        row = None  # A broken cache must never break grading
+    with _stats_lock:
+        _stats["hits" if row else "misses"] += 1
+    metrics.record("cache", "grading_cache", (time.perf_counter() - start) * 1000, cache_hit=bool(row))
+    return json.loads(row[0]) if row else None
+
+def _touch(conn: sqlite3.Connection, key: str):
+    """Remember a hit, and write the buffered last_used times once the batch is full or old enough."""
+    global _touched, _touched_since
+    with _pending_lock:
+        _touched[key] = time.time()
+        if len(_touched) < CACHE_TOUCH_BATCH and time.monotonic() - _touched_since < CACHE_TOUCH_INTERVAL:
+            return
+        touched, _touched, _touched_since = _touched, {}, time.monotonic()
+    conn.executemany('UPDATE grading_cache SET last_used = ? WHERE cache_key = ?',
+                     [(used, key) for key, used in touched.items()])
+    conn.commit()
+
+def _evict(conn: sqlite3.Connection):
+    """Delete the least recently used entries beyond CACHE_MAX_ENTRIES."""
+    excess = conn.execute('SELECT COUNT(*) FROM grading_cache').fetchone()[0] - CACHE_MAX_ENTRIES
+    if excess > 0:
+        conn.execute('''
+        DELETE FROM grading_cache WHERE cache_key IN (
+            SELECT cache_key FROM grading_cache ORDER BY last_used LIMIT ?
+        )
+        ''', (excess,))
+
+def put(question: str, reference: str, student_answer: str, prompt_version: str, result: Dict[str, Any]):
+    """Store a grade; every CACHE_EVICT_INTERVAL puts, evict the least recently used entries beyond CACHE_MAX_ENTRIES."""
+    global _puts_since_check
+    if CACHE_MAX_ENTRIES <= 0:
+        return
+    key = make_key(question, reference, student_answer, prompt_version)
+    with _pending_lock:
+        _puts_since_check += 1
+        check = _puts_since_check >= CACHE_EVICT_INTERVAL
+        if check:
+            _puts_since_check = 0
+    try:
+        with _cache_connection() as conn:
+            conn.execute('''
+            INSERT OR REPLACE INTO grading_cache (cache_key, question_hash, result, last_used)
+            VALUES (?, ?, ?, ?)
+            ''', (key, _hash(question), json.dumps(result, ensure_ascii=False), time.time()))
+            if check:
+                _evict(conn)
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"Grading cache error: {e}")
+
+def invalidate_question(question: str) -> int:
+    """Drop every cached grade of a question, e.g. after its reference answer was edited."""
+    try:
+        with _cache_connection() as conn:
+            cursor = conn.execute('DELETE FROM grading_cache WHERE question_hash = ?', (_hash(question),))
+            conn.commit()
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        print(f"Grading cache error: {e}")
+        return 0
+
+def cache_stats() -> Dict[str, int]:
+    """Return this process's hit/miss counters and the number of cached grades."""
+    try:
+        with _cache_connection() as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM grading_cache').fetchone()[0]
+    except sqlite3.Error:
+        entries = 0
+    with _stats_lock:
+        return {"hits": _stats["hits"], "misses": _stats["misses"], "entries": entries}
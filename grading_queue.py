@@ -0,0 +1,146 @@
+import argparse
+import os
+import sqlite3
+import time
+from typing import List, Dict, Any
+import database as db
+import metrics
+import pre_grader
+import submission_manager
+from grading import grade_submissions_batch
+from utils import load_questions
+
+# When enabled, the student page saves submissions as "pending" and returns immediately;
+# a separate worker process (python grading_queue.py) grades them in the background.
+BACKGROUND_GRADING = os.getenv("BACKGROUND_GRADING", "0") == "1"
+
+# Worker tuning: grading requests sent in parallel, submissions graded together as one batch,
+# how long a claimed job stays locked, how often a failing job is retried and the base delay
+# between retries (seconds).
+WORKER_CONCURRENCY = int(os.getenv("GRADING_WORKER_CONCURRENCY", "4"))
+WORKER_BATCH_SIZE = int(os.getenv("GRADING_WORKER_BATCH", "50"))
+JOB_LEASE_SECONDS = float(os.getenv("GRADING_JOB_LEASE", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("GRADING_JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_DELAY = float(os.getenv("GRADING_JOB_RETRY_DELAY", "5"))
+
+def claim_jobs(limit: int) -> List[Dict[str, Any]]:
+    """
+    Claim up to `limit` grading jobs that are ready to run.
+
+    Claimed jobs are leased for JOB_LEASE_SECONDS. A job whose worker died keeps its
+    "running" status but its lease expires, so it is claimed again after a restart.
+    """
+    now = time.time()
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            # Take the write lock so two workers never claim the same job
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+            SELECT id, submission_id, attempts FROM grading_jobs
+            WHERE status IN ('queued', 'running') AND available_at <= ?
+            AND (locked_until IS NULL OR locked_until < ?)
+            ORDER BY id LIMIT ?
+            ''', (now, now, limit))
+            jobs = [dict(row) for row in cursor.fetchall()]
+            cursor.executemany('''
+            UPDATE grading_jobs SET status = 'running', attempts = attempts + 1, locked_until = ?
+            WHERE id = ?
+            ''', [(now + JOB_LEASE_SECONDS, job['id']) for job in jobs])
+            conn.commit()
+            return jobs
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return []
+
+def complete_job(job_id: int):
+    """Mark a job as done."""
+    with db.db_connection() as conn:
+        conn.execute("UPDATE grading_jobs SET status = 'done', locked_until = NULL, last_error = NULL WHERE id = ?", (job_id,))
+        conn.commit()
+
+def fail_job(job: Dict[str, Any], error: str):
+    """Schedule a failed job for retry with exponential backoff, or give up after JOB_MAX_ATTEMPTS."""
+    attempts = job['attempts'] + 1  # Includes the attempt that just failed
+    with db.db_connection() as conn:
+        if attempts >= JOB_MAX_ATTEMPTS:
+            conn.execute("UPDATE grading_jobs SET status = 'failed', locked_until = NULL, last_error = ? WHERE id = ?",
+                         (error, job['id']))
+            conn.execute("UPDATE submissions SET status = 'failed' WHERE id = ?", (job['submission_id'],))
+        else:
+            retry_at = time.time() + JOB_RETRY_DELAY * 2 ** (attempts - 1)
+            conn.execute('''
+            UPDATE grading_jobs SET status = 'queued', locked_until = NULL, last_error = ?, available_at = ?
+            WHERE id = ?
+            ''', (error, retry_at, job['id']))
+        conn.commit()
+
+def _store_result(job: Dict[str, Any], result: Dict[str, Any]):
+    """Store the grades of a job's submission, or schedule a retry if any answer failed."""
+    # Retry when any answer could not be graded; answers graded this time are cached
+    failed = [q_text for q_text, evaluation in result['evaluations'].items() if evaluation.get('error')]
+    if failed:
+        fail_job(job, f"{len(failed)} answer(s) could not be graded")
+    elif not submission_manager.update_submission_grades(job['submission_id'], result['evaluations'],
+                                                        result['total_score'], result['max_score']):
+        fail_job(job, "Failed to store grades")
+    else:
+        complete_job(job['id'])
+
+def process_jobs(jobs: List[Dict[str, Any]], concurrency: int = WORKER_CONCURRENCY):
+    """
+    Grade the submissions of claimed jobs and store the results.
+
+    Jobs of the same exam are graded together, so each question's answers go to the
+    model in batches instead of one request per student.
+    """
+    groups = {}  # (teacher ID, exam ID) -> [(job, submission)]
+    for job in jobs:
+        submission = submission_manager.load_submission(job['submission_id'])
+        if submission is None:
+            fail_job(job, f"Submission {job['submission_id']} not found")
+            continue
+        groups.setdefault((submission['teacher_id'], submission['exam_id']), []).append((job, submission))
+
+    for (teacher_id, exam_id), items in groups.items():
+        try:
+            questions = load_questions(teacher_id, exam_id)
+            with metrics.exam_context(teacher_id, exam_id):
+                results = grade_submissions_batch(questions, {job['id']: submission['answers'] for job, submission in items},
+                                                  max_workers=concurrency)
+        except Exception as e:
+            print(f"Grading exam {exam_id} failed: {e}")
+            for job, _ in items:
+                fail_job(job, str(e))
+            continue
+        for job, _ in items:
+            _store_result(job, results[job['id']])
+
+def run_worker(concurrency: int = WORKER_CONCURRENCY, batch_size: int = WORKER_BATCH_SIZE, poll_interval: float = 1.0, once: bool = False):
+    """
+    Drain the grading queue in batches.
+
+    Args:
+        concurrency (int): Number of grading requests sent in parallel.
+        batch_size (int): Number of jobs claimed and graded together.
+        poll_interval (float): Seconds to wait when the queue is empty.
+        once (bool): Stop when the queue is empty instead of polling forever.
+    """
+    while True:
+        jobs = claim_jobs(batch_size)
+        if not jobs:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        process_jobs(jobs, concurrency)
+        print(f"Graded {len(jobs)} submission(s), model calls avoided so far: {pre_grader.pre_grade_stats()['avoided']}")
+
+# Usage: python grading_queue.py [--concurrency N] [--batch-size N] [--once]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grade pending submissions in the background.")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="Grading requests sent in parallel")
+    parser.add_argument("--batch-size", type=int, default=WORKER_BATCH_SIZE, help="Submissions graded together")
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+    args = parser.parse_args()
+    run_worker(args.concurrency, args.batch_size, once=args.once)
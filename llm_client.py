@@ -0,0 +1,181 @@
+import os
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+import metrics
+import rate_limiter
+
+# The OpenAI SDK is slow to import, so it is loaded on the first request instead of with the pages
+if TYPE_CHECKING:
+    from openai import AzureOpenAI
+
+# Azure OpenAI configuration
+# Retrieve configuration details for Azure OpenAI from environment variables,
+# with default values provided for local testing or fallback.
+ENDPOINT = os.getenv("ENDPOINT_URL", "https://your_account.openai.azure.com/")
+API_KEY = os.getenv("AZURE_OPENAI_API_KEY", "your_azure_openAI_KEY❤️")
+API_VERSION = "2025-01-01-preview"
+
+# Request tuning: per-call timeout in seconds and how often to retry
+# rate limited (429) or failed (5xx / connection) requests.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> "AzureOpenAI":
+    """
+    Return the process-wide Azure OpenAI client, creating it on first use.
+
+    The client keeps a pool of keep-alive HTTP connections, so sharing one instance
+    across all sessions and threads avoids a new TCP/TLS handshake for every request.
+    Retries are handled by `chat_completion`, so the client's own retries are disabled.
+    """
+    global _client
+    if _client is None:
+        from openai import AzureOpenAI
+        with _client_lock:
+            if _client is None:
+                _client = AzureOpenAI(
+                    azure_endpoint=ENDPOINT,
+                    api_key=API_KEY,
+                    api_version=API_VERSION,
+                    timeout=LLM_TIMEOUT,
+                    max_retries=0
+                )
+    return _client
+
+def configure(endpoint: Optional[str] = None, api_key: Optional[str] = None):
+    """
+    Point the shared client at another endpoint, e.g. a local fake server in tests.
+
+    The current client is closed and a new one is created on the next call.
+    """
+    global _client, ENDPOINT, API_KEY
+    with _client_lock:
+        if endpoint is not None:
+            ENDPOINT = endpoint
+        if api_key is not None:
+            API_KEY = api_key
+        if _client is not None:
+            _client.close()
+        _client = None
+
+def _is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections are worth retrying."""
+    from openai import APIConnectionError, APIStatusError
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+def _backoff_delay(attempt: int, error: Exception) -> float:
+    """Seconds to wait before the next attempt: the server's Retry-After if given, else exponential backoff with full jitter."""
+    from openai import APIStatusError
+    if isinstance(error, APIStatusError):
+        retry_after = error.response.headers.get("retry-after")
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), LLM_BACKOFF_MAX)
+        except ValueError:
+            pass  # Retry-After may also be an HTTP date, fall back to backoff
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+def _record_request(start: float, retries: Optional[int], usage: Any = None, error: Optional[Exception] = None):
+    """Record the latency, token usage, retries and error of one request in the metrics table."""
+    metrics.record(
+        "llm", metrics.current_operation() or "chat_completion", (time.perf_counter() - start) * 1000,
+        prompt_tokens=getattr(usage, "prompt_tokens", None), completion_tokens=getattr(usage, "completion_tokens", None),
+        retries=retries, error=None if error is None else f"{type(error).__name__}: {error}"
+    )
+
+def _create(start: float, model: str, messages: List[Dict[str, str]], max_tokens: int, timeout: Optional[float], **kwargs: Any):
+    """Send a request within the shared rate limit, retrying transient errors; returns the response and the number of retries."""
+    client = get_client()
+    tokens = rate_limiter.estimate_request_tokens(messages, max_tokens)
+    attempt = 0
+    while True:
+        try:
+            rate_limiter.acquire(tokens)
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                timeout=timeout or LLM_TIMEOUT,
+                **kwargs
+            )
+            return response, attempt
+        except Exception as e:
+            if attempt == LLM_MAX_RETRIES or not _is_retryable(e):
+                _record_request(start, attempt, error=e)
+                raise
+            time.sleep(_backoff_delay(attempt, e))
+            attempt += 1
+
+def chat_completion(model: str, messages: List[Dict[str, str]], max_tokens: int, timeout: Optional[float] = None, **kwargs: Any):
+    """
+    Send a chat completion request through the shared client.
+
+    Every attempt first waits for the shared RPM/TPM budget (see rate_limiter), so
+    concurrent sessions and processes stay within the deployment's limits together.
+
+    Args:
+        model (str): The deployment name to call.
+        messages (List[Dict[str, str]]): The chat messages.
+        max_tokens (int): Upper bound on completion tokens.
+        timeout (Optional[float]): Per-call timeout in seconds, defaults to LLM_TIMEOUT.
+        **kwargs: Extra arguments passed to `chat.completions.create`.
+
+    Returns:
+        The chat completion response.
+
+    Raises:
+        openai.APIError: When the request fails with a non-retryable error or retries are exhausted.
+        rate_limiter.RateLimitTimeout: When the shared budget has no room for the request in time.
+    """
+    start = time.perf_counter()
+    response, retries = _create(start, model, messages, max_tokens, timeout, **kwargs)
+    # Streams are recorded by chat_completion_stream once they have been read
+    if not kwargs.get("stream"):
+        _record_request(start, retries, response.usage)
+    return response
+
+def chat_completion_stream(model: str, messages: List[Dict[str, str]], max_tokens: int, on_delta: Callable[[str], None], timeout: Optional[float] = None, **kwargs: Any) -> str:
+    """
+    Send a streaming chat completion request and pass each piece of content to `on_delta` as it arrives.
+
+    Opening the stream is retried like `chat_completion`; an error in the middle of the
+    stream is raised, since part of the reply has already been delivered.
+
+    Args:
+        model (str): The deployment name to call.
+        messages (List[Dict[str, str]]): The chat messages.
+        max_tokens (int): Upper bound on completion tokens.
+        on_delta (Callable[[str], None]): Called with every new piece of content.
+        timeout (Optional[float]): Per-call timeout in seconds, defaults to LLM_TIMEOUT.
+        **kwargs: Extra arguments passed to `chat.completions.create`.
+
+    Returns:
+        str: The complete reply content.
+    """
+    start = time.perf_counter()
+    # Ask for the token usage, sent in a last chunk without choices
+    stream, retries = _create(start, model, messages, max_tokens, timeout, stream=True,
+                              stream_options={"include_usage": True}, **kwargs)
+    content, usage = [], None
+    try:
+        with stream:
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                # Azure sends chunks without choices, e.g. content filter results
+                if chunk.choices and chunk.choices[0].delta.content:
+                    content.append(chunk.choices[0].delta.content)
+                    on_delta(chunk.choices[0].delta.content)
+    except Exception as e:
+        _record_request(start, retries, usage, e)
+        raise
+    _record_request(start, retries, usage)
+    return "".join(content)
@@ -0,0 +1,210 @@
+import atexit
+import contextvars
+import functools
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, List, Optional
+import database as db
+
+# pandas is only needed by the dashboard, so it is loaded there instead of with every page
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Local performance metrics: latency, tokens, retries, cache hits and errors of LLM calls,
+# grading steps and database calls. Records are buffered in memory and written in batches
+# to their own SQLite file, so timing a call costs a clock read and a list append.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_PATH = os.getenv("METRICS_PATH", os.path.join(os.path.dirname(db.DB_PATH), "metrics.db"))
+# Seconds between background flushes, and buffered records that trigger an early one
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+METRICS_FLUSH_SIZE = int(os.getenv("METRICS_FLUSH_SIZE", "500"))
+# Records older than this many days are deleted
+METRICS_RETENTION_DAYS = float(os.getenv("METRICS_RETENTION_DAYS", "30"))
+# Price per 1000 prompt and completion tokens, used for the cost per exam
+LLM_PROMPT_COST_PER_1K = float(os.getenv("LLM_PROMPT_COST_PER_1K", "0.002"))
+LLM_COMPLETION_COST_PER_1K = float(os.getenv("LLM_COMPLETION_COST_PER_1K", "0.008"))
+
+COLUMNS = ("ts", "kind", "name", "duration_ms", "prompt_tokens", "completion_tokens", "retries", "cache_hit", "error", "teacher_id", "exam_id")
+
+# The operation (e.g. "evaluate_answer") and the exam that LLM calls are made for
+_operation = contextvars.ContextVar("metrics_operation", default=None)
+_exam = contextvars.ContextVar("metrics_exam", default=(None, None))
+
+_buffer: List[tuple] = []
+_buffer_lock = threading.Lock()
+_flusher = None
+_table_ready = False
+
+@contextmanager
+def _metrics_connection():
+    """Open the metrics database, creating its table on first use"""
+    global _table_ready
+    if not _table_ready:
+        os.makedirs(os.path.dirname(METRICS_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(METRICS_PATH, timeout=5.0)
+    try:
+        if not _table_ready:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS metrics (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL NOT NULL,
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                duration_ms REAL,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                retries INTEGER,
+                cache_hit INTEGER,
+                error TEXT,
+                teacher_id TEXT,
+                exam_id TEXT
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_metrics_ts ON metrics (ts)')
+            conn.commit()
+            _table_ready = True
+        yield conn
+    finally:
+        conn.close()
+
+def record(kind: str, name: str, duration_ms: Optional[float] = None, prompt_tokens: Optional[int] = None,
+           completion_tokens: Optional[int] = None, retries: Optional[int] = None, cache_hit: Optional[bool] = None,
+           error: Optional[str] = None):
+    """
+    Buffer one metric record, tagged with the current exam (see `exam_context`).
+
+    Args:
+        kind (str): "llm" for requests to Azure, "call" for grading steps, "db" for database calls
+            and "cache" for cache lookups.
+        name (str): The function or operation, e.g. "evaluate_answer".
+    """
+    global _flusher
+    if not METRICS_ENABLED:
+        return
+    teacher_id, exam_id = _exam.get()
+    row = (time.time(), kind, name, duration_ms, prompt_tokens, completion_tokens, retries,
+           None if cache_hit is None else int(cache_hit), error, teacher_id, None if exam_id is None else str(exam_id))
+    with _buffer_lock:
+        _buffer.append(row)
+        full = len(_buffer) >= METRICS_FLUSH_SIZE
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_periodically, daemon=True)
+            _flusher.start()
+    if full:
+        flush()
+
+def flush():
+    """Write the buffered records to the metrics database."""
+    global _buffer
+    with _buffer_lock:
+        rows, _buffer = _buffer, []
+    if not rows:
+        return
+    try:
+        with _metrics_connection() as conn:
+            conn.executemany(f'INSERT INTO metrics ({", ".join(COLUMNS)}) VALUES ({", ".join("?" for _ in COLUMNS)})', rows)
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"Metrics error: {e}")
+
+def _flush_periodically():
+    last_prune = 0.0
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+        if time.time() - last_prune > 3600:
+            prune()
+            last_prune = time.time()
+
+def prune():
+    """Delete records older than METRICS_RETENTION_DAYS."""
+    try:
+        with _metrics_connection() as conn:
+            conn.execute('DELETE FROM metrics WHERE ts < ?', (time.time() - METRICS_RETENTION_DAYS * 86400,))
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"Metrics error: {e}")
+
+atexit.register(flush)
+
+@contextmanager
+def exam_context(teacher_id: str, exam_id: Any):
+    """Attribute the metrics recorded inside the block (e.g. LLM tokens) to an exam."""
+    token = _exam.set((teacher_id, exam_id))
+    try:
+        yield
+    finally:
+        _exam.reset(token)
+
+def current_operation() -> Optional[str]:
+    """Return the name of the timed operation running in the current context."""
+    return _operation.get()
+
+def timed(kind: str, name: Optional[str] = None) -> Callable:
+    """
+    Decorator that records the latency of every call, and the error if it raises.
+
+    Functions timed with kind "call" also name the LLM requests made inside them.
+    """
+    def decorator(func: Callable) -> Callable:
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS_ENABLED:
+                return func(*args, **kwargs)
+            token = _operation.set(label) if kind == "call" else None
+            start = time.perf_counter()
+            error = None
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                record(kind, label, (time.perf_counter() - start) * 1000, error=error)
+                if token is not None:
+                    _operation.reset(token)
+        return wrapper
+    return decorator
+
+def load_metrics(since: float) -> "pd.DataFrame":
+    """Load the records written since the given UNIX time, including this process's buffered ones."""
+    import pandas as pd
+    flush()
+    try:
+        with _metrics_connection() as conn:
+            return pd.read_sql_query(f'SELECT {", ".join(COLUMNS)} FROM metrics WHERE ts >= ?', conn, params=(since,))
+    except sqlite3.Error:
+        return pd.DataFrame(columns=COLUMNS)
+
+def latency_summary(frame: "pd.DataFrame") -> "pd.DataFrame":
+    """Per kind and name: calls, p50/p95 latency, error rate, retries, cache hit rate and tokens."""
+    import pandas as pd
+    if frame.empty:
+        return pd.DataFrame(columns=["kind", "name", "calls", "p50_ms", "p95_ms", "error_rate", "retries", "cache_hit_rate", "prompt_tokens", "completion_tokens"])
+    grouped = frame.assign(failed=frame["error"].notna()).groupby(["kind", "name"])
+    return pd.DataFrame({
+        "calls": grouped.size(),
+        "p50_ms": grouped["duration_ms"].quantile(0.5),
+        "p95_ms": grouped["duration_ms"].quantile(0.95),
+        "error_rate": grouped["failed"].mean(),
+        "retries": grouped["retries"].sum(),
+        "cache_hit_rate": grouped["cache_hit"].mean(),
+        "prompt_tokens": grouped["prompt_tokens"].sum(),
+        "completion_tokens": grouped["completion_tokens"].sum()
+    }).reset_index().sort_values(["kind", "p95_ms"], ascending=[True, False])
+
+def cost_per_exam(frame: "pd.DataFrame") -> "pd.DataFrame":
+    """Per teacher and exam: LLM requests, tokens and their estimated cost."""
+    import pandas as pd
+    llm = frame[(frame["kind"] == "llm") & frame["exam_id"].notna()]
+    if llm.empty:
+        return pd.DataFrame(columns=["teacher_id", "exam_id", "requests", "prompt_tokens", "completion_tokens", "cost"])
+    costs = llm.groupby(["teacher_id", "exam_id"]).agg(
+        requests=("name", "size"), prompt_tokens=("prompt_tokens", "sum"), completion_tokens=("completion_tokens", "sum"))
+    costs["cost"] = (costs["prompt_tokens"] * LLM_PROMPT_COST_PER_1K + costs["completion_tokens"] * LLM_COMPLETION_COST_PER_1K) / 1000
+    return costs.reset_index().sort_values("cost", ascending=False)
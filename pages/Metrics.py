@@ -0,0 +1,60 @@
+import time
+import streamlit as st
+import metrics
+from exam_manager import load_exams
+
+# Time windows the dashboard can show, in seconds
+WINDOWS = {"Last hour": 3600, "Last 24 hours": 86400, "Last 7 days": 7 * 86400, "Last 30 days": 30 * 86400}
+
+# Check if user is authenticated, redirect to login if not
+if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
+    st.error("Please login first! ⚠️")
+    st.page_link("Home.py", label="Go to Login")
+else:
+    teacher_id = st.session_state["teacher_id"]
+    st.title("Eshraq - Performance")
+
+    window = st.selectbox("Time window:", list(WINDOWS), index=1)
+    frame = metrics.load_metrics(time.time() - WINDOWS[window])
+    if frame.empty:
+        st.write("No metrics recorded in this time window.")
+    else:
+        llm = frame[frame["kind"] == "llm"]
+        col1, col2, col3 = st.columns(3)
+        col1.metric("LLM requests", len(llm))
+        col2.metric("Error rate", f"{llm['error'].notna().mean():.1%}" if len(llm) else "-")
+        col3.metric("Retries", int(llm["retries"].sum()))
+
+        # Slowest operations first within each kind (llm, call, db, cache, error)
+        st.write("### Latency")
+        st.dataframe(
+            metrics.latency_summary(frame),
+            column_config={
+                "p50_ms": st.column_config.NumberColumn("p50 (ms)", format="%.0f"),
+                "p95_ms": st.column_config.NumberColumn("p95 (ms)", format="%.0f"),
+                "error_rate": st.column_config.NumberColumn("Errors", format="percent"),
+                "cache_hit_rate": st.column_config.NumberColumn("Cache hits", format="percent")
+            },
+            hide_index=True
+        )
+
+        # Token usage and estimated cost of this teacher's exams
+        st.write("### Cost per exam")
+        exam_names = {str(exam_id): name for exam_id, name in load_exams(teacher_id).items()}
+        costs = metrics.cost_per_exam(frame)
+        costs = costs[costs["teacher_id"] == teacher_id].drop(columns="teacher_id")
+        if costs.empty:
+            st.write("No LLM requests were made for your exams in this time window.")
+        else:
+            costs.insert(0, "exam", costs["exam_id"].map(lambda exam_id: exam_names.get(exam_id, exam_id)))
+            st.dataframe(
+                costs.drop(columns="exam_id"),
+                column_config={"cost": st.column_config.NumberColumn("Estimated cost ($)", format="%.4f")},
+                hide_index=True
+            )
+
+        # Recent failures, newest first
+        errors = frame[frame["error"].notna()].sort_values("ts", ascending=False).head(20)
+        if not errors.empty:
+            st.write("### Recent errors")
+            st.dataframe(errors[["kind", "name", "error"]], hide_index=True)
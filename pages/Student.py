@@ -1,23 +1,32 @@
 import streamlit as st
-from utils import load_questions
-from submission_manager import save_submission
-from evaluation import evaluate_answer
-from openai import AzureOpenAI
-import pandas
-import os
+from streamlit_autorefresh import st_autorefresh
+from utils import load_exam_snapshot
+from submission_manager import load_submission, find_submission, submission_key, claim_submission, update_submission_grades
+from submission_writer import submit, reserve
+from grading import grade_submission_stream, summarize_grades
+from grading_queue import BACKGROUND_GRADING
+import metrics
 
-# Azure OpenAI configuration
-ENDPOINT = os.getenv("ENDPOINT_URL", "https://example-openai-endpoint.com/")  # Azure OpenAI endpoint URL
-API_KEY = os.getenv("AZURE_OPENAI_API_KEY", "Your-API-Key-Here")  # Azure OpenAI API key
-API_VERSION = "2025-01-01-preview"  # API version used
-DEPLOYMENT_NAME = os.getenv("DEPLOYMENT_NAME", "gpt-4.1")  # Deployment name for the model
+def display_results(questions, evaluations, total_score, max_score):
+    """Show the total score and per-topic insights of a graded submission."""
+    # Calculate topic-wise scores
+    topic_scores = {}
+    for q_text, eval in evaluations.items():
+        topic = questions[q_text].get("Question Number", "General") if q_text in questions else "General"
+        topic_scores.setdefault(topic, []).append(eval["score"])
+    feedback = f"Your total score is {total_score} out of {max_score}.\n\n**Performance Insights:**\n"
+    for topic, scores in topic_scores.items():
+        avg_score = sum(scores) / len(scores)
+        if avg_score < 7:
+            feedback += f"- {topic}: Avg. {avg_score:.1f}/10. Review the basics of {topic}. 📚\n"
+        else:
+            feedback += f"- {topic}: Avg. {avg_score:.1f}/10. Good work—keep practicing! 🌟\n"
+    st.write("**Exam Results**")
+    st.write(feedback)
 
-# Initialize Azure OpenAI client
-client = AzureOpenAI(
-    azure_endpoint=ENDPOINT,  # Passing the API endpoint URL
-    api_key=API_KEY,          # Passing the API key
-    api_version=API_VERSION   # Passing the API version
-)
+def display_question_result(placeholder, q_text, evaluation):
+    """Show the score and feedback of one graded question."""
+    placeholder.markdown(f"**{q_text}**\n\n**Score:** {evaluation['score']}/10\n\n{evaluation['feedback']}")
 
 # Retrieve teacher ID and exam ID from URL query parameters
 teacher_id = st.query_params.get("teacher_id", "teacher1")  # Default teacher ID
@@ -30,7 +39,7 @@ st.title("Eshraq - Exam Submission 📚")
 if not exam_id:
     st.error("No exam specified! Please use a valid exam link. ⚠️")  # Error message for missing exam ID
 else:
-    questions = load_questions(teacher_id, exam_id)  # Load the exam questions based on teacher and exam IDs
+    questions = load_exam_snapshot(teacher_id, exam_id)  # Load the exam questions (cached across reruns and sessions)
     if not questions:
         st.warning("No questions available for this exam yet. Ask your teacher to add some! ⚠️")  # Warning if no questions are found
     else:
@@ -61,56 +70,110 @@ else:
             else:
                 # Collect answers from session state
                 answers = {q_text: st.session_state.get(f"answer_{q_text}") for q_text in questions}
-                evaluations = {}
-                total_score = 0
-                max_score = len(questions) * 10  # Maximum possible score
+                key = submission_key(teacher_id, exam_id, student_name, answers)
+                submission = {
+                    "student_name": student_name,
+                    "answers": answers,
+                    "idempotency_key": key,
+                    "evaluations": {},
+                    "total_score": 0,
+                    "max_score": len(questions) * 10
+                }
+                previous = find_submission(teacher_id, exam_id, key)
+                submission_id = None
+                if previous is not None and previous["status"] in ("failed", "grading"):
+                    # Grading these answers failed or was abandoned: take the submission over and grade it again
+                    if claim_submission(previous["id"], queue_job=BACKGROUND_GRADING):
+                        submission_id = previous["id"]
+                if previous is not None and submission_id is None:
+                    # The same answers were already submitted (double click or refresh): show the stored result, don't grade again
+                    st.info("These answers were already submitted. ✅")
+                    if previous["status"] == "graded":
+                        st.write("**Your Answers**")
+                        for q_text, evaluation in previous["evaluations"].items():
+                            display_question_result(st.empty(), q_text, evaluation)
+                        display_results(questions, previous["evaluations"], previous["total_score"], previous["max_score"])
+                    else:
+                        st.session_state["pending_submission_id"] = previous["id"]
+                elif BACKGROUND_GRADING:
+                    # Save right away and let the background worker grade the submission
+                    if submission_id is None:
+                        submission_id = submit(teacher_id, exam_id, submission, status="pending")
+                    if submission_id:
+                        st.session_state["pending_submission_id"] = submission_id
+                        st.success("Your answers have been submitted successfully! ✅")
+                    else:
+                        st.error("Failed to submit your answers. Please try again. ⚠️")
+                else:
+                    if submission_id is None:
+                        # Reserve the answers before grading them, so a second click or a refresh waits for
+                        # this grading instead of paying for it again
+                        reservation = reserve(teacher_id, exam_id, submission)
+                        if reservation is not None and not reservation[1]:
+                            # Another click got there first: follow its grading
+                            st.info("These answers were already submitted. ✅")
+                            st.session_state["pending_submission_id"] = reservation[0]
+                        elif reservation is not None:
+                            submission_id = reservation[0]
+                        else:
+                            st.error("Failed to submit your answers. Please try again. ⚠️")
+                if submission_id and not BACKGROUND_GRADING:
+                    # This session now shows its own grading, not an earlier submission's
+                    st.session_state.pop("pending_submission_id", None)
+                    # Grade all answers concurrently and show each grade as soon as it is done
+                    st.write("**Your Answers**")
+                    placeholders = {q_text: st.empty() for q_text, answer in answers.items() if answer is not None}
+                    for q_text, placeholder in placeholders.items():
+                        placeholder.markdown(f"**{q_text}**\n\nGrading... ⏳")
+                    evaluations, errors = {}, []
+                    try:
+                        # Attribute the model's token usage to this exam on the metrics page
+                        with metrics.exam_context(teacher_id, exam_id):
+                            for kind, q_text, value in grade_submission_stream(questions, answers):
+                                if kind == "feedback":
+                                    # Feedback streamed from the model while it is still grading
+                                    placeholders[q_text].markdown(f"**{q_text}**\n\n⏳ {value}")
+                                elif kind == "result":
+                                    evaluations[q_text] = value
+                                    display_question_result(placeholders[q_text], q_text, value)
+                                else:
+                                    placeholders[q_text].empty()
+                                    errors.append(value)
+                                    st.error(f"{value} ⚠️")  # Report questions that could not be graded
+                    except BaseException:
+                        # Interrupted, e.g. by a rerun: release the reservation so the next submit grades it again
+                        update_submission_grades(submission_id, evaluations, 0, len(questions) * 10, status="failed")
+                        raise
+                    # Totals and saving happen once, after every question is graded
+                    result = summarize_grades(questions, answers, evaluations, errors)
+                    evaluations = result["evaluations"]
+                    total_score = result["total_score"]
+                    max_score = result["max_score"]  # Maximum possible score
+                    # Answers the model failed to grade are stored as failed, so submitting again re-grades them
+                    failed = any(evaluation.get("error") for evaluation in evaluations.values())
 
-                for q_text, answer in answers.items():
-                    if answer is None:
-                        continue  # Skip unanswered questions
-                    q_data = questions[q_text]
-                    if q_data.get("type") == "Short Answer":
-                        if "reference" not in q_data:
-                            st.error(f"Question '{q_text}' is missing 'reference' key.")  # Error if reference key is missing
-                            continue
-                        eval_result = evaluate_answer(q_text, answer, q_data["reference"])  # Evaluate short answer
-                        evaluations[q_text] = eval_result
-                        total_score += eval_result["score"]
-                    elif q_data.get("type") == "Multiple Choice":
-                        if "correct" not in q_data or "options" not in q_data:
-                            st.error(f"Question '{q_text}' is missing required keys.")  # Error if required keys are missing
-                            continue
-                        correct = set(answer) == set(q_data["correct"])  # Check if the answer is correct
-                        score = 10 if correct else 0
-                        feedback = "Correct! ✅" if correct else "Incorrect. Try reviewing this Question! 📖"
-                        evaluations[q_text] = {"correct": correct, "score": score, "feedback": feedback}
-                        total_score += score
+                    if evaluations:
+                        display_results(questions, evaluations, total_score, max_score)
 
-                if evaluations:
-                    # Calculate topic-wise scores
-                    topic_scores = {}
-                    for q_text, eval in evaluations.items():
-                        topic = questions[q_text].get("Question Number", "General")
-                        topic_scores.setdefault(topic, []).append(eval["score"])
-                    feedback = f"Your total score is {total_score} out of {max_score}.\n\n**Performance Insights:**\n"
-                    for topic, scores in topic_scores.items():
-                        avg_score = sum(scores) / len(scores)
-                        if avg_score < 7:
-                            feedback += f"- {topic}: Avg. {avg_score:.1f}/10. Review the basics of {topic}. 📚\n"
+                        # Only confirm once the grades are stored
+                        if not update_submission_grades(submission_id, evaluations, total_score, max_score,
+                                                        status="failed" if failed else "graded"):
+                            st.error("Failed to save your answers. Please submit them again. ⚠️")
+                        elif failed:
+                            st.error("Some answers could not be graded. Please submit them again. ⚠️")
                         else:
-                            feedback += f"- {topic}: Avg. {avg_score:.1f}/10. Good work—keep practicing! 🌟\n"
-                    st.write("**Exam Results**")
-                    st.write(feedback)
+                            st.success("Your answers have been submitted successfully! ✅")
+                    else:
+                        update_submission_grades(submission_id, {}, 0, max_score, status="failed")
+                        st.error("No valid answers were evaluated. Please check the questions. ⚠️")  # Error if no valid answers
 
-                    # Save the submission
-                    submission = {
-                        "student_name": student_name,
-                        "answers": answers,
-                        "evaluations": evaluations,
-                        "total_score": total_score,
-                        "max_score": max_score
-                    }
-                    save_submission(teacher_id, exam_id, submission)
-                    st.success("Your answers have been submitted successfully! ✅")
-                else:
-                    st.error("No valid answers were evaluated. Please check the questions. ⚠️")  # Error if no valid answers
+        # Poll for the result of this session's submission, graded in the background or by another click
+        if "pending_submission_id" in st.session_state:
+            submission = load_submission(st.session_state["pending_submission_id"])
+            if submission is None or submission["status"] == "failed":
+                st.error("We could not grade your answers. Please submit them again. ⚠️")
+            elif submission["status"] in ("pending", "grading"):
+                st.info("Grading your answers... Results will appear here automatically. ⏳")
+                st_autorefresh(interval=3 * 1000, key="grading_poll")
+            else:
+                display_results(questions, submission["evaluations"], submission["total_score"], submission["max_score"])
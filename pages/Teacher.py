@@ -1,14 +1,19 @@
 import streamlit as st
-import exam_management
-import question_editor
-import submission_viewer
-import utils
 
 # Check if user is authenticated, redirect to login if not
 if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
     st.error("Please login first! ⚠️")
     st.page_link("Home.py", label="Go to Login")
 else:
+    # The dashboard's modules (and pandas with them) are only loaded for logged-in teachers
+    import analytics_viewer
+    import bulk_import_viewer
+    import exam_management
+    import question_editor
+    import regrade
+    import submission_viewer
+    import utils
+
     # Get teacher ID from session and display dashboard
     teacher_id = st.session_state["teacher_id"]
     st.title(f"Eshraq - {teacher_id}'s Dashboard")
@@ -17,8 +22,26 @@ else:
     selected_exam_id, exams = exam_management.display_exam_management(teacher_id)
     
     if selected_exam_id:
-        # Create three tabs for different exam management functions
-        tab1, tab2, tab3 = st.tabs(["Add/Edit Questions", "Share Exam", "Manage Submissions"])
+        # Progress of the background re-grades started by changed reference answers
+        regrades = regrade.regrade_jobs(teacher_id, selected_exam_id)
+        for question_id, job in regrades.items():
+            col1, col2 = st.columns([4, 1])
+            if job["status"] == "running":
+                col1.progress(job["done"] / job["total"] if job["total"] else 1.0,
+                              text=f"Re-grading '{job['question']}': {job['done']}/{job['total']} answers")
+                if col2.button("Cancel ⏹️", key=f"regrade_cancel_{question_id}"):
+                    regrade.cancel_regrade(teacher_id, selected_exam_id, question_id)
+                    st.rerun()
+            else:
+                col1.write(f"Re-grade of '{job['question']}' {job['status']}: "
+                           f"{job['done'] - job['failed']}/{job['total']} answers updated.")
+        if any(job["status"] != "running" for job in regrades.values()):
+            if st.button("Dismiss finished re-grades", key="regrade_dismiss"):
+                regrade.clear_finished(teacher_id, selected_exam_id)
+                st.rerun()
+
+        # Create five tabs for different exam management functions
+        tab1, tab2, tab3, tab4, tab5 = st.tabs(["Add/Edit Questions", "Share Exam", "Manage Submissions", "Analytics", "Import Answers"])
 
         # Tab 1: Question Editor Interface
         with tab1:
@@ -37,8 +60,8 @@ else:
             with st.container(border=True):
                 st.write("## Eshraq - Exam")
                 st.write("Sample Student Name: _____________")
-                # Load and display all exam questions
-                questions = utils.load_questions(teacher_id, selected_exam_id)
+                # Load and display all exam questions from the snapshot students are served
+                questions = utils.load_exam_snapshot(teacher_id, selected_exam_id)
                 for q_text, q_data in questions.items():
                     st.write(f"\n**Question:** {q_text}")
                     # Handle different question types (Short Answer or Multiple Choice)
@@ -50,3 +73,11 @@ else:
         # Tab 3: Submission Management Interface
         with tab3:
             submission_viewer.display_submission_viewer(teacher_id, selected_exam_id, exams)
+
+        # Tab 4: Exam Analytics
+        with tab4:
+            analytics_viewer.display_analytics(teacher_id, selected_exam_id, exams)
+
+        # Tab 5: Bulk Import of Paper Answer Sheets
+        with tab5:
+            bulk_import_viewer.display_bulk_import(teacher_id, selected_exam_id, exams)
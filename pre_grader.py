@@ -0,0 +1,111 @@
+import os
+import re
+import threading
+from typing import TYPE_CHECKING, Dict, Any, List, Optional
+from grading_cache import normalize_answer
+
+# NumPy is loaded on the first pre-grade, so pages that never grade don't pay for the import
+if TYPE_CHECKING:
+    import numpy as np
+
+# Deterministic pre-scoring of short answers, run before any request to Azure OpenAI.
+# Clear-cut answers (blank, or identical to the reference after normalization) are graded
+# locally; everything else is sent to the model.
+PRE_GRADING = os.getenv("PRE_GRADING", "1") == "1"
+# Opt-in: grade answers sharing no vocabulary with the reference 0 without asking the model.
+# Off by default because a correct paraphrase can share no words with the reference
+# ("plants making food using sunlight" for "Photosynthesis", "twelve months" for "12").
+PRE_GRADE_UNRELATED = os.getenv("PRE_GRADE_UNRELATED", "0") == "1"
+# Share of the reference's words an answer may contain and still be graded 0 as unrelated
+PRE_GRADE_UNRELATED_OVERLAP = float(os.getenv("PRE_GRADE_UNRELATED_OVERLAP", "0.0"))
+# Shorter answers are never graded as unrelated
+PRE_GRADE_MIN_TOKENS = int(os.getenv("PRE_GRADE_MIN_TOKENS", "3"))
+
+FEEDBACK = {
+    "blank": "No answer was given.",
+    "exact": "Your answer matches the reference answer.",
+    "unrelated": "Your answer does not address the question.",
+}
+
+# Per-process counters: answers resolved by each rule, and answers left to the model
+_stats = {"blank": 0, "exact": 0, "unrelated": 0, "undecided": 0}
+_stats_lock = threading.Lock()
+
+def tokenize(text: str) -> List[str]:
+    """Split a normalized answer into word tokens."""
+    return re.findall(r"\w+", normalize_answer(text))
+
+def similarity_scores(reference: str, answers: List[str]) -> Dict[str, "np.ndarray"]:
+    """
+    Compare every answer with the reference's vocabulary in one vectorized pass.
+
+    Args:
+        reference (str): The reference answer.
+        answers (List[str]): The students' answers.
+
+    Returns:
+        Dict[str, np.ndarray]: Per answer, the `overlap` share of the reference's distinct
+        words it contains, and its `tokens` count.
+    """
+    import numpy as np
+    documents = [tokenize(reference)] + [tokenize(answer) for answer in answers]
+    vocabulary, rows, columns = {}, [], []
+    for row, tokens in enumerate(documents):
+        for token in tokens:
+            rows.append(row)
+            columns.append(vocabulary.setdefault(token, len(vocabulary)))
+    counts = np.zeros((len(documents), max(len(vocabulary), 1)))
+    np.add.at(counts, (rows, columns), 1)
+
+    present = counts > 0
+    reference_words = present[0].sum()
+    overlap = (present[1:] & present[0]).sum(axis=1) / max(reference_words, 1)
+    return {"overlap": overlap, "tokens": counts[1:].sum(axis=1)}
+
+def pre_grade(reference: str, answers: List[str], subject: Optional[str] = None) -> List[Optional[Dict[str, Any]]]:
+    """
+    Grade the clear-cut answers locally.
+
+    Args:
+        reference (str): The reference answer of the question.
+        answers (List[str]): The students' answers to the question.
+        subject (Optional[str]): The question's subject, reported in the results.
+
+    Returns:
+        List[Optional[Dict[str, Any]]]: One evaluation result per answer, or None where the
+        answer is ambiguous and has to be graded by the model.
+    """
+    if not PRE_GRADING or not answers:
+        return [None] * len(answers)
+    # The vectorized comparison is only needed by the opt-in unrelated rule
+    scores = similarity_scores(reference, answers) if PRE_GRADE_UNRELATED else None
+    normalized_reference = normalize_answer(reference)
+    results, counts = [], dict.fromkeys(_stats, 0)
+    for index, answer in enumerate(answers):
+        normalized = normalize_answer(answer or "")
+        if not normalized:
+            rule = "blank"
+        elif normalized == normalized_reference:
+            rule = "exact"
+        elif scores is not None and scores["tokens"][index] >= PRE_GRADE_MIN_TOKENS and scores["overlap"][index] <= PRE_GRADE_UNRELATED_OVERLAP:
+            rule = "unrelated"
+        else:
+            rule = "undecided"
+        counts[rule] += 1
+        if rule == "undecided":
+            results.append(None)
+            continue
+        # Only an exact match is graded 10 locally: signs, decimal points and fractions change an answer's meaning
+        score = 10 if rule == "exact" else 0
+        results.append({"correct": score >= 8, "score": score, "feedback": FEEDBACK[rule], "subject": subject, "pre_graded": rule})
+    with _stats_lock:
+        for rule, count in counts.items():
+            _stats[rule] += count
+    return results
+
+def pre_grade_stats() -> Dict[str, int]:
+    """Return this process's counts per rule plus the number of model calls avoided."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["avoided"] = stats["blank"] + stats["exact"] + stats["unrelated"]
+    return stats
@@ -1,4 +1,5 @@
 import streamlit as st
+import regrade
 import utils
 
 def display_question_editor(teacher_id: str, selected_exam_id: int, exams: dict):
@@ -67,8 +68,8 @@ def display_question_editor(teacher_id: str, selected_exam_id: int, exams: dict)
                 if new_question_text in questions:
                     st.error("Question already exists! ⚠️")
                 else:
-                    questions[new_question_text] = new_question_data
-                    if utils.save_questions(teacher_id, selected_exam_id, questions):
+                    # Insert only the new question, the others stay untouched
+                    if utils.upsert_questions(teacher_id, selected_exam_id, {new_question_text: new_question_data}):
                         st.success("New question added! ✅")
                         st.rerun()
                     else:
@@ -98,8 +99,9 @@ def display_question_editor(teacher_id: str, selected_exam_id: int, exams: dict)
                     if st.button(f"Delete ❌", key=f"delete_{q_text}"):
                         current_questions = utils.load_questions(teacher_id, selected_exam_id)
                         if q_text in current_questions:
-                            del current_questions[q_text]
-                            if utils.save_questions(teacher_id, selected_exam_id, current_questions):
+                            # Delete only this question by its ID
+                            if utils.delete_questions(teacher_id, selected_exam_id, [current_questions[q_text]['id']]):
+                                del current_questions[q_text]
                                 st.success("Question deleted successfully! ✅")
                                 st.session_state['questions'] = current_questions
                                 st.rerun()
@@ -127,16 +129,20 @@ def display_question_editor(teacher_id: str, selected_exam_id: int, exams: dict)
                     if st.button("Save Changes", key=f"save_{q_text}"):
                         if edit_question_text and edit_topic:
                             if q_data['type'] == "Short Answer" and edit_reference:
-                                questions.pop(q_text)
-                                questions[edit_question_text] = {
+                                # Update this question in place so it keeps its ID
+                                if utils.update_question(teacher_id, selected_exam_id, q_data['id'], edit_question_text, {
                                     "type": "Short Answer", 
                                     "Question Number": edit_topic, 
                                     "reference": edit_reference
-                                }
-                                utils.save_questions(teacher_id, selected_exam_id, questions)
-                                st.success("Question updated! ✅")
-                                st.session_state.pop('editing_question')
-                                st.rerun()
+                                }):
+                                    # Grades given against the old reference answer are stale now
+                                    if edit_reference != q_data['reference']:
+                                        regrade.start_regrade(teacher_id, selected_exam_id, q_data['id'])
+                                    st.success("Question updated! ✅")
+                                    st.session_state.pop('editing_question')
+                                    st.rerun()
+                                else:
+                                    st.error("Failed to update question! ⚠️")
                             elif q_data['type'] == "Multiple Choice":
                                 new_options = [opt.strip() for opt in edit_options_text.split("\n") if opt.strip()]
                                 seen = set()
@@ -150,16 +156,19 @@ def display_question_editor(teacher_id: str, selected_exam_id: int, exams: dict)
                                     if invalid_correct:
                                         st.error(f"Correct options {invalid_correct} are not in the list! ⚠️")
                                     else:
-                                        questions.pop(q_text)
-                                        questions[edit_question_text] = {
+                                        # Update this question in place so it keeps its ID
+                                        if utils.update_question(teacher_id, selected_exam_id, q_data['id'], edit_question_text, {
                                             "type": "Multiple Choice",
                                             "Question Number": edit_topic,
                                             "options": unique_new_options,
                                             "correct": edit_correct_options
-                                        }
-                                        utils.save_questions(teacher_id, selected_exam_id, questions)
-                                        st.success("Question updated! ✅")
-                                        st.session_state.pop('editing_question')
-                                        st.rerun()
+                                        }):
+                                            if set(edit_correct_options) != set(q_data['correct']):
+                                                regrade.start_regrade(teacher_id, selected_exam_id, q_data['id'])
+                                            st.success("Question updated! ✅")
+                                            st.session_state.pop('editing_question')
+                                            st.rerun()
+                                        else:
+                                            st.error("Failed to update question! ⚠️")
                         else:
                             st.error("Question and Question Number are required! ⚠️")
\ No newline at end of file
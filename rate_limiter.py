@@ -0,0 +1,141 @@
+import contextvars
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+import database as db
+
+# Requests and tokens per minute allowed by the Azure OpenAI deployment, shared by every
+# session, thread and process on this machine through a token bucket stored in SQLite.
+# Azure grants 6 requests per minute for every 1000 tokens per minute. 0 disables a limit.
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "300"))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "50000"))
+# Longest a request waits for budget before giving up (seconds)
+LLM_RATE_LIMIT_MAX_WAIT = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT", "120"))
+# Share of each budget that lower priority requests leave for student submissions
+LOW_PRIORITY_RESERVE = float(os.getenv("LLM_LOW_PRIORITY_RESERVE", "0.3"))
+LIMITER_PATH = os.getenv("LLM_RATE_LIMIT_PATH", os.path.join(os.path.dirname(db.DB_PATH), "rate_limit.db"))
+
+# Request priorities: student submissions go ahead of teacher re-grades
+STUDENT = 0
+REGRADE = 1
+
+_priority = contextvars.ContextVar("llm_priority", default=STUDENT)
+_table_ready = False
+_stats = {"requests": 0, "waits": 0, "waited_seconds": 0.0}
+_stats_lock = threading.Lock()
+
+class RateLimitTimeout(Exception):
+    """Raised when a request could not get enough budget within LLM_RATE_LIMIT_MAX_WAIT."""
+
+@contextmanager
+def priority(level: int):
+    """Send the LLM requests made inside the block with the given priority."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority() -> int:
+    """Return the priority of requests made in the current context."""
+    return _priority.get()
+
+def estimate_request_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    """Tokens a request counts against the TPM budget: the prompt (about four characters per token) plus max_tokens, as Azure counts them."""
+    return sum(len(message.get("content") or "") for message in messages) // 4 + 1 + max_tokens
+
+@contextmanager
+def _limiter_connection():
+    """Open the limiter database, creating its table on first use"""
+    global _table_ready
+    if not _table_ready:
+        os.makedirs(os.path.dirname(LIMITER_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(LIMITER_PATH, timeout=10.0, isolation_level=None)
+    try:
+        if not _table_ready:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                name TEXT PRIMARY KEY,
+                level REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+            ''')
+            _table_ready = True
+        yield conn
+    finally:
+        conn.close()
+
+def _try_acquire(tokens: int, reserve: float) -> float:
+    """
+    Take one request and `tokens` tokens from the shared buckets if both have enough left.
+
+    Returns 0 on success, otherwise the seconds until enough budget has refilled.
+    """
+    # (bucket, capacity per minute, amount needed); a request can't need more than a full bucket
+    buckets = [(name, limit, min(need, limit)) for name, limit, need in
+               (("requests", LLM_RPM_LIMIT, 1), ("tokens", LLM_TPM_LIMIT, tokens)) if limit > 0]
+    if not buckets:
+        return 0.0
+    with _limiter_connection() as conn:
+        # Take the write lock so concurrent processes see each other's withdrawals
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            stored = {name: (level, updated) for name, level, updated in conn.execute('SELECT name, level, updated FROM rate_buckets')}
+            levels, wait = {}, 0.0
+            for name, limit, need in buckets:
+                # Buckets start full and refill continuously at limit / 60 per second
+                level, updated = stored.get(name, (limit, now))
+                levels[name] = min(limit, level + (now - updated) * limit / 60)
+                # Lower priority requests keep off the reserve, unless they could never fit otherwise
+                floor = min(limit * reserve, limit - need)
+                if levels[name] - need < floor:
+                    wait = max(wait, (need + floor - levels[name]) * 60 / limit)
+            if wait == 0:
+                for name, limit, need in buckets:
+                    levels[name] -= need
+            conn.executemany('INSERT OR REPLACE INTO rate_buckets (name, level, updated) VALUES (?, ?, ?)',
+                             [(name, level, now) for name, level in levels.items()])
+            conn.execute('COMMIT')
+            return wait
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+
+def acquire(tokens: int, timeout: float = LLM_RATE_LIMIT_MAX_WAIT):
+    """
+    Wait until the shared RPM/TPM budget allows a request of `tokens` tokens, then take it.
+
+    Requests with REGRADE priority leave LOW_PRIORITY_RESERVE of each budget untouched, so
+    student submissions still get through while re-grades are running.
+
+    Raises:
+        RateLimitTimeout: If the budget does not allow the request within `timeout` seconds.
+    """
+    reserve = LOW_PRIORITY_RESERVE if current_priority() > STUDENT else 0.0
+    deadline = time.monotonic() + timeout
+    waited = 0.0
+    while True:
+        wait = _try_acquire(tokens, reserve)
+        if wait == 0:
+            break
+        if time.monotonic() + wait > deadline:
+            raise RateLimitTimeout(f"No LLM budget for a {tokens} token request within {timeout:.0f}s")
+        # Jitter spreads out waiters that would otherwise retry at the same moment
+        delay = wait * random.uniform(1.0, 1.2)
+        time.sleep(delay)
+        waited += delay
+    with _stats_lock:
+        _stats["requests"] += 1
+        if waited:
+            _stats["waits"] += 1
+            _stats["waited_seconds"] += waited
+
+def limiter_stats() -> Dict[str, float]:
+    """Return this process's number of admitted requests, how many had to wait and for how long in total."""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,156 @@
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List
+import database as db
+import metrics
+import rate_limiter
+import submission_manager
+from evaluation import evaluate_answers_batch
+from grading import grade_multiple_choice
+from utils import load_questions
+
+# Re-grading of the stored answers to a question whose reference answer (or correct options)
+# changed. Answers are graded in chunks of REGRADE_CHUNK_SIZE, at most REGRADE_MAX_WORKERS
+# chunks at a time, with lower priority than student submissions (see rate_limiter).
+REGRADE_MAX_WORKERS = int(os.getenv("REGRADE_MAX_WORKERS", "4"))
+REGRADE_CHUNK_SIZE = int(os.getenv("REGRADE_CHUNK_SIZE", "25"))
+
+# Re-grades of this process by (teacher ID, exam ID, question ID)
+_jobs: Dict[tuple, Dict[str, Any]] = {}
+# Chunks of grades stored by this process's re-grades, by (teacher ID, exam ID)
+_versions: Dict[tuple, int] = {}
+_jobs_lock = threading.Lock()
+
+def affected_answers(teacher_id: str, exam_id: int, question_id: int) -> List[Dict[str, Any]]:
+    """Return the ID and answer of every graded answer to a question; unanswered questions and other questions are not included."""
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT a.id, a.answer FROM submission_answers a JOIN submissions s ON s.id = a.submission_id
+            WHERE s.teacher_id = ? AND s.exam_id = ? AND s.status = 'graded' AND a.question_id = ?
+            ORDER BY a.id
+            ''', (teacher_id, exam_id, question_id))
+            rows = [(row['id'], json.loads(row['answer'])) for row in cursor.fetchall() if row['answer'] is not None]
+    except sqlite3.Error:
+        return []
+    return [{"id": answer_id, "answer": answer} for answer_id, answer in rows if answer is not None]
+
+def _grade_chunk(q_text: str, q_data: Dict[str, Any], chunk: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """Grade a chunk of answers to the same question, keyed by answer ID."""
+    if q_data["type"] == "Multiple Choice":
+        return {item["id"]: grade_multiple_choice(item["answer"], q_data["correct"]) for item in chunk}
+    try:
+        # One request for the whole chunk instead of one per answer
+        return evaluate_answers_batch(q_text, q_data["reference"], {item["id"]: item["answer"] for item in chunk}, q_data.get("subject"))
+    except Exception as e:
+        print(f"Re-grade error: {e}")
+        return {item["id"]: {"correct": False, "score": 0, "feedback": "Error in evaluation", "error": True} for item in chunk}
+
+def _grading_unchanged(cursor: sqlite3.Cursor, q_text: str, q_data: Dict[str, Any]) -> bool:
+    """Whether the question is still graded the way the re-grade assumes: same text, reference answer and correct options."""
+    cursor.execute('SELECT question_text, reference, correct_option FROM questions WHERE id = ?', (q_data["id"],))
+    row = cursor.fetchone()
+    if row is None or row['question_text'] != q_text:
+        return False
+    if q_data["type"] == "Multiple Choice":
+        return json.loads(row['correct_option'] or '[]') == q_data.get("correct", [])
+    return row['reference'] == q_data.get("reference")
+
+def _store_grades(job: Dict[str, Any], q_text: str, q_data: Dict[str, Any], grades: List[tuple]) -> bool:
+    """
+    Store a chunk's grades unless the re-grade was cancelled or its question changed meanwhile.
+
+    Both are checked under the write lock, in the transaction that stores the grades, so a
+    chunk of a superseded re-grade can never overwrite grades against a newer reference answer.
+    """
+    try:
+        with db.db_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if job["cancel"].is_set() or not _grading_unchanged(conn.cursor(), q_text, q_data):
+                job["cancel"].set()  # Stale: the remaining chunks are not stored either
+                return False
+            # Commits this connection's transaction, so the check and the write are atomic
+            return submission_manager.update_answer_grades(grades)
+    except sqlite3.Error:
+        return False
+
+def _run(job: Dict[str, Any], teacher_id: str, exam_id: int, q_text: str, q_data: Dict[str, Any], answers: List[Dict[str, Any]]):
+    """Re-grade the answers chunk by chunk, storing each chunk's grades as soon as it is done."""
+    chunks = [answers[start:start + REGRADE_CHUNK_SIZE] for start in range(0, len(answers), REGRADE_CHUNK_SIZE)]
+    with rate_limiter.priority(rate_limiter.REGRADE), metrics.exam_context(teacher_id, exam_id):
+        with ThreadPoolExecutor(max_workers=REGRADE_MAX_WORKERS) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, _grade_chunk, q_text, q_data, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                if job["cancel"].is_set():
+                    # Chunks already being graded finish, the others never start
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                results = future.result()
+                # Failed answers keep their previous grade
+                grades = [(answer_id, result) for answer_id, result in results.items() if not result.get("error")]
+                if not _store_grades(job, q_text, q_data, grades):
+                    if job["cancel"].is_set():
+                        continue  # Cancelled or superseded while this chunk was being graded
+                    grades = []
+                elif grades:
+                    with _jobs_lock:
+                        _versions[(teacher_id, str(exam_id))] = _versions.get((teacher_id, str(exam_id)), 0) + 1
+                job["done"] += len(results)
+                job["failed"] += len(results) - len(grades)
+    job["status"] = "done" if job["done"] == job["total"] else "cancelled"
+
+def start_regrade(teacher_id: str, exam_id: int, question_id: int) -> int:
+    """
+    Re-grade every stored answer to a question on a background thread.
+
+    Only the affected answers are updated, and each submission's total_score changes by the
+    difference of its re-graded scores. A re-grade still running for the same question is
+    cancelled first.
+
+    Returns:
+        int: The number of answers being re-graded.
+    """
+    questions = load_questions(teacher_id, exam_id)
+    q_text = next((text for text, data in questions.items() if data['id'] == question_id), None)
+    if q_text is None:
+        return 0
+    answers = affected_answers(teacher_id, exam_id, question_id)
+
+    key = (teacher_id, str(exam_id), question_id)
+    job = {"question": q_text, "total": len(answers), "done": 0, "failed": 0, "status": "running", "cancel": threading.Event()}
+    with _jobs_lock:
+        if key in _jobs:
+            _jobs[key]["cancel"].set()
+        _jobs[key] = job
+    threading.Thread(target=_run, args=(job, teacher_id, exam_id, q_text, questions[q_text], answers), daemon=True).start()
+    return len(answers)
+
+def cancel_regrade(teacher_id: str, exam_id: int, question_id: int):
+    """Stop a running re-grade; answers already re-graded keep their new grades."""
+    with _jobs_lock:
+        job = _jobs.get((teacher_id, str(exam_id), question_id))
+    if job is not None:
+        job["cancel"].set()
+
+def regrade_jobs(teacher_id: str, exam_id: int) -> Dict[int, Dict[str, Any]]:
+    """Return the progress of an exam's re-grades by question ID: question, total, done, failed and status."""
+    with _jobs_lock:
+        return {key[2]: {name: value for name, value in job.items() if name != "cancel"}
+                for key, job in _jobs.items() if key[:2] == (teacher_id, str(exam_id))}
+
+def grades_version(teacher_id: str, exam_id: int) -> int:
+    """Return a counter that changes whenever a re-grade stores new grades for the exam, so cached scores can be refreshed."""
+    with _jobs_lock:
+        return _versions.get((teacher_id, str(exam_id)), 0)
+
+def clear_finished(teacher_id: str, exam_id: int):
+    """Forget an exam's finished and cancelled re-grades."""
+    with _jobs_lock:
+        for key in [key for key, job in _jobs.items() if key[:2] == (teacher_id, str(exam_id)) and job["status"] != "running"]:
+            del _jobs[key]
@@ -1,38 +1,415 @@
+import hashlib
 import json
+import os
 import sqlite3
+import time
+import analytics
 import database as db
-from typing import List, Dict, Any
+import metrics
+from typing import List, Dict, Any, Optional, Tuple
+
+# Submissions are stored as a header row (student, scores, status) in `submissions`
+# plus one row per answered question in `submission_answers`.
+
+# Seconds a submission reserved by the student page (status "grading") may stay ungraded
+# before it is considered abandoned, e.g. by a crashed server, and graded again
+GRADING_LEASE = float(os.getenv("SUBMIT_GRADING_LEASE", "300"))
+
+def _build_submissions(headers: List[sqlite3.Row], answer_rows: List[sqlite3.Row]) -> List[Dict[str, Any]]:
+    """Assemble header and answer rows into submission dictionaries."""
+    submissions = {}
+    for row in headers:
+        submissions[row['id']] = {
+            "id": row['id'],
+            "student_name": row['student_name'],
+            "answers": {},
+            "evaluations": {},
+            "total_score": row['total_score'],
+            "max_score": row['max_score'],
+            "status": row['status']
+        }
+    for row in answer_rows:
+        submission = submissions.get(row['submission_id'])
+        if submission is None:
+            continue
+        submission['answers'][row['question_text']] = json.loads(row['answer']) if row['answer'] is not None else None
+        # Answers without a score were not evaluated (yet)
+        if row['score'] is not None:
+            submission['evaluations'][row['question_text']] = {
+                "correct": bool(row['correct']),
+                "score": row['score'],
+                "feedback": row['feedback']
+            }
+    return list(submissions.values())
+
+def _insert_answers(cursor: sqlite3.Cursor, submission_id: int, teacher_id: str, exam_id: int, submission: Dict[str, Any]):
+    """Insert one row per answer of a submission."""
+    # Link answers to their question IDs for indexed per-question queries
+    cursor.execute('SELECT question_text, id FROM questions WHERE teacher_id = ? AND exam_id = ?', (teacher_id, exam_id))
+    question_ids = {row['question_text']: row['id'] for row in cursor.fetchall()}
+    evaluations = submission.get('evaluations', {})
+    cursor.executemany('''
+    INSERT INTO submission_answers (submission_id, question_id, question_text, position, answer, score, correct, feedback)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (submission_id, question_ids.get(q_text), q_text, position, json.dumps(answer, ensure_ascii=False),
+         evaluations.get(q_text, {}).get('score'), evaluations.get(q_text, {}).get('correct'),
+         evaluations.get(q_text, {}).get('feedback'))
+        for position, (q_text, answer) in enumerate(submission.get('answers', {}).items())
+    ])
+
+def _stored_scores(cursor: sqlite3.Cursor, submission_id: int) -> Dict[str, Dict[str, Any]]:
+    """Return the stored per-question scores of a submission."""
+    cursor.execute('SELECT question_text, score FROM submission_answers WHERE submission_id = ? AND score IS NOT NULL',
+                   (submission_id,))
+    return {row['question_text']: {"score": row['score']} for row in cursor.fetchall()}
 
 # Function to retrieve exam submissions from database
+@metrics.timed("db")
 def load_submissions(teacher_id: str, exam_id: int) -> List[Dict[str, Any]]:
     """Load submissions for a specific exam."""
     try:
-        with db.db_connection() as conn:  # Using context manager for auto-closing connection
+        with db.db_connection() as conn:
             cursor = conn.cursor()
-            # Query to fetch submission data based on teacher and exam IDs
-            cursor.execute('SELECT submission_data FROM submissions WHERE teacher_id = ? AND exam_id = ?', 
-                          (teacher_id, exam_id))
-            # Convert JSON strings back to Python dictionaries for each submission
-            return [json.loads(row['submission_data']) for row in cursor.fetchall()]
+            # Fetch the submission headers and all their answers with two indexed queries
+            cursor.execute('''
+            SELECT id, student_name, total_score, max_score, status FROM submissions
+            WHERE teacher_id = ? AND exam_id = ? ORDER BY id
+            ''', (teacher_id, exam_id))
+            headers = cursor.fetchall()
+            cursor.execute('''
+            SELECT a.submission_id, a.question_text, a.answer, a.score, a.correct, a.feedback
+            FROM submission_answers a JOIN submissions s ON s.id = a.submission_id
+            WHERE s.teacher_id = ? AND s.exam_id = ? ORDER BY a.submission_id, a.position
+            ''', (teacher_id, exam_id))
+            return _build_submissions(headers, cursor.fetchall())
     except sqlite3.Error:
         # Return empty list if database operation fails
         return []
 
+# Function to retrieve a single submission, e.g. to poll its grading status
+@metrics.timed("db")
+def load_submission(submission_id: int) -> Optional[Dict[str, Any]]:
+    """Load one submission by its ID."""
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT id, teacher_id, exam_id, student_name, total_score, max_score, status FROM submissions WHERE id = ?
+            ''', (submission_id,))
+            header = cursor.fetchone()
+            if header is None:
+                return None
+            cursor.execute('''
+            SELECT submission_id, question_text, answer, score, correct, feedback
+            FROM submission_answers WHERE submission_id = ? ORDER BY position
+            ''', (submission_id,))
+            submission = _build_submissions([header], cursor.fetchall())[0]
+            submission.update(teacher_id=header['teacher_id'], exam_id=header['exam_id'])
+            return submission
+    except sqlite3.Error:
+        return None
+
+# Function to look up an exam attempt that was already submitted, e.g. by a double click or a refresh
+@metrics.timed("db")
+def find_submission(teacher_id: str, exam_id: int, key: str) -> Optional[Dict[str, Any]]:
+    """Load the submission stored with the given idempotency key (see submission_key), or None."""
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM submissions WHERE teacher_id = ? AND exam_id = ? AND idempotency_key = ?',
+                           (teacher_id, exam_id, key))
+            row = cursor.fetchone()
+    except sqlite3.Error:
+        return None
+    return load_submission(row['id']) if row is not None else None
+
+# Function to list the scores of an exam without loading any answers
+@metrics.timed("db")
+def load_score_list(teacher_id: str, exam_id: int) -> List[Dict[str, Any]]:
+    """Load the student name, scores and status of every submission of an exam."""
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT id, student_name, total_score, max_score, status, created_at FROM submissions
+            WHERE teacher_id = ? AND exam_id = ? ORDER BY id
+            ''', (teacher_id, exam_id))
+            return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error:
+        return []
+
+# Function to aggregate scores per question in SQL
+@metrics.timed("db")
+def question_statistics(teacher_id: str, exam_id: int) -> List[Dict[str, Any]]:
+    """Return the number of graded answers and the average, lowest and highest score of each question."""
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT a.question_id, a.question_text, COUNT(a.score) AS answers, AVG(a.score) AS average_score,
+                   MIN(a.score) AS min_score, MAX(a.score) AS max_score
+            FROM submission_answers a JOIN submissions s ON s.id = a.submission_id
+            WHERE s.teacher_id = ? AND s.exam_id = ?
+            GROUP BY a.question_text ORDER BY MIN(a.position)
+            ''', (teacher_id, exam_id))
+            return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error:
+        return []
+
+def _with_answers(cursor: sqlite3.Cursor, headers: List[sqlite3.Row], with_answers: bool = True) -> List[Dict[str, Any]]:
+    """Fetch the answers of the given submission headers and assemble the submissions, or return just the headers."""
+    if not with_answers:
+        return [dict(row) for row in headers]
+    if not headers:
+        return []
+    placeholders = ", ".join("?" for _ in headers)
+    cursor.execute(f'''
+    SELECT submission_id, question_text, answer, score, correct, feedback FROM submission_answers
+    WHERE submission_id IN ({placeholders}) ORDER BY submission_id, position
+    ''', [row['id'] for row in headers])
+    return _build_submissions(headers, cursor.fetchall())
+
+# Sort orders of the submission feed: SQL ordering and the keyset condition that continues after a row
+FEED_SORTS = {
+    "time": ("id DESC", "id < ?", lambda sub: (sub['id'],)),
+    "score": ("total_score DESC, id DESC", "(total_score < ? OR (total_score = ? AND id < ?))",
+              lambda sub: (sub['total_score'], sub['total_score'], sub['id'])),
+}
+
+# Function to page through an exam's submissions without loading all of them
+@metrics.timed("db")
+def load_submission_page(teacher_id: str, exam_id: int, sort_by: str = "time", after: Optional[Dict[str, Any]] = None, limit: int = 20,
+                         with_answers: bool = True) -> List[Dict[str, Any]]:
+    """
+    Load one page of an exam's submissions, newest or highest score first.
+
+    Pages are keyset based: pass the last submission of the previous page as `after`
+    to get the next one, which stays correct while new submissions keep arriving.
+    With `with_answers` False only the header rows (no answers) are loaded.
+    """
+    order_sql, after_sql, after_params = FEED_SORTS[sort_by]
+    query = 'SELECT id, student_name, total_score, max_score, status, created_at FROM submissions WHERE teacher_id = ? AND exam_id = ?'
+    params = [teacher_id, exam_id]
+    if after is not None:
+        query += f' AND {after_sql}'
+        params.extend(after_params(after))
+    query += f' ORDER BY {order_sql} LIMIT ?'
+    params.append(limit)
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            return _with_answers(cursor, cursor.fetchall(), with_answers)
+    except sqlite3.Error:
+        return []
+
+# Function to fetch only the submissions that arrived after a known one
+@metrics.timed("db")
+def load_new_submissions(teacher_id: str, exam_id: int, after_id: int, limit: int = 100, with_answers: bool = True) -> List[Dict[str, Any]]:
+    """Load submissions with an ID greater than `after_id` (the feed cursor), oldest first."""
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT id, student_name, total_score, max_score, status, created_at FROM submissions
+            WHERE teacher_id = ? AND exam_id = ? AND id > ? ORDER BY id LIMIT ?
+            ''', (teacher_id, exam_id, after_id, limit))
+            return _with_answers(cursor, cursor.fetchall(), with_answers)
+    except sqlite3.Error:
+        return []
+
+# Function to refresh specific submissions, e.g. those still being graded
+@metrics.timed("db")
+def load_submissions_by_ids(submission_ids: List[int], with_answers: bool = True) -> List[Dict[str, Any]]:
+    """Load the given submissions."""
+    if not submission_ids:
+        return []
+    placeholders = ", ".join("?" for _ in submission_ids)
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+            SELECT id, student_name, total_score, max_score, status, created_at FROM submissions WHERE id IN ({placeholders}) ORDER BY id
+            ''', list(submission_ids))
+            return _with_answers(cursor, cursor.fetchall(), with_answers)
+    except sqlite3.Error:
+        return []
+
+# Function to get the feed cursor of an exam
+@metrics.timed("db")
+def latest_submission_id(teacher_id: str, exam_id: int) -> int:
+    """Return the highest submission ID of an exam, or 0 if it has none."""
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT MAX(id) FROM submissions WHERE teacher_id = ? AND exam_id = ?', (teacher_id, exam_id))
+            return cursor.fetchone()[0] or 0
+    except sqlite3.Error:
+        return 0
+
+def submission_key(teacher_id: str, exam_id: int, student_name: str, answers: Dict[str, Any]) -> str:
+    """Return the idempotency key of an exam attempt: a hash of the exam, the student and their answers."""
+    content = json.dumps([teacher_id, str(exam_id), student_name.strip(), answers], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def _insert_submission(cursor: sqlite3.Cursor, teacher_id: str, exam_id: int, submission: Dict[str, Any], status: str) -> Tuple[int, bool]:
+    """
+    Insert a submission's header, answers, analytics and grading job.
+
+    A submission whose `idempotency_key` is already stored is not inserted again.
+    Returns the submission's ID and whether it was inserted (False for the stored one).
+    """
+    key = submission.get('idempotency_key')
+    if key is not None:
+        cursor.execute('SELECT id FROM submissions WHERE teacher_id = ? AND exam_id = ? AND idempotency_key = ?',
+                       (teacher_id, exam_id, key))
+        existing = cursor.fetchone()
+        if existing is not None:
+            return existing['id'], False
+    now = time.time()
+    # Insert the submission header, then one row per answer
+    cursor.execute('''
+    INSERT INTO submissions (teacher_id, exam_id, student_name, submission_data, total_score, max_score, status, created_at,
+                             idempotency_key, grading_started_at)
+    VALUES (?, ?, ?, '{}', ?, ?, ?, ?, ?, ?)
+    ''', (teacher_id, exam_id, submission['student_name'], submission.get('total_score', 0),
+          submission.get('max_score', 0), status, now, key, now if status == "grading" else None))
+    submission_id = cursor.lastrowid
+    _insert_answers(cursor, submission_id, teacher_id, exam_id, submission)
+    if status == "graded":
+        # Keep the exam's analytics summary up to date in the same transaction
+        analytics.record_submission(cursor, teacher_id, exam_id, submission.get('evaluations', {}),
+                                    submission.get('total_score', 0), submission.get('max_score', 0))
+    if status == "pending":
+        cursor.execute('INSERT INTO grading_jobs (submission_id, available_at) VALUES (?, ?)',
+                      (submission_id, now))
+    return submission_id, True
+
 # Function to store new exam submissions in database
-def save_submission(teacher_id: str, exam_id: int, submission: Dict[str, Any]) -> bool:
-    """Save a submission for a specific exam."""
-    try:
-        with db.db_connection() as conn:  # Using context manager for auto-closing connection
-            cursor = conn.cursor()
-            # Convert submission dictionary to JSON string for storage
-            submission_json = json.dumps(submission, ensure_ascii=False)  # Allow non-ASCII characters
-            # Insert submission details into database
-            cursor.execute(''' 
-            INSERT INTO submissions (teacher_id, exam_id, student_name, submission_data)
-            VALUES (?, ?, ?, ?)
-            ''', (teacher_id, exam_id, submission['student_name'], submission_json))
+@metrics.timed("db")
+def save_submission(teacher_id: str, exam_id: int, submission: Dict[str, Any], status: str = "graded") -> Optional[int]:
+    """
+    Save a submission for a specific exam.
+
+    A submission saved with status "pending" is queued for the background grader
+    in the same transaction, so it can't be stored without its grading job.
+    Returns the new submission ID, or None if the database operation fails.
+    Concurrent student submits should go through submission_writer.submit, which
+    batches them into shared transactions.
+    """
+    try:
+        with db.db_connection() as conn:
+            submission_id, _ = _insert_submission(conn.cursor(), teacher_id, exam_id, submission, status)
             conn.commit()  # Commit the transaction
-            return True  # Return success
+            return submission_id  # Return the new submission ID
+    except sqlite3.Error:
+        # Return None if database operation fails
+        return None
+
+# Function to grade a submission again after its grading failed or was abandoned
+@metrics.timed("db")
+def claim_submission(submission_id: int, queue_job: bool = False) -> bool:
+    """
+    Take over a failed submission, or one reserved for grading longer than GRADING_LEASE, to grade it again.
+
+    The claim is atomic, so only one caller gets it. The submission becomes "grading" for the
+    caller to grade itself, or "pending" with a fresh job for the background grader (`queue_job`).
+    Its grading_started_at restarts the lease; created_at keeps the student's submit time.
+    Returns False if the submission can't be claimed (e.g. someone else is grading it).
+    """
+    now = time.time()
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            UPDATE submissions SET status = ?, grading_started_at = ?
+            WHERE id = ? AND (status = 'failed' OR (status = 'grading' AND grading_started_at < ?))
+            ''', ("pending" if queue_job else "grading", now, submission_id, now - GRADING_LEASE))
+            if cursor.rowcount == 0:
+                return False
+            if queue_job:
+                cursor.execute('''
+                INSERT INTO grading_jobs (submission_id, available_at) VALUES (?, ?)
+                ON CONFLICT (submission_id) DO UPDATE SET status = 'queued', attempts = 0, last_error = NULL,
+                    available_at = excluded.available_at, locked_until = NULL
+                ''', (submission_id, now))
+            conn.commit()
+            return True
+    except sqlite3.Error:
+        return False
+
+# Function to store the grades of a submission graded in the background
+@metrics.timed("db")
+def update_submission_grades(submission_id: int, evaluations: Dict[str, Dict[str, Any]], total_score: int, max_score: int, status: str = "graded") -> bool:
+    """Store the evaluations and scores of an existing submission."""
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT teacher_id, exam_id, status, total_score, max_score FROM submissions WHERE id = ?', (submission_id,))
+            previous = cursor.fetchone()
+            if previous is None:
+                return False
+            if previous['status'] == 'graded':
+                # Take the previous grades out of the exam's analytics before replacing them
+                analytics.record_submission(cursor, previous['teacher_id'], previous['exam_id'], _stored_scores(cursor, submission_id),
+                                            previous['total_score'], previous['max_score'], sign=-1)
+            cursor.execute('UPDATE submissions SET total_score = ?, max_score = ?, status = ? WHERE id = ?',
+                          (total_score, max_score, status, submission_id))
+            cursor.executemany('''
+            UPDATE submission_answers SET score = ?, correct = ?, feedback = ?
+            WHERE submission_id = ? AND question_text = ?
+            ''', [(evaluation['score'], evaluation.get('correct'), evaluation.get('feedback'), submission_id, q_text)
+                  for q_text, evaluation in evaluations.items()])
+            if status == 'graded':
+                analytics.record_submission(cursor, previous['teacher_id'], previous['exam_id'], _stored_scores(cursor, submission_id),
+                                            total_score, max_score)
+            conn.commit()
+            return True
+    except sqlite3.Error:
+        return False
+
+# Function to store the new grades of individual answers, e.g. after a reference answer was corrected
+@metrics.timed("db")
+def update_answer_grades(grades: List[Tuple[int, Dict[str, Any]]]) -> bool:
+    """
+    Replace the grades of individual answers, given as (answer ID, evaluation) pairs.
+
+    Each submission's total_score changes by the difference between its old and new scores,
+    so its other answers and all other submissions are left untouched.
+    """
+    if not grades:
+        return True
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            placeholders = ", ".join("?" for _ in grades)
+            cursor.execute(f'''
+            SELECT a.id, a.submission_id, a.score, s.teacher_id, s.exam_id, s.status, s.total_score, s.max_score
+            FROM submission_answers a JOIN submissions s ON s.id = a.submission_id WHERE a.id IN ({placeholders})
+            ''', [answer_id for answer_id, _ in grades])
+            rows = {row['id']: row for row in cursor.fetchall()}
+            by_submission = {}
+            for answer_id, evaluation in grades:
+                if answer_id in rows:
+                    by_submission.setdefault(rows[answer_id]['submission_id'], []).append((rows[answer_id], evaluation))
+
+            for submission_id, items in by_submission.items():
+                header = items[0][0]
+                graded = header['status'] == 'graded'
+                if graded:
+                    # Swap the submission's old grades for the new ones in the exam's analytics
+                    analytics.record_submission(cursor, header['teacher_id'], header['exam_id'], _stored_scores(cursor, submission_id),
+                                                header['total_score'], header['max_score'], sign=-1)
+                cursor.executemany('UPDATE submission_answers SET score = ?, correct = ?, feedback = ? WHERE id = ?',
+                                   [(evaluation['score'], evaluation.get('correct'), evaluation.get('feedback'), row['id'])
+                                    for row, evaluation in items])
+                delta = sum(evaluation['score'] - (row['score'] or 0) for row, evaluation in items)
+                cursor.execute('UPDATE submissions SET total_score = total_score + ? WHERE id = ?', (delta, submission_id))
+                if graded:
+                    analytics.record_submission(cursor, header['teacher_id'], header['exam_id'], _stored_scores(cursor, submission_id),
+                                                header['total_score'] + delta, header['max_score'])
+            conn.commit()
+            return True
     except sqlite3.Error:
-        # Return False if database operation fails
-        return False
\ No newline at end of file
+        return False
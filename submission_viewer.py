@@ -1,8 +1,123 @@
+import tempfile
+from datetime import datetime
+from typing import Any, Mapping
 import streamlit as st
+import export_results
+import regrade
 import submission_manager
 import utils
 from streamlit_autorefresh import st_autorefresh
 
+# Number of submissions fetched per page
+FEED_PAGE_SIZE = 20
+# Sort options of the viewer, mapped to the feed's sort orders
+SORT_OPTIONS = {"Newest first": "time", "Highest score": "score"}
+
+def _load_feed(teacher_id: str, exam_id: int, sort_by: str) -> dict:
+    """
+    Keep the loaded submissions' summaries (no answers) in session state and fetch only what changed.
+
+    The first visit loads one page; later reruns (auto-refresh, widget clicks) only fetch
+    submissions newer than the feed cursor and re-check those still being graded or failed,
+    or every loaded one after a re-grade stored new grades.
+    """
+    key = f"submission_feed_{teacher_id}_{exam_id}"
+    feed = st.session_state.get(key)
+    if feed is None or feed["sort_by"] != sort_by:
+        # Remember where the feed starts, then load the first page in the chosen order
+        cursor = submission_manager.latest_submission_id(teacher_id, exam_id)
+        version = regrade.grades_version(teacher_id, exam_id)
+        page = submission_manager.load_submission_page(teacher_id, exam_id, sort_by, limit=FEED_PAGE_SIZE, with_answers=False)
+        feed = {
+            "sort_by": sort_by,
+            "cursor": cursor,
+            "regrade_version": version,
+            "rows": {sub['id']: sub for sub in page},
+            "last": page[-1] if page else None,
+            "exhausted": len(page) < FEED_PAGE_SIZE
+        }
+        st.session_state[key] = feed
+        return feed
+
+    # Append submissions that arrived since the last refresh
+    new_rows = submission_manager.load_new_submissions(teacher_id, exam_id, feed["cursor"], with_answers=False)
+    if new_rows:
+        feed["rows"].update((sub['id'], sub) for sub in new_rows)
+        feed["cursor"] = new_rows[-1]['id']
+        st.success(f"{len(new_rows)} new submission(s) received! ✅")
+
+    # Refresh the grades of submissions still being graded, and of failed ones, which a resubmit grades again under the same ID
+    pending = [sub_id for sub_id, sub in feed["rows"].items() if sub.get('status') in ('pending', 'grading', 'failed')]
+    version = regrade.grades_version(teacher_id, exam_id)
+    if version != feed["regrade_version"]:
+        # A re-grade changed scores in place: the loaded rows' totals are stale
+        pending = list(feed["rows"])
+        feed["regrade_version"] = version
+    feed["rows"].update((sub['id'], sub) for sub in submission_manager.load_submissions_by_ids(pending, with_answers=False))
+    return feed
+
+def _load_next_page(teacher_id: str, exam_id: int, feed: dict):
+    """Fetch the page after the last one loaded."""
+    page = submission_manager.load_submission_page(teacher_id, exam_id, feed["sort_by"], after=feed["last"], limit=FEED_PAGE_SIZE,
+                                                   with_answers=False)
+    feed["rows"].update((sub['id'], sub) for sub in page)
+    if page:
+        feed["last"] = page[-1]
+    feed["exhausted"] = len(page) < FEED_PAGE_SIZE
+
+def _export_file(teacher_id: str, exam_id: int, fmt: str) -> bytes:
+    """Export an exam's results through a temporary file, chunk by chunk."""
+    with tempfile.TemporaryFile() as handle:
+        export_results.export_results(teacher_id, exam_id, handle, fmt)
+        handle.seek(0)
+        return handle.read()
+
+def _score_label(sub: dict) -> str:
+    """Describe a submission's score, or its grading status if it has none yet."""
+    # Submissions still queued for the background grader or being graded by the student page have no score yet
+    status = sub.get('status', 'graded')
+    if status in ('pending', 'grading'):
+        return "Grading... ⏳"
+    if status == 'failed':
+        return "Grading failed ⚠️"
+    return f"{sub['total_score']}/{sub['max_score']}"
+
+def _display_submission(sub: dict, questions: Mapping[str, Mapping[str, Any]]):
+    """Show one submission's answers and scores, with a widget per answer."""
+    if sub is None:
+        st.error("This submission could not be loaded. ⚠️")
+        return
+    idx = sub['id']
+    try:
+        # Display submission header with styling
+        st.markdown(f"<h3 style='color: #4CAF50;'>Submission Details</h3>", unsafe_allow_html=True)
+        st.markdown(f"<p style='font-size: 16px;'><b>Total Score:</b> <span style='color: #2196F3;'>{sub['total_score']} / {sub['max_score']}</span></p>", unsafe_allow_html=True)
+
+        # Create a bordered container for submission details
+        with st.container(border=True):
+            st.write(f"## {sub['student_name']}'s Submission")
+            st.markdown(f"<p style='font-weight: bold; font-size: 16px;'>Student Name: <span style='color:#009688;'>{sub['student_name']}</span></p>", unsafe_allow_html=True)
+
+            # Display each question and its answer
+            for q_text, answer in sub['answers'].items():
+                st.write(f"\n**Question:** {q_text}")
+                # Handle different question types (Short Answer vs Multiple Choice)
+                if questions[q_text]['type'] == "Short Answer":
+                    st.text_area("Answer:", value=answer if isinstance(answer, str) else ", ".join(answer), key=f"sub_{idx}_{q_text}", disabled=True)
+                else:
+                    st.multiselect("Answer:", questions[q_text]['options'], default=answer if isinstance(answer, list) else [answer], key=f"sub_{idx}_{q_text}", disabled=True)
+
+                # Display question score if evaluated
+                if q_text in sub['evaluations']:
+                    eval_data = sub['evaluations'][q_text]
+                    st.markdown(f"**Score:** <span style='color: #009688;'>{eval_data['score']}/10</span>", unsafe_allow_html=True)
+
+    # Error handling for malformed submission data
+    except KeyError:
+        st.error(f"Error in submission data of submission {idx}. ⚠️")
+    except Exception as e:
+        st.error(f"Failed to process submission: {str(e)} ⚠️")
+
 def display_submission_viewer(teacher_id: str, selected_exam_id: int, exams: dict):
     # Display the exam title as a subheader
     st.subheader(f"Submissions for {exams[selected_exam_id]}")
@@ -14,56 +129,56 @@ def display_submission_viewer(teacher_id: str, selected_exam_id: int, exams: dic
     if st.button("Refresh Submissions 🔄"):
         st.rerun()
 
-    # Load all submissions for the selected exam and its questions
-    submissions = submission_manager.load_submissions(teacher_id, selected_exam_id)
-    questions = utils.load_questions(teacher_id, selected_exam_id)
-    
-    # Track the number of submissions to detect new ones
-    if "last_submission_count" not in st.session_state:
-        st.session_state["last_submission_count"] = len(submissions)
-    
-    # Show notification when new submissions are received
-    if len(submissions) > st.session_state["last_submission_count"]:
-        st.success("New submission received! ✅")
-        st.session_state["last_submission_count"] = len(submissions)
+    # Export every result, one row per student, without loading the submissions into the viewer
+    with st.expander("Export results"):
+        export_format = st.radio("Format:", export_results.EXPORT_FORMATS, horizontal=True, key=f"export_format_{selected_exam_id}")
+        st.download_button(
+            "Download results ⬇️",
+            # Generated only when the button is clicked
+            data=lambda: _export_file(teacher_id, selected_exam_id, export_format),
+            file_name=f"{exams[selected_exam_id]}_results.{export_format}",
+            mime="text/csv" if export_format == "csv" else "application/octet-stream",
+            key=f"export_download_{selected_exam_id}"
+        )
+
+    # Load new and still-grading submissions into the cached feed
+    sort_label = st.selectbox("Sort by", list(SORT_OPTIONS), key=f"submissions_sort_{selected_exam_id}")
+    sort_by = SORT_OPTIONS[sort_label]
+    feed = _load_feed(teacher_id, selected_exam_id, sort_by)
+
+    # Show the loaded submissions in the chosen order
+    if sort_by == "score":
+        submissions = sorted(feed["rows"].values(), key=lambda sub: (sub['total_score'], sub['id']), reverse=True)
+    else:
+        submissions = sorted(feed["rows"].values(), key=lambda sub: sub['id'], reverse=True)
 
     if submissions:
-        # Iterate through each submission
-        for idx, sub in enumerate(submissions):
-            # Skip invalid submission entries
-            if not isinstance(sub, dict):
-                continue
-            try:
-                # Create expandable section for each submission with student info and score
-                with st.expander(f"Student: {sub['student_name']} - Score: {sub['total_score']}/{sub['max_score']}"):
-                    # Display submission header with styling
-                    st.markdown(f"<h3 style='color: #4CAF50;'>Submission Details</h3>", unsafe_allow_html=True)
-                    st.markdown(f"<p style='font-size: 16px;'><b>Total Score:</b> <span style='color: #2196F3;'>{sub['total_score']} / {sub['max_score']}</span></p>", unsafe_allow_html=True)
-                    
-                    # Create a bordered container for submission details
-                    with st.container(border=True):
-                        st.write(f"## {sub['student_name']}'s Submission")
-                        st.markdown(f"<p style='font-weight: bold; font-size: 16px;'>Student Name: <span style='color:#009688;'>{sub['student_name']}</span></p>", unsafe_allow_html=True)
-                        
-                        # Display each question and its answer
-                        for q_text, answer in sub['answers'].items():
-                            st.write(f"\n**Question:** {q_text}")
-                            # Handle different question types (Short Answer vs Multiple Choice)
-                            if questions[q_text]['type'] == "Short Answer":
-                                st.text_area("Answer:", value=answer if isinstance(answer, str) else ", ".join(answer), key=f"sub_{idx}_{q_text}", disabled=True)
-                            else:
-                                st.multiselect("Answer:", questions[q_text]['options'], default=answer if isinstance(answer, list) else [answer], key=f"sub_{idx}_{q_text}", disabled=True)
-                            
-                            # Display question score if evaluated
-                            if q_text in sub['evaluations']:
-                                eval_data = sub['evaluations'][q_text]
-                                st.markdown(f"**Score:** <span style='color: #009688;'>{eval_data['score']}/10</span>", unsafe_allow_html=True)
-            
-            # Error handling for malformed submission data
-            except KeyError:
-                st.error(f"Error in submission data at index {idx}. Skipping this entry. ⚠️")
-            except Exception as e:
-                st.error(f"Failed to process submission: {str(e)} ⚠️")
+        # One compact table row per submission; answers are loaded only for the submission being opened
+        st.dataframe([
+            {
+                "Student": sub['student_name'],
+                "Score": _score_label(sub),
+                "Submitted": datetime.fromtimestamp(sub['created_at']) if sub.get('created_at') else None
+            }
+            for sub in submissions
+        ], hide_index=True)
+
+        # Selected by ID, so the open submission stays open while new ones arrive
+        names = {sub['id']: sub['student_name'] for sub in submissions}
+        selected_id = st.selectbox(
+            "Open submission:", [None] + list(names),
+            format_func=lambda sub_id: "Select a student..." if sub_id is None else f"{names[sub_id]} (#{sub_id})",
+            key=f"submission_open_{selected_exam_id}"
+        )
+        if selected_id is not None:
+            # The questions are only needed to render an opened submission; the cached snapshot avoids a query per rerun
+            questions = utils.load_exam_snapshot(teacher_id, selected_exam_id)
+            _display_submission(submission_manager.load_submission(selected_id), questions)
+
+        # Fetch older pages only when asked
+        if not feed["exhausted"] and st.button("Load more submissions", key=f"submissions_more_{selected_exam_id}"):
+            _load_next_page(teacher_id, selected_exam_id, feed)
+            st.rerun()
     else:
         # Display message when no submissions are available
         st.write("No submissions yet.")
\ No newline at end of file
@@ -0,0 +1,162 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Dict, Any, List, Optional, Tuple
+import database as db
+import metrics
+import submission_manager
+
+# Group commit of student submissions: instead of every Streamlit session taking the SQLite
+# write lock for its own transaction, submits are handed to one writer thread per process,
+# which stores everything that arrived within SUBMIT_FLUSH_INTERVAL in a single transaction.
+# Callers block until their submission is committed, so a returned ID is always durable.
+
+# Longest a submit waits for others to join its batch (seconds), and the most submissions per transaction
+SUBMIT_FLUSH_INTERVAL = float(os.getenv("SUBMIT_FLUSH_INTERVAL", "0.01"))
+SUBMIT_BATCH_SIZE = int(os.getenv("SUBMIT_BATCH_SIZE", "200"))
+# Longest a submission waits in the queue before the caller withdraws it and reports a failure (seconds)
+SUBMIT_WRITE_TIMEOUT = float(os.getenv("SUBMIT_WRITE_TIMEOUT", "30"))
+# Attempts at committing a batch while another process holds the write lock
+SUBMIT_COMMIT_ATTEMPTS = int(os.getenv("SUBMIT_COMMIT_ATTEMPTS", "3"))
+
+# Pending writes: (teacher ID, exam ID, submission, status, future receiving the submission ID and whether it was inserted)
+_queue: "queue.Queue[Tuple[str, int, Dict[str, Any], str, Future]]" = queue.Queue()
+_writer: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+_stats = {"submissions": 0, "batches": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+def _ensure_writer():
+    """Start the writer thread on the first submit."""
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_run, name="submission-writer", daemon=True)
+            _writer.start()
+
+def _next_batch() -> List[Tuple[str, int, Dict[str, Any], str, Future]]:
+    """Wait for a submission, then collect the ones arriving within the flush interval."""
+    batch = [_queue.get()]
+    deadline = time.monotonic() + SUBMIT_FLUSH_INTERVAL
+    while len(batch) < SUBMIT_BATCH_SIZE:
+        try:
+            batch.append(_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+        except queue.Empty:
+            break
+    return batch
+
+def _write_batch(batch: List[Tuple[str, int, Dict[str, Any], str, Future]]) -> List[Optional[Tuple[int, bool]]]:
+    """
+    Store a batch in one transaction.
+
+    Each submission is written inside its own savepoint, so one that fails (e.g. a malformed
+    submission) is left out without failing the rest. Returns the ID of each submission and whether
+    it was inserted (see submission_manager._insert_submission), or None for those that failed;
+    raises sqlite3.Error if the transaction itself could not be committed.
+    """
+    with db.db_connection() as conn:
+        cursor = conn.cursor()
+        # Take the write lock up front, so the batch can't fail halfway on a lock upgrade
+        cursor.execute('BEGIN IMMEDIATE')
+        results = []
+        for teacher_id, exam_id, submission, status, _ in batch:
+            cursor.execute('SAVEPOINT submission')
+            try:
+                results.append(submission_manager._insert_submission(cursor, teacher_id, exam_id, submission, status))
+            except (sqlite3.Error, KeyError, TypeError):
+                cursor.execute('ROLLBACK TO submission')
+                results.append(None)
+            cursor.execute('RELEASE submission')
+        conn.commit()
+        return results
+
+def _commit(batch: List[Tuple[str, int, Dict[str, Any], str, Future]]):
+    """Write a batch, retrying while the write lock is busy, and hand each caller its result."""
+    # Submissions their callers withdrew after SUBMIT_WRITE_TIMEOUT are skipped; the rest can't be withdrawn anymore
+    batch = [item for item in batch if item[-1].set_running_or_notify_cancel()]
+    if not batch:
+        return
+    results, error = [None] * len(batch), None
+    for _ in range(SUBMIT_COMMIT_ATTEMPTS):
+        try:
+            results = _write_batch(batch)
+            break
+        except sqlite3.Error as e:
+            # Another process held the write lock for longer than DB_TIMEOUT
+            error = f"{type(e).__name__}: {e}"
+    else:
+        print(f"Submission batch error: {error}")
+        metrics.record("error", "submission_writer", error=error)
+    for (*_, future), result in zip(batch, results):
+        future.set_result(result)
+    with _stats_lock:
+        _stats["submissions"] += len(batch)
+        _stats["batches"] += 1
+        _stats["failed"] += results.count(None)
+
+def _run():
+    """Writer loop: commit batches until the process exits."""
+    # An fsync per batch rather than per submission makes full durability affordable
+    db.get_connection().execute('PRAGMA synchronous = FULL')
+    while True:
+        batch = _next_batch()
+        try:
+            _commit(batch)
+        except Exception as e:
+            # Fail this batch's callers but keep the writer alive for the next submits
+            print(f"Submission writer error: {e}")
+            metrics.record("error", "submission_writer", error=f"{type(e).__name__}: {e}")
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+def _submit(teacher_id: str, exam_id: int, submission: Dict[str, Any], status: str) -> Optional[Tuple[int, bool]]:
+    """Queue a submission for the writer and wait for its result (see submit)."""
+    _ensure_writer()
+    future = Future()
+    _queue.put((teacher_id, exam_id, submission, status, future))
+    try:
+        try:
+            return future.result(timeout=SUBMIT_WRITE_TIMEOUT)
+        except FutureTimeout:
+            if future.cancel():
+                return None  # Withdrawn from the queue: the writer will skip it
+            return future.result()  # Already being written: wait for the outcome
+    except Exception:
+        # The writer failed the batch (and recorded why)
+        return None
+
+@metrics.timed("db")
+def submit(teacher_id: str, exam_id: int, submission: Dict[str, Any], status: str = "graded") -> Optional[int]:
+    """
+    Save a submission through the writer thread and wait until it is committed.
+
+    Takes the same arguments as submission_manager.save_submission. Returns the new
+    submission ID once it is durably stored, or None if it was not stored and never will be:
+    it failed, or was still queued after SUBMIT_WRITE_TIMEOUT seconds and has been withdrawn.
+    A submission the writer has already started on is waited for, so None never hides a
+    submission that commits later.
+    """
+    result = _submit(teacher_id, exam_id, submission, status)
+    return result[0] if result is not None else None
+
+@metrics.timed("db")
+def reserve(teacher_id: str, exam_id: int, submission: Dict[str, Any]) -> Optional[Tuple[int, bool]]:
+    """
+    Store a submission with status "grading" before grading it, to reserve its idempotency key.
+
+    Returns the submission ID and whether this call reserved it: False means the same
+    submission was already stored, e.g. by a second click, and must not be graded again.
+    Returns None if it could not be stored.
+    """
+    return _submit(teacher_id, exam_id, submission, "grading")
+
+def writer_stats() -> Dict[str, Any]:
+    """Return this process's submissions written, batches committed, failures and mean batch size."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["mean_batch"] = stats["submissions"] / stats["batches"] if stats["batches"] else 0.0
+    return stats
@@ -1,9 +1,14 @@
 import json
 import urllib.parse
 import database as db
-from typing import Dict, Any
+import exam_cache
+import grading_cache
+import metrics
+from evaluation import detect_subject
+from typing import Dict, Any, Optional, List, Mapping
 import sqlite3
 
+@metrics.timed("db")
 def load_questions(teacher_id: str, exam_id: int) -> Dict[str, Dict[str, Any]]:
     """Load questions for a specific exam."""
     # Main function to retrieve questions from database for a specific teacher and exam
@@ -12,8 +17,8 @@ def load_questions(teacher_id: str, exam_id: int) -> Dict[str, Dict[str, Any]]:
             cursor = conn.cursor()
             # SQL query to get all question details for the specified exam
             cursor.execute(''' 
-            SELECT question_text, question_type, question_number, reference, options, correct_option 
-            FROM questions WHERE teacher_id = ? AND exam_id = ?
+            SELECT id, question_text, question_type, question_number, reference, options, correct_option, subject 
+            FROM questions WHERE teacher_id = ? AND exam_id = ? ORDER BY id
             ''', (teacher_id, exam_id))
             
             questions = {}
@@ -21,14 +26,17 @@ def load_questions(teacher_id: str, exam_id: int) -> Dict[str, Dict[str, Any]]:
             for row in cursor.fetchall():
                 # Create basic question data structure
                 question_data = {
+                    "id": row['id'],
                     "type": row['question_type'],
                     "Question Number": row['question_number']
                 }
                 
                 # Handle different question types
                 if row['question_type'] == "Short Answer":
-                    # For short answer questions, include reference answer
+                    # For short answer questions, include reference answer and its stored subject
                     question_data["reference"] = row['reference']
+                    if row['subject']:
+                        question_data["subject"] = row['subject']
                 elif row['question_type'] == "Multiple Choice":
                     # For multiple choice, parse options and correct answers from JSON
                     question_data["options"] = json.loads(row['options']) if row['options'] else []
@@ -41,46 +49,245 @@ def load_questions(teacher_id: str, exam_id: int) -> Dict[str, Dict[str, Any]]:
     except sqlite3.Error:
         return {}
 
+@metrics.timed("db")
+def exam_version(teacher_id: str, exam_id: int) -> int:
+    """Return the version of an exam's question set, bumped by every question write."""
+    try:
+        with db.db_connection() as conn:
+            row = conn.execute('SELECT version FROM exams WHERE id = ? AND teacher_id = ?', (exam_id, teacher_id)).fetchone()
+            return row['version'] if row else 0
+    except sqlite3.Error:
+        return 0
+
+@metrics.timed("db")
+def load_exam_snapshot(teacher_id: str, exam_id: int) -> Mapping[str, Mapping[str, Any]]:
+    """
+    Load an exam's questions through the process-wide snapshot cache.
+
+    Returns the same read-only mapping while the exam's version is unchanged, so page
+    reruns don't query the questions again. Use load_questions for a copy to edit.
+    """
+    return exam_cache.get_snapshot(teacher_id, exam_id,
+                                   lambda: exam_version(teacher_id, exam_id),
+                                   lambda: load_questions(teacher_id, exam_id))
+
+def _bump_exam_version(cursor: sqlite3.Cursor, teacher_id: str, exam_id: int):
+    """Mark the exam's cached snapshots as stale, inside the transaction that changes its questions."""
+    cursor.execute('UPDATE exams SET version = version + 1 WHERE id = ? AND teacher_id = ?', (exam_id, teacher_id))
+
+def _classify_questions(questions: Dict[str, Dict[str, Any]]):
+    """Detect the subject of short answer questions that don't have one yet."""
+    # Classify new short answer questions once here, so grading doesn't have to
+    # detect the subject again for every student's answer. A failed detection leaves
+    # the subject NULL, so backfill_subjects classifies the question again later.
+    for question_text, data in questions.items():
+        if data['type'] == "Short Answer" and not data.get('subject'):
+            data['subject'] = detect_subject(question_text)
+
+def _question_values(question_text: str, data: Dict[str, Any]) -> tuple:
+    """Column values of a question: text, type, number, reference, options, correct options and subject."""
+    # Handle correct options for multiple choice questions
+    if data['type'] == "Multiple Choice":
+        correct_options = json.dumps(data.get('correct', []))
+    else:
+        correct_options = None
+    return (
+        question_text,
+        data['type'],
+        data.get('Question Number', 'General'),
+        data.get('reference'),
+        json.dumps(data.get('options', [])),
+        correct_options,
+        data.get('subject')
+    )
+
+def _upsert_rows(cursor: sqlite3.Cursor, teacher_id: str, exam_id: int, questions: Dict[str, Dict[str, Any]]):
+    """Insert or update the given questions (matched by question text) on the caller's transaction."""
+    # Cached grades of questions whose reference answer changes are stale now
+    cursor.execute('SELECT question_text, reference FROM questions WHERE teacher_id = ? AND exam_id = ?',
+                  (teacher_id, exam_id))
+    for row in cursor.fetchall():
+        if row['question_text'] in questions and questions[row['question_text']].get('reference') != row['reference']:
+            grading_cache.invalidate_question(row['question_text'])
+
+    # Insert or update all questions with a single statement
+    cursor.executemany('''
+        INSERT INTO questions
+        (teacher_id, exam_id, question_text, question_type, question_number, reference, options, correct_option, subject)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (teacher_id, exam_id, question_text) DO UPDATE SET
+            question_type = excluded.question_type,
+            question_number = excluded.question_number,
+            reference = excluded.reference,
+            options = excluded.options,
+            correct_option = excluded.correct_option,
+            subject = excluded.subject
+    ''', [(teacher_id, exam_id) + _question_values(question_text, data) for question_text, data in questions.items()])
+
+def _delete_rows(cursor: sqlite3.Cursor, teacher_id: str, exam_id: int, question_ids: List[int]):
+    """Delete questions by ID on the caller's transaction."""
+    # Drop the cached grades of the deleted questions
+    placeholders = ", ".join("?" for _ in question_ids)
+    cursor.execute(f'SELECT question_text FROM questions WHERE teacher_id = ? AND exam_id = ? AND id IN ({placeholders})',
+                  [teacher_id, exam_id] + list(question_ids))
+    for row in cursor.fetchall():
+        grading_cache.invalidate_question(row['question_text'])
+
+    cursor.executemany('DELETE FROM questions WHERE id = ? AND teacher_id = ? AND exam_id = ?',
+                      [(question_id, teacher_id, exam_id) for question_id in question_ids])
+
+@metrics.timed("db")
+def upsert_questions(teacher_id: str, exam_id: int, questions: Dict[str, Dict[str, Any]]) -> bool:
+    """
+    Insert new questions or update existing ones (matched by question text) in one transaction.
+
+    Only the given questions are written, and existing questions keep their IDs.
+    """
+    _classify_questions(questions)
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            _upsert_rows(cursor, teacher_id, exam_id, questions)
+            _bump_exam_version(cursor, teacher_id, exam_id)
+            conn.commit()
+        exam_cache.invalidate(teacher_id, exam_id)
+        return True
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return False
+
+@metrics.timed("db")
+def update_question(teacher_id: str, exam_id: int, question_id: int, question_text: str, data: Dict[str, Any]) -> bool:
+    """Update one question by ID, keeping its ID even when its text changes."""
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT question_text, reference, subject FROM questions WHERE id = ? AND teacher_id = ? AND exam_id = ?',
+                          (question_id, teacher_id, exam_id))
+            current = cursor.fetchone()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return False
+    if current is None:
+        return False
+
+    if current['question_text'] != question_text or current['reference'] != data.get('reference'):
+        grading_cache.invalidate_question(current['question_text'])
+    # The stored subject still applies while the question text is unchanged
+    if current['question_text'] == question_text and not data.get('subject'):
+        data['subject'] = current['subject']
+    _classify_questions({question_text: data})
+
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE questions SET question_text = ?, question_type = ?, question_number = ?, reference = ?,
+                    options = ?, correct_option = ?, subject = ?
+                WHERE id = ? AND teacher_id = ? AND exam_id = ?
+            ''', _question_values(question_text, data) + (question_id, teacher_id, exam_id))
+            updated = cursor.rowcount > 0
+            _bump_exam_version(cursor, teacher_id, exam_id)
+            conn.commit()
+        exam_cache.invalidate(teacher_id, exam_id)
+        return updated
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return False
+
+@metrics.timed("db")
+def delete_questions(teacher_id: str, exam_id: int, question_ids: List[int]) -> bool:
+    """Delete questions by ID in one transaction."""
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            _delete_rows(cursor, teacher_id, exam_id, question_ids)
+            _bump_exam_version(cursor, teacher_id, exam_id)
+            conn.commit()
+        exam_cache.invalidate(teacher_id, exam_id)
+        return True
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return False
+
+@metrics.timed("db")
 def save_questions(teacher_id: str, exam_id: int, questions: Dict[str, Dict[str, Any]]) -> bool:
-    """Save questions for a specific exam."""
+    """
+    Save the full question set of a specific exam in one transaction.
+
+    Only the difference to what is stored is written: removed questions are deleted
+    and new or changed ones are upserted, so unchanged questions keep their IDs.
+    The given question dicts are not modified.
+    """
+    current = load_questions(teacher_id, exam_id)
+    removed = [data['id'] for question_text, data in current.items() if question_text not in questions]
+
+    def without_id(data: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in data.items() if key != 'id'}
+
+    # Work on copies: the editor keeps the caller's dicts in session state
+    questions = {question_text: dict(data) for question_text, data in questions.items()}
+    # Keep stored subjects of unchanged question texts instead of classifying them again
+    for question_text, data in questions.items():
+        if question_text in current and current[question_text].get('subject'):
+            data.setdefault('subject', current[question_text]['subject'])
+    changed = {question_text: data for question_text, data in questions.items()
+               if question_text not in current or without_id(current[question_text]) != without_id(data)}
+    if not removed and not changed:
+        return True
+    # Classify before taking the write lock, which the model requests would otherwise hold
+    _classify_questions(changed)
     try:
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        # First delete existing questions for this exam
-        cursor.execute('DELETE FROM questions WHERE teacher_id = ? AND exam_id = ?', 
-                      (teacher_id, exam_id))
-        
-        # Insert each question into database
-        for question_text, data in questions.items():
-            # Handle correct options for multiple choice questions
-            if data['type'] == "Multiple Choice":
-                correct_options = json.dumps(data.get('correct', []))
-            else:
-                correct_options = None
-                
-            # Insert new question with all its details
-            cursor.execute(''' 
-                INSERT INTO questions 
-                (teacher_id, exam_id, question_text, question_type, question_number, reference, options, correct_option)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                teacher_id,
-                exam_id,
-                question_text,
-                data['type'],
-                data.get('Question Number', 'General'),
-                data.get('reference'),
-                json.dumps(data.get('options', [])),
-                correct_options
-            ))
-        conn.commit()
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            # Deletes and upserts commit together, so a failure can't leave the exam half saved
+            cursor.execute('BEGIN IMMEDIATE')
+            if removed:
+                _delete_rows(cursor, teacher_id, exam_id, removed)
+            if changed:
+                _upsert_rows(cursor, teacher_id, exam_id, changed)
+            _bump_exam_version(cursor, teacher_id, exam_id)
+            conn.commit()
+        exam_cache.invalidate(teacher_id, exam_id)
         return True
     except sqlite3.Error as e:
         print(f"Database error: {e}")
         return False
-    finally:
-        # Ensure connection is closed even if error occurs
-        conn.close()
+
+def backfill_subjects(teacher_id: Optional[str] = None, exam_id: Optional[int] = None) -> int:
+    """
+    Detect and store the subject of short answer questions that have none: saved before subjects
+    were tracked, or whose detection failed. Returns the number of questions classified.
+    """
+    try:
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            # Find unclassified questions, optionally limited to one teacher or exam
+            query = "SELECT id, teacher_id, exam_id, question_text FROM questions WHERE question_type = 'Short Answer' AND subject IS NULL"
+            params = []
+            if teacher_id is not None:
+                query += ' AND teacher_id = ?'
+                params.append(teacher_id)
+            if exam_id is not None:
+                query += ' AND exam_id = ?'
+                params.append(exam_id)
+            rows = cursor.execute(query, params).fetchall()
+
+            # Classify each question and store the result right away so an interrupted run can resume
+            classified = 0
+            for row in rows:
+                subject = detect_subject(row['question_text'])
+                if subject is None:
+                    continue  # Still unknown; left for the next run
+                classified += 1
+                cursor.execute('UPDATE questions SET subject = ? WHERE id = ?', (subject, row['id']))
+                _bump_exam_version(cursor, row['teacher_id'], row['exam_id'])
+                conn.commit()
+                exam_cache.invalidate(row['teacher_id'], row['exam_id'])
+            return classified
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return 0
 
 def generate_exam_link(teacher_id: str, exam_id: str) -> str:
     """Generate a unique exam link with proper URL encoding."""